@@ -1,5 +1,8 @@
 from django.contrib import admin
-from .models import OrdenUIState, EmpleadoResponsable
+from .models import (
+    OrdenUIState, OrdenUIStateArchivo, EmpleadoResponsable, ErpDocumento, ErpMirrorEstado, ResumenError,
+    ResumenFinalizacion,
+)
 
 @admin.register(OrdenUIState)
 class OrdenUIStateAdmin(admin.ModelAdmin):
@@ -12,3 +15,30 @@ class EmpleadoResponsableAdmin(admin.ModelAdmin):
     list_display = ("nombre", "activo")
     list_filter = ("activo",)
     search_fields = ("nombre",)
+
+@admin.register(ErpDocumento)
+class ErpDocumentoAdmin(admin.ModelAdmin):
+    list_display = ("doc_id", "folio", "cliente", "fecha_creacion", "pend_u", "total_u", "almacen_calc", "abierto", "synced_at")
+    list_filter = ("abierto",)
+    search_fields = ("doc_id", "folio", "cliente")
+
+@admin.register(ErpMirrorEstado)
+class ErpMirrorEstadoAdmin(admin.ModelAdmin):
+    list_display = ("nombre", "watermark", "last_sync_at", "last_success_at")
+
+@admin.register(ResumenFinalizacion)
+class ResumenFinalizacionAdmin(admin.ModelAdmin):
+    list_display = ("fecha", "almacen", "vendedor", "bucket", "finalizados", "minutos_total")
+    list_filter = ("almacen",)
+    date_hierarchy = "fecha"
+
+@admin.register(ResumenError)
+class ResumenErrorAdmin(admin.ModelAdmin):
+    list_display = ("fecha", "responsable", "errores", "resueltos")
+    date_hierarchy = "fecha"
+
+@admin.register(OrdenUIStateArchivo)
+class OrdenUIStateArchivoAdmin(admin.ModelAdmin):
+    list_display = ("doc_id", "folio", "fecha_finalizacion", "has_error", "error_responsable", "archived_at")
+    list_filter = ("has_error", "error_resuelto")
+    search_fields = ("doc_id", "folio",)
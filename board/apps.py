@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class BoardConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'board'
+
+    def ready(self):
+        # Registra las señales de los resúmenes (rollup.fold_deleted_responsable)
+        from .services import rollup  # noqa: F401
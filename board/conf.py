@@ -0,0 +1,96 @@
+from django.conf import settings
+
+# Valores por defecto del tablero; cualquiera se sobreescribe en settings.py
+# con el prefijo BOARD_ (ej. BOARD_ORDERS_CACHE_TTL = 30).
+DEFAULTS = {
+    # --- Cache de snapshots del ERP ---
+    "CACHE_ALIAS": "default",
+    "ORDERS_CACHE_TTL": 20,            # segundos que un snapshot se considera fresco
+    "ORDERS_CACHE_STALE_TTL": 300,     # segundos extra que se sirve "viejo" mientras otro refresca
+    "ORDERS_CACHE_MAX_ENTRIES": 64,    # combinaciones de filtros distintas guardadas
+    "ORDERS_CACHE_LOCK_TIMEOUT": 30,   # candado de refresco (anti-estampida)
+
+    # --- Protección del ERP (circuit breaker + timeouts) ---
+    "ERP_QUERY_TIMEOUT": 15,           # segundos por query (pyodbc); 0 = sin límite
+    "ERP_BREAKER_THRESHOLD": 3,        # fallas seguidas que abren el circuito...
+    "ERP_BREAKER_WINDOW": 60,          # ...dentro de esta ventana (s)
+    "ERP_BREAKER_OPEN": 30,            # segundos abierto antes de dejar pasar una prueba
+    "ORDERS_CACHE_KEEP_ON_ERROR": 3600,  # cuánto se conserva el último snapshot bueno si el ERP falla
+
+    # --- Gateway del ERP (concurrencia y conexiones) ---
+    # (la conexión persistente va en DATABASES["erp"]: CONN_MAX_AGE / CONN_HEALTH_CHECKS)
+    "ERP_MAX_CONCURRENT": 4,           # queries simultáneos al ERP (global solo con cache compartido); 0 = sin límite
+    "ERP_QUEUE_TIMEOUT": 10,           # segundos máximos en cola antes de ErpBusy
+    "ERP_CONN_CHECK_INTERVAL": 30,     # cada cuánto se revisa (rota / obsoleta) la conexión de cada hilo
+
+    # --- Filtro por doc_ids en el ERP ---
+    "ERP_DOC_ID_BUCKETS": (8, 32, 128, 512),  # tamaños de IN (...) permitidos; el mayor = tamaño de bloque
+    "ERP_CHUNK_WORKERS": 4,                   # hilos para bloques independientes
+    "ERP_FETCH_SIZE": 500,                    # filas por fetchmany (se arman al vuelo, sin fetchall)
+
+    # --- Cache de partidas (fetch_items_many) ---
+    "ITEMS_CACHE_TTL": 900,            # segundos; además se invalida si cambia pend_u
+    "ITEMS_CACHE_MAX_ENTRIES": 2000,   # documentos con partidas en cache
+    "ITEMS_PREFETCH": True,            # precargar en segundo plano las partidas del tablero visible
+    "ITEMS_PREFETCH_CHUNK": 500,       # doc_ids por query de precarga
+
+    # --- Cache de fragmentos HTML por tarjeta (_card.html) ---
+    "CARD_FRAGMENT_CACHE": True,       # False = renderizar siempre cada tarjeta
+    "CARD_FRAGMENT_TTL": 3600,         # segundos; la llave cambia sola cuando cambia la tarjeta
+    "CARD_FRAGMENT_MAX_ENTRIES": 5000, # fragmentos guardados (los más viejos se expulsan)
+    "CARD_FRAGMENT_VERSION": "3",      # subirlo al cambiar _card.html invalida todo
+
+    # --- Historial ('pasados') ---
+    "PAST_PAGE_SIZE": 100,             # tarjetas por página (keyset por fecha_finalizacion/doc_id)
+    "ARCHIVE_AFTER_DAYS": 180,         # finalizadas más viejas pasan a OrdenUIStateArchivo
+    "ARCHIVE_BATCH": 1000,             # filas movidas por transacción al archivar
+
+    # --- Impresión masiva ---
+    "PRINT_MAX_ORDERS": 500,           # tope de órdenes por documento
+    "PRINT_STREAM_CHUNK": 50,          # órdenes por query mientras se va enviando el documento
+
+    # --- Exportación del historial (CSV / XLSX) ---
+    "EXPORT_CHUNK": 500,               # doc_ids por query al ERP (y filas por vuelta del cursor local)
+    "EXPORT_MAX_DAYS": 366,            # rango máximo de fechas de finalización por export
+
+    # --- Finalizar / reabrir en bloque (multi-selección) ---
+    "BULK_MAX_ORDERS": 200,            # tope de órdenes por POST
+
+    # --- Polling incremental de tarjetas (since) ---
+    "DELTA_MAX_GAP": 600,              # si el cliente trae un 'since' más viejo, render completo
+    "DELTA_MAX_CARDS": 60,             # demasiados cambios juntos -> render completo
+
+    # --- Espejo local de admDocumentos ---
+    "ORDERS_SOURCE": "erp",            # "erp" (directo) o "mirror" (tabla ErpDocumento)
+    "MIRROR_BATCH": 1000,              # documentos nuevos por query incremental
+    "MIRROR_RECHECK_DAYS": 30,         # antigüedad máxima de pedidos abiertos a re-verificar
+    "MIRROR_INTERVAL": 30,             # segundos entre pasadas con --loop
+    "MIRROR_RECONCILE_INTERVAL": 3600,  # segundos entre reconciliaciones completas con --loop
+    "MIRROR_MAX_LAG": 300,             # lag (s) a partir del cual el espejo se reporta no sano
+
+    # --- Índice local de búsqueda (folio / cliente) ---
+    "SEARCH_INDEX": False,             # índice local en vez de LIKE en el ERP (activar tras build_search_index)
+    "SEARCH_MAX_RESULTS": 500,         # doc_ids máximos que una búsqueda manda al ERP
+    "SEARCH_SUGGEST_LIMIT": 8,         # sugerencias del typeahead
+    "SEARCH_INDEX_BATCH": 1000,        # documentos por query al reconstruir el índice
+
+    # --- Métricas (/metrics, Prometheus) ---
+    "METRICS_ENABLED": True,           # histogramas compartidos en el cache (un par de incr por medición)
+    "METRICS_SERVER_TIMING": False,    # cabecera Server-Timing por request (devtools del navegador)
+    "METRICS_TOKEN": None,             # si se define, /metrics acepta "Authorization: Bearer <token>" sin sesión
+
+    # --- Benchmarks (comando bench_board) ---
+    "BENCH_BASELINE": "bench_baseline.json",  # línea base (relativa a BASE_DIR)
+    "BENCH_THRESHOLD": 0.25,           # mediana 25 % más lenta que la base = regresión...
+    "BENCH_MIN_DELTA_MS": 2.0,         # ...y al menos 2 ms más lenta (ruido de los rápidos)
+    "BENCH_REPEAT": 5,                 # repeticiones medidas por benchmark
+
+    # --- Canal SSE (push a los tableros) ---
+    "EVENTS_POLL": 0.5,                # cada cuánto el watcher de cada proceso revisa la versión
+    "EVENTS_KEEPALIVE": 25,            # comentario ": keepalive" para que proxies no corten
+    "EVENTS_BOARD_TTL": 900,           # segundos que un tablero visto sigue refrescándose para SSE
+}
+
+
+def get(name):
+    return getattr(settings, f"BOARD_{name}", DEFAULTS[name])
@@ -0,0 +1,25 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from board import conf
+from board.services import archive
+
+
+class Command(BaseCommand):
+    help = (
+        "Mueve a OrdenUIStateArchivo las órdenes finalizadas hace más de N días; el historial "
+        "las sigue mostrando y la tabla caliente queda chica."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--days", type=int, default=None, help="Antigüedad mínima (default BOARD_ARCHIVE_AFTER_DAYS).")
+        parser.add_argument("--batch", type=int, default=None, help="Filas por transacción (default BOARD_ARCHIVE_BATCH).")
+        parser.add_argument("--dry-run", action="store_true", help="Solo contar cuántas se moverían.")
+
+    def handle(self, *args, **opts):
+        started = time.monotonic()
+        days = conf.get("ARCHIVE_AFTER_DAYS") if opts["days"] is None else opts["days"]
+        moved = archive.archive_finalized(days=days, batch=opts["batch"], dry_run=opts["dry_run"])
+        verb = "por_archivar" if opts["dry_run"] else "archivadas"
+        self.stdout.write(f"{verb}={moved} antes_de={archive.cutoff(days):%Y-%m-%d} ({time.monotonic() - started:.2f}s)")
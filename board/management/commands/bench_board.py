@@ -0,0 +1,72 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from board import conf
+from board.services import bench
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmarks del tablero (fetch_orders, build_cards, fetch_items y vistas) contra un ERP "
+        "de reemplazo en SQLite con N documentos; compara contra la línea base guardada."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--docs", type=int, nargs="+", default=[1000],
+            help=f"Tamaños del ERP a generar (ej. --docs {' '.join(map(str, bench.SIZES))}).",
+        )
+        parser.add_argument("--only", nargs="+", default=None, help="Prefijos de benchmarks (ej. erp. view.kpis).")
+        parser.add_argument("--repeat", type=int, default=None, help="Repeticiones medidas (default BOARD_BENCH_REPEAT).")
+        parser.add_argument("--warmup", type=int, default=1, help="Repeticiones previas sin medir.")
+        parser.add_argument("--data-dir", default=None, help="Reutilizar aquí los ERP generados (erp_standin_<n>.sqlite3).")
+        parser.add_argument("--baseline", default=None, help="Archivo de línea base (default BOARD_BENCH_BASELINE).")
+        parser.add_argument("--save-baseline", action="store_true", help="Guardar estos resultados como línea base.")
+        parser.add_argument("--threshold", type=float, default=None, help="Fracción de regresión (default BOARD_BENCH_THRESHOLD).")
+        parser.add_argument("--list", action="store_true", help="Solo listar los benchmarks.")
+
+    def handle(self, *args, **opts):
+        benchmarks = bench.select(opts["only"])
+        if opts["list"]:
+            for b in benchmarks:
+                self.stdout.write(b.name)
+            return
+        if not benchmarks:
+            raise CommandError("Ningún benchmark coincide con --only.")
+
+        path = bench.baseline_path(opts["baseline"])
+        baseline = bench.load_baseline(path)
+        repeat = opts["repeat"] or conf.get("BENCH_REPEAT")
+
+        def progress(n_docs, name, result):
+            base = baseline.get(str(n_docs), {}).get(name)
+            vs = f"  (base {base['median_ms']:.1f} ms)" if base else ""
+            self.stdout.write(
+                f"{n_docs:>7} {name:<34} {result['median_ms']:>9.1f} ms  "
+                f"min {result['min_ms']:.1f}  max {result['max_ms']:.1f}{vs}"
+            )
+
+        results = {}
+        for n_docs in opts["docs"]:
+            started = time.monotonic()
+            results[n_docs] = bench.run(
+                n_docs, benchmarks, repeat=repeat, warmup=opts["warmup"],
+                data_dir=opts["data_dir"], verbosity=max(0, opts["verbosity"] - 1), progress=progress,
+            )
+            self.stdout.write(f"-- {n_docs} documentos ({time.monotonic() - started:.1f}s)")
+
+        if opts["save_baseline"]:
+            bench.save_baseline(path, results, baseline)
+            self.stdout.write(self.style.SUCCESS(f"Línea base guardada en {path}"))
+            return
+
+        if not baseline:
+            self.stdout.write(f"Sin línea base en {path}; usa --save-baseline para crearla.")
+            return
+        regressions = bench.compare(results, baseline, threshold=opts["threshold"])
+        for n_docs, name, before, now, change in regressions:
+            self.stderr.write(f"REGRESIÓN {n_docs} {name}: {before:.1f} -> {now:.1f} ms (+{change:.0%})")
+        if regressions:
+            raise CommandError(f"{len(regressions)} benchmark(s) más lentos que la línea base.")
+        self.stdout.write(self.style.SUCCESS("Sin regresiones contra la línea base."))
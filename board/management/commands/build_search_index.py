@@ -0,0 +1,28 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from board import conf
+from board.services.erp import fetch_orders_after
+from board.services.search import rebuild
+
+
+class Command(BaseCommand):
+    help = (
+        "Llena el índice local de búsqueda (folio / cliente) con los pedidos del ERP. "
+        "Después de la primera corrida completa se activa con BOARD_SEARCH_INDEX = True."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch", type=int, default=None, help="Documentos por query (default BOARD_SEARCH_INDEX_BATCH).")
+        parser.add_argument("--start", type=int, default=0, help="Continuar después de este CIDDOCUMENTO.")
+
+    def handle(self, *args, **opts):
+        started = time.monotonic()
+        batch = opts["batch"] or conf.get("SEARCH_INDEX_BATCH")
+
+        def fetch_batch(after, limit):
+            return fetch_orders_after(after, limit=limit, fail_silently=False)
+
+        total, last = rebuild(fetch_batch, batch=batch, start=opts["start"])
+        self.stdout.write(f"indexados={total} ultimo_doc_id={last} ({time.monotonic() - started:.2f}s)")
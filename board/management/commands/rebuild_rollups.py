@@ -0,0 +1,31 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from board.services import rollup
+from board.services.erp import fetch_orders
+
+
+class Command(BaseCommand):
+    help = (
+        "Recalcula los resúmenes de finalización / errores desde OrdenUIState; antes llena "
+        "almacén / vendedor (desde el ERP) de las finalizadas que no los tienen."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch", type=int, default=500, help="Documentos por query al ERP en el backfill.")
+        parser.add_argument("--skip-backfill", action="store_true", help="No consultar el ERP; solo recalcular.")
+
+    def handle(self, *args, **opts):
+        started = time.monotonic()
+        filled = 0
+        if not opts["skip_backfill"]:
+            def fetch_rows(doc_ids):
+                return fetch_orders(doc_ids=doc_ids, fail_silently=False)
+
+            filled = rollup.backfill_dimensions(fetch_rows, batch=opts["batch"])
+        fin_rows, err_rows = rollup.rebuild()
+        self.stdout.write(
+            f"dimensiones={filled} resumen_finalizacion={fin_rows} resumen_error={err_rows} "
+            f"({time.monotonic() - started:.2f}s)"
+        )
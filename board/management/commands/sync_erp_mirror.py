@@ -0,0 +1,47 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from board import conf
+from board.services.mirror import sync_mirror
+
+
+class Command(BaseCommand):
+    help = "Sincroniza el espejo local de admDocumentos (ErpDocumento) de forma incremental."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--loop", action="store_true", help="No terminar: sincronizar cada --interval segundos.")
+        parser.add_argument("--interval", type=int, default=None, help="Segundos entre pasadas (default BOARD_MIRROR_INTERVAL).")
+        parser.add_argument("--batch", type=int, default=None, help="Documentos nuevos por query (default BOARD_MIRROR_BATCH).")
+        parser.add_argument(
+            "--reconcile", action="store_true",
+            help="Re-verificar todos los documentos recientes, no solo los abiertos (con --loop se hace "
+                 "cada BOARD_MIRROR_RECONCILE_INTERVAL segundos).",
+        )
+
+    def handle(self, *args, **opts):
+        interval = opts["interval"] or conf.get("MIRROR_INTERVAL")
+        reconcile_every = conf.get("MIRROR_RECONCILE_INTERVAL")
+        last_reconcile = None
+        while True:
+            started = time.monotonic()
+            reconcile = opts["reconcile"] or (
+                opts["loop"] and (last_reconcile is None or started - last_reconcile >= reconcile_every)
+            )
+            try:
+                result = sync_mirror(batch=opts["batch"], reconcile=reconcile)
+            except Exception as exc:
+                if not opts["loop"]:
+                    raise
+                self.stderr.write(f"Error en sync: {exc}")
+            else:
+                if reconcile:
+                    last_reconcile = started
+                self.stdout.write(
+                    f"nuevos={result['nuevos']} actualizados={result['actualizados']} "
+                    f"eliminados={result['eliminados']} "
+                    f"watermark={result['watermark']} ({time.monotonic() - started:.2f}s)"
+                )
+            if not opts["loop"]:
+                return
+            time.sleep(max(0, interval - (time.monotonic() - started)))
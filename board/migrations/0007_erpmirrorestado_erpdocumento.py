@@ -0,0 +1,47 @@
+# Generated by Django 5.2.18 on 2026-10-17 00:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('board', '0006_ordenuistate_folio'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ErpMirrorEstado',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('nombre', models.CharField(max_length=50, unique=True)),
+                ('watermark', models.BigIntegerField(default=0)),
+                ('last_sync_at', models.DateTimeField(blank=True, null=True)),
+                ('last_success_at', models.DateTimeField(blank=True, null=True)),
+                ('last_error', models.TextField(blank=True, default='')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ErpDocumento',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('doc_id', models.BigIntegerField(unique=True)),
+                ('folio', models.CharField(blank=True, max_length=50, null=True)),
+                ('folio_num', models.BigIntegerField(blank=True, null=True)),
+                ('cliente', models.CharField(blank=True, default='', max_length=255)),
+                ('fecha_creacion', models.DateField(db_index=True)),
+                ('fecha_entrega', models.DateField(blank=True, null=True)),
+                ('observ', models.TextField(blank=True, default='')),
+                ('referencia', models.CharField(blank=True, default='', max_length=255)),
+                ('total_u', models.FloatField(default=0)),
+                ('pend_u', models.FloatField(default=0)),
+                ('vendedor', models.CharField(blank=True, max_length=255, null=True)),
+                ('almacen_calc', models.CharField(blank=True, max_length=10, null=True)),
+                ('abierto', models.BooleanField(db_index=True, default=True)),
+                ('synced_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['folio_num', 'folio', 'doc_id'], name='board_erpdoc_folio_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 5.2.18 on 2026-10-17 00:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('board', '0007_erpmirrorestado_erpdocumento'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IndiceBusqueda',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('doc_id', models.BigIntegerField(unique=True)),
+                ('folio', models.CharField(blank=True, db_index=True, max_length=50, null=True)),
+                ('folio_num', models.BigIntegerField(blank=True, db_index=True, null=True)),
+                ('cliente', models.CharField(blank=True, default='', max_length=255)),
+                ('texto', models.CharField(blank=True, db_index=True, default='', max_length=255)),
+                ('fecha_creacion', models.DateField(blank=True, db_index=True, null=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='IndiceTrigrama',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('gram', models.CharField(max_length=3)),
+                ('doc_id', models.BigIntegerField()),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('gram', 'doc_id'), name='board_trigrama_uniq')],
+            },
+        ),
+    ]
@@ -0,0 +1,52 @@
+# Generated by Django 5.2.18 on 2026-10-17 00:31
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('board', '0008_indicebusqueda_indicetrigrama'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ordenuistate',
+            name='almacen',
+            field=models.CharField(blank=True, max_length=10, null=True),
+        ),
+        migrations.AddField(
+            model_name='ordenuistate',
+            name='vendedor',
+            field=models.CharField(blank=True, max_length=255, null=True),
+        ),
+        migrations.CreateModel(
+            name='ResumenFinalizacion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('fecha', models.DateField()),
+                ('almacen', models.CharField(blank=True, default='', max_length=10)),
+                ('vendedor', models.CharField(blank=True, default='', max_length=255)),
+                ('bucket', models.SmallIntegerField(default=-1)),
+                ('finalizados', models.IntegerField(default=0)),
+                ('minutos_total', models.BigIntegerField(default=0)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('fecha', 'almacen', 'vendedor', 'bucket'), name='board_resumen_fin_uniq')],
+            },
+        ),
+        migrations.CreateModel(
+            name='ResumenError',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('fecha', models.DateField()),
+                ('errores', models.IntegerField(default=0)),
+                ('resueltos', models.IntegerField(default=0)),
+                ('responsable', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, to='board.empleadoresponsable')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('fecha', 'responsable'), name='board_resumen_err_uniq'), models.UniqueConstraint(condition=models.Q(('responsable__isnull', True)), fields=('fecha',), name='board_resumen_err_sin_resp_uniq')],
+            },
+        ),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 5.2.18 on 2026-10-17 00:36
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('board', '0009_rollups'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OrdenUIStateArchivo',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('doc_id', models.BigIntegerField(db_index=True, unique=True)),
+                ('folio', models.CharField(blank=True, db_index=True, max_length=50, null=True)),
+                ('is_finalizado', models.BooleanField(default=False)),
+                ('fecha_finalizacion', models.DateTimeField(blank=True, null=True)),
+                ('first_seen_at', models.DateTimeField(blank=True, null=True)),
+                ('has_error', models.BooleanField(default=False)),
+                ('error_resuelto', models.BooleanField(default=False)),
+                ('error_comentarios', models.TextField(blank=True)),
+                ('almacen', models.CharField(blank=True, max_length=10, null=True)),
+                ('vendedor', models.CharField(blank=True, max_length=255, null=True)),
+                ('updated_at', models.DateTimeField()),
+                ('archived_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='ordenuistate',
+            index=models.Index(condition=models.Q(('is_finalizado', True)), fields=['-fecha_finalizacion', '-doc_id'], name='board_ui_finalizadas_idx'),
+        ),
+        migrations.AddField(
+            model_name='ordenuistatearchivo',
+            name='error_responsable',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='board.empleadoresponsable'),
+        ),
+        migrations.AddIndex(
+            model_name='ordenuistatearchivo',
+            index=models.Index(fields=['-fecha_finalizacion', '-doc_id'], name='board_uiarch_fecha_idx'),
+        ),
+    ]
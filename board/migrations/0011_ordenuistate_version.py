@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-17 00:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('board', '0010_ordenuistate_archivo'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ordenuistate',
+            name='version',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='ordenuistatearchivo',
+            name='version',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.18 on 2026-10-17 00:58
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('board', '0011_ordenuistate_version'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='resumenerror',
+            name='responsable',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='board.empleadoresponsable'),
+        ),
+    ]
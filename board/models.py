@@ -7,7 +7,8 @@ class EmpleadoResponsable(models.Model):
     def __str__(self):
         return self.nombre
 
-class OrdenUIState(models.Model):
+class OrdenUIStateBase(models.Model):
+    """Campos del estado UI de una orden; compartidos por la tabla caliente y el archivo."""
     doc_id = models.BigIntegerField(unique=True, db_index=True)
     folio = models.CharField(max_length=50, db_index=True, blank=True, null=True)
     is_finalizado = models.BooleanField(default=False)
@@ -23,10 +24,158 @@ class OrdenUIState(models.Model):
     error_resuelto = models.BooleanField(default=False)
     error_comentarios = models.TextField(blank=True)
 
+    # === Dimensiones del ERP fijadas al finalizar (para los resúmenes) ===
+    almacen = models.CharField(max_length=10, blank=True, null=True)
+    vendedor = models.CharField(max_length=255, blank=True, null=True)
+
+    # Sube en cada cambio de estado (rollup.update_ui): el cliente manda la que vio
+    version = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        abstract = True
+
     def __str__(self):
         estado = "FINALIZADO" if self.is_finalizado else "ERP"
         return f"Orden {self.doc_id} ({estado})"
 
 
-""" correr este codigo para eliminar todo y poner una base nueva
-python manage.py shell -c "from board.models import OrdenUIState; OrdenUIState.objects.all().delete()"""
\ No newline at end of file
+class OrdenUIState(OrdenUIStateBase):
+    """
+    Tabla caliente: órdenes abiertas y finalizadas recientes. Las finalizadas
+    hace más de BOARD_ARCHIVE_AFTER_DAYS se mueven a OrdenUIStateArchivo
+    (comando archive_ui_states), así los 'doc_id__in' de cada poll leen una
+    tabla chica.
+    """
+    class Meta:
+        indexes = [
+            # Historial ('pasados') por keyset y selección del archivado: solo finalizadas
+            models.Index(
+                fields=["-fecha_finalizacion", "-doc_id"], condition=models.Q(is_finalizado=True),
+                name="board_ui_finalizadas_idx",
+            ),
+        ]
+
+
+class OrdenUIStateArchivo(OrdenUIStateBase):
+    """Órdenes finalizadas archivadas (services.archive); el historial las sigue leyendo."""
+    updated_at = models.DateTimeField()  # se conserva el de la tabla caliente
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["-fecha_finalizacion", "-doc_id"], name="board_uiarch_fecha_idx"),
+        ]
+
+
+# === Espejo local de admDocumentos (lo llena el comando sync_erp_mirror) ===
+class ErpDocumento(models.Model):
+    doc_id = models.BigIntegerField(unique=True)
+    folio = models.CharField(max_length=50, blank=True, null=True)
+    folio_num = models.BigIntegerField(null=True, blank=True)  # para ordenar igual que el ERP
+    cliente = models.CharField(max_length=255, blank=True, default="")
+    fecha_creacion = models.DateField(db_index=True)
+    fecha_entrega = models.DateField(null=True, blank=True)
+    observ = models.TextField(blank=True, default="")
+    referencia = models.CharField(max_length=255, blank=True, default="")
+    total_u = models.FloatField(default=0)
+    pend_u = models.FloatField(default=0)
+    vendedor = models.CharField(max_length=255, blank=True, null=True)
+    almacen_calc = models.CharField(max_length=10, blank=True, null=True)
+    abierto = models.BooleanField(default=True, db_index=True)  # pend_u > 0: se re-verifica en cada sync
+    synced_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["folio_num", "folio", "doc_id"], name="board_erpdoc_folio_idx"),
+        ]
+
+    def __str__(self):
+        return f"Doc {self.doc_id} (folio {self.folio})"
+
+
+class ErpMirrorEstado(models.Model):
+    nombre = models.CharField(max_length=50, unique=True)
+    watermark = models.BigIntegerField(default=0)  # último CIDDOCUMENTO copiado
+    last_sync_at = models.DateTimeField(null=True, blank=True)
+    last_success_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True, default="")
+
+    def __str__(self):
+        return f"{self.nombre} @ {self.watermark}"
+
+# === Índice local de búsqueda (folio / cliente -> doc_id) ===
+class IndiceBusqueda(models.Model):
+    doc_id = models.BigIntegerField(unique=True)
+    folio = models.CharField(max_length=50, blank=True, null=True, db_index=True)
+    folio_num = models.BigIntegerField(null=True, blank=True, db_index=True)
+    cliente = models.CharField(max_length=255, blank=True, default="")
+    texto = models.CharField(max_length=255, blank=True, default="", db_index=True)  # cliente normalizado
+    fecha_creacion = models.DateField(null=True, blank=True, db_index=True)
+
+    def __str__(self):
+        return f"{self.folio} · {self.cliente}"
+
+
+class IndiceTrigrama(models.Model):
+    gram = models.CharField(max_length=3)
+    doc_id = models.BigIntegerField()
+
+    class Meta:
+        constraints = [
+            # También es el índice de consulta: gram -> doc_ids
+            models.UniqueConstraint(fields=["gram", "doc_id"], name="board_trigrama_uniq"),
+        ]
+
+    def __str__(self):
+        return f"{self.gram!r} -> {self.doc_id}"
+
+# === Resúmenes mantenidos al vuelo (services.rollup) ===
+class ResumenFinalizacion(models.Model):
+    """
+    Finalizados por día (local de fecha_finalizacion), almacén, vendedor y
+    rango de duración first_seen_at -> fecha_finalizacion (bucket, ver
+    rollup.DURATION_BUCKETS; -1 = sin first_seen_at).
+    """
+    fecha = models.DateField()
+    almacen = models.CharField(max_length=10, blank=True, default="")
+    vendedor = models.CharField(max_length=255, blank=True, default="")
+    bucket = models.SmallIntegerField(default=-1)
+    finalizados = models.IntegerField(default=0)
+    minutos_total = models.BigIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["fecha", "almacen", "vendedor", "bucket"], name="board_resumen_fin_uniq"),
+        ]
+
+    def __str__(self):
+        return f"{self.fecha} {self.almacen}/{self.vendedor}: {self.finalizados}"
+
+
+class ResumenError(models.Model):
+    """
+    Órdenes finalizadas con error por día y responsable (y cuántas ya se
+    resolvieron). Borrar un responsable sigue permitido: sus órdenes quedan
+    sin responsable (SET_NULL) y sus filas se suman antes a la fila "sin
+    responsable" de cada día (rollup.fold_deleted_responsable) y luego se borran.
+    """
+    fecha = models.DateField()
+    responsable = models.ForeignKey(EmpleadoResponsable, null=True, blank=True, on_delete=models.CASCADE)
+    errores = models.IntegerField(default=0)
+    resueltos = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["fecha", "responsable"], name="board_resumen_err_uniq"),
+            # NULL no choca con NULL en un UNIQUE: una sola fila "sin responsable" por día
+            models.UniqueConstraint(
+                fields=["fecha"], condition=models.Q(responsable__isnull=True), name="board_resumen_err_sin_resp_uniq",
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.fecha} {self.responsable}: {self.errores}"
+
+
+""" Las finalizadas viejas no se borran: se archivan (y el historial las sigue mostrando)
+python manage.py archive_ui_states --days 180"""
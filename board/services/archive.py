@@ -0,0 +1,89 @@
+"""
+Archivo de OrdenUIState: las órdenes finalizadas hace más de
+ARCHIVE_AFTER_DAYS se mueven (en lotes, copiar + borrar en la misma
+transacción) a OrdenUIStateArchivo. La tabla caliente queda con lo abierto y
+lo reciente; el historial, las tarjetas sueltas y la impresión buscan en el
+archivo lo que no esté en la caliente, y reabrir una orden la regresa.
+"""
+from datetime import timedelta
+
+from django.db import transaction
+from django.utils import timezone
+
+from .. import conf
+from ..models import OrdenUIState, OrdenUIStateArchivo
+
+# Columnas que se copian tal cual (error_responsable_id incluido, sin la PK)
+FIELDS = tuple(f.attname for f in OrdenUIState._meta.concrete_fields if not f.primary_key)
+
+
+def cutoff(days=None):
+    days = conf.get("ARCHIVE_AFTER_DAYS") if days is None else days
+    return timezone.now() - timedelta(days=max(1, days))
+
+
+def archive_finalized(days=None, batch=None, dry_run=False):
+    """
+    Mueve al archivo las finalizadas antes de cutoff(days), 'batch' por
+    transacción (usa el índice parcial de finalizadas). Devuelve cuántas.
+    """
+    batch = batch or conf.get("ARCHIVE_BATCH")
+    pending = OrdenUIState.objects.filter(is_finalizado=True, fecha_finalizacion__lt=cutoff(days))
+    if dry_run:
+        return pending.count()
+    moved = 0
+    while True:
+        with transaction.atomic():
+            chunk = list(pending.select_for_update().order_by("fecha_finalizacion", "doc_id")[:batch])
+            if not chunk:
+                return moved
+            doc_ids = [ui.doc_id for ui in chunk]
+            # Por si una corrida anterior ya la había archivado (y luego se restauró)
+            OrdenUIStateArchivo.objects.filter(doc_id__in=doc_ids).delete()
+            OrdenUIStateArchivo.objects.bulk_create(
+                [OrdenUIStateArchivo(**{f: getattr(ui, f) for f in FIELDS}) for ui in chunk]
+            )
+            OrdenUIState.objects.filter(pk__in=[ui.pk for ui in chunk]).delete()
+        moved += len(chunk)
+
+
+def restore(doc_id):
+    """
+    Regresa doc_id del archivo a la tabla caliente (para modificarla, ej. al
+    reabrir). Llamar dentro de una transacción. Devuelve el OrdenUIState o None.
+    """
+    archived = OrdenUIStateArchivo.objects.select_for_update().filter(doc_id=doc_id).first()
+    if archived is None:
+        return None
+    ui = OrdenUIState(**{f: getattr(archived, f) for f in FIELDS})
+    archived.delete()
+    ui.save(force_insert=True)
+    return ui
+
+
+def archived_states(doc_ids, only=None):
+    """{doc_id: OrdenUIStateArchivo} (con error_responsable unido) de los doc_ids archivados."""
+    if not doc_ids:
+        return {}
+    qs = OrdenUIStateArchivo.objects.filter(doc_id__in=doc_ids)
+    qs = qs.only(*only) if only else qs.select_related("error_responsable")
+    return {ui.doc_id: ui for ui in qs}
+
+
+def ui_states(doc_ids, only=None):
+    """{doc_id: estado} de la tabla caliente y, para los que falten, del archivo."""
+    qs = OrdenUIState.objects.filter(doc_id__in=doc_ids)
+    qs = qs.only(*only) if only else qs.select_related("error_responsable")
+    found = {ui.doc_id: ui for ui in qs}
+    found.update(archived_states([d for d in doc_ids if d not in found], only=only))
+    return found
+
+
+async def aget_ui(doc_id, *only):
+    """El estado de doc_id (caliente o archivado) para vistas async, o None."""
+    for model in (OrdenUIState, OrdenUIStateArchivo):
+        qs = model.objects.filter(doc_id=doc_id)
+        ui = await (qs.only(*only) if only else qs.select_related("error_responsable")).afirst()
+        if ui is not None:
+            return ui
+    return None
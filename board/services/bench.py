@@ -0,0 +1,307 @@
+"""
+Benchmarks repetibles del tablero contra el ERP de reemplazo (erp_standin)
+registrado como el alias 'erp': mismos queries, mismas capas (gateway, cache
+de snapshots, índice de búsqueda, vistas) y datos deterministas de 1k a 500k
+documentos. Lo usa el comando bench_board; los resultados se comparan contra
+una línea base guardada en JSON.
+"""
+import json
+import os
+import statistics
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.db import connections, transaction
+from django.test import Client, override_settings
+from django.test.utils import setup_databases, teardown_databases
+from django.urls import reverse
+from django.utils import timezone
+
+from .. import conf
+from ..models import OrdenUIState
+from . import erp, erp_standin, orders, rollup
+from . import search as search_index
+
+SIZES = (1_000, 10_000, 100_000, 500_000)
+
+# Datos fijos (no dependen de 'hoy'): los resultados de dos corridas son comparables
+DATA_START = datetime(2025, 8, 1, 8, 0)
+DOC_MINUTES = 13        # un documento cada 13 minutos (ver erp_standin.seed)
+RECENT_DAYS = 2         # ventana de 'relevantes': los últimos 2 días de datos
+FINALIZED_EVERY = 5     # 1 de cada 5 documentos finalizado (historial de 'pasados')
+SAMPLE_IDS = 500
+
+
+class Benchmark:
+    """fn(env) es lo que se mide; setup(env) corre antes de cada repetición sin medirse."""
+
+    def __init__(self, name, fn, setup=None, needs=()):
+        self.name = name
+        self.fn = fn
+        self.setup = setup
+        self.needs = set(needs)
+
+
+def _cold(env):
+    # Sin snapshot ni partidas en cache: cada repetición paga el ERP
+    caches[conf.get("CACHE_ALIAS")].clear()
+
+
+def _get(env, url_name, *args, **params):
+    response = env["client"].get(reverse(url_name, args=args), params)
+    if response.status_code != 200:
+        raise AssertionError(f"{url_name} respondió {response.status_code}")
+    # Consumir el cuerpo completo (también si es streaming)
+    return b"".join(response) if response.streaming else response.content
+
+
+BENCHMARKS = [
+    # --- ERP directo (sin cache) ---
+    Benchmark("erp.fetch_orders.recent", lambda env: erp.fetch_orders(date_from=env["date_from"], fail_silently=False)),
+    Benchmark("erp.fetch_orders.search", lambda env: erp.fetch_orders(
+        date_from=env["date_from"], search="Cliente 1", fail_silently=False,
+    )),
+    Benchmark("erp.fetch_orders.doc_ids", lambda env: erp.fetch_orders(doc_ids=env["sample_ids"], fail_silently=False)),
+    Benchmark("erp.fetch_orders_after", lambda env: erp.fetch_orders_after(
+        env["n_docs"] // 2, limit=conf.get("SEARCH_INDEX_BATCH"), fail_silently=False,
+    )),
+    Benchmark("erp.fetch_items", lambda env: erp.fetch_items(env["sample_ids"][0])),
+    Benchmark("erp.fetch_items_many", lambda env: erp.fetch_items_many(env["sample_ids"], fail_silently=False)),
+
+    # --- build_cards (cache frío = ERP + DB local; caliente = solo DB local) ---
+    Benchmark("build_cards.relevantes", lambda env: orders.build_cards(date_from=env["date_from"]), setup=_cold),
+    Benchmark("build_cards.relevantes_cached", lambda env: orders.build_cards(date_from=env["date_from"])),
+    Benchmark("build_cards.relevantes_search", lambda env: orders.build_cards(
+        date_from=env["date_from"], search="Cliente 1",
+    ), setup=_cold, needs={"search_index"}),
+    Benchmark("build_cards.pasados", lambda env: orders.build_cards(view_mode="pasados"), setup=_cold),
+    Benchmark("build_cards.pasados_search", lambda env: orders.build_cards(
+        view_mode="pasados", search="Cliente 1",
+    ), setup=_cold, needs={"search_index"}),
+    Benchmark("build_past_page.cursor", lambda env: orders.build_past_page(cursor=env["past_cursor"]), setup=_cold),
+
+    # --- Vistas (request completo: middleware, sesión, render) ---
+    Benchmark("view.dashboard", lambda env: _get(env, "dashboard", date_from=env["date_from_str"]), setup=_cold),
+    Benchmark("view.orders_cards", lambda env: _get(env, "orders-cards", date_from=env["date_from_str"]), setup=_cold),
+    Benchmark("view.orders_cards_cached", lambda env: _get(env, "orders-cards", date_from=env["date_from_str"])),
+    Benchmark("view.orders_cards_pasados", lambda env: _get(env, "orders-cards", view="pasados"), setup=_cold),
+    Benchmark("view.orders_board", lambda env: _get(env, "orders-board", date_from=env["date_from_str"]), setup=_cold),
+    Benchmark("view.kpis", lambda env: _get(env, "kpis", date_from=env["date_from_str"]), setup=_cold),
+    Benchmark("view.order_detail", lambda env: _get(env, "order-detail", env["sample_ids"][0]), setup=_cold),
+    Benchmark("view.order_print", lambda env: _get(env, "order-print", env["sample_ids"][0]), setup=_cold),
+    Benchmark("view.orders_print_bulk", lambda env: _get(
+        env, "orders-print-bulk", ids=",".join(map(str, env["sample_ids"][:50])),
+    ), setup=_cold),
+    Benchmark("view.search_suggest", lambda env: _get(env, "search-suggest", q="cliente 12"), needs={"search_index"}),
+    Benchmark("view.orders_export", lambda env: _get(env, "orders-export", format="csv"), setup=_cold),
+    Benchmark("view.reports", lambda env: _get(env, "reports", by="fecha,almacen,vendedor")),
+    Benchmark("view.cache_stats", lambda env: _get(env, "cache-stats")),
+    Benchmark("view.metrics", lambda env: _get(env, "metrics")),
+]
+
+
+def select(only=None):
+    """Benchmarks cuyo nombre empieza con alguno de los prefijos de 'only' (todos si no hay)."""
+    if not only:
+        return list(BENCHMARKS)
+    return [b for b in BENCHMARKS if any(b.name.startswith(prefix) for prefix in only)]
+
+
+def _standin_ready(alias, n_docs):
+    try:
+        with connections[alias].cursor() as cur:
+            cur.execute("SELECT COUNT(*) FROM admDocumentos")
+            return cur.fetchone()[0] == n_docs
+    except Exception:
+        return False
+
+
+def _seed_erp(n_docs, data_dir=None):
+    """
+    Registra el stand-in como el alias del ERP. Con data_dir, el archivo
+    erp_standin_<n>.sqlite3 se reutiliza entre corridas (generar 500k tarda).
+    Devuelve (ruta, temporal).
+    """
+    path = os.path.join(data_dir, f"erp_standin_{n_docs}.sqlite3") if data_dir else None
+    if path and os.path.exists(path):
+        erp_standin.install(erp.ERP_ALIAS, path)
+        if _standin_ready(erp.ERP_ALIAS, n_docs):
+            return path, False
+        connections[erp.ERP_ALIAS].close()
+        os.remove(path)
+    if data_dir:
+        os.makedirs(data_dir, exist_ok=True)
+    path = erp_standin.install(erp.ERP_ALIAS, path)
+    erp_standin.create_schema(erp.ERP_ALIAS)
+    erp_standin.seed(n_docs, alias=erp.ERP_ALIAS, start=DATA_START)
+    return path, data_dir is None
+
+
+def _seed_local(n_docs, last_created):
+    """Historial de 'pasados': 1 de cada FINALIZED_EVERY documentos finalizado, en días previos."""
+    now = timezone.now()
+    seen = timezone.make_aware(last_created) if timezone.is_naive(last_created) else last_created
+    batch = []
+    with transaction.atomic():
+        for doc_id in range(FINALIZED_EVERY, n_docs + 1, FINALIZED_EVERY):
+            batch.append(OrdenUIState(
+                doc_id=doc_id,
+                folio=None,
+                is_finalizado=True,
+                fecha_finalizacion=now - timedelta(days=1, minutes=n_docs - doc_id),
+                first_seen_at=seen,
+            ))
+            if len(batch) >= 5000:
+                OrdenUIState.objects.bulk_create(batch)
+                batch = []
+        if batch:
+            OrdenUIState.objects.bulk_create(batch)
+        rollup.rebuild()
+
+
+def _build_index():
+    def fetch_batch(after, limit):
+        return erp.fetch_orders_after(after, limit=limit, fail_silently=False)
+
+    search_index.rebuild(fetch_batch, batch=conf.get("SEARCH_INDEX_BATCH"))
+
+
+@contextmanager
+def environment(n_docs, data_dir=None, needs=(), verbosity=0):
+    """
+    Todo lo que un benchmark necesita, aislado del sistema real:
+      - DB local de prueba (como el test runner), nunca la de producción;
+      - cache locmem propio (limpiarlo no toca Redis / memcached compartido);
+      - el alias del ERP apuntando al stand-in con n_docs documentos;
+      - sin precarga de partidas en segundo plano (hilos que ensucian la medición).
+    Entrega un dict con fechas, doc_ids de muestra, cliente autenticado, etc.
+    """
+    overrides = override_settings(
+        DEBUG=False,
+        ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, "testserver"],
+        CACHES={
+            **settings.CACHES,
+            conf.get("CACHE_ALIAS"): {
+                "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+                "LOCATION": "board-bench",
+            },
+        },
+        BOARD_ITEMS_PREFETCH=False,
+        BOARD_SEARCH_INDEX="search_index" in needs,
+    )
+    original_erp = connections.settings.get(erp.ERP_ALIAS)
+    overrides.enable()
+    old_config = setup_databases(verbosity=verbosity, interactive=False, aliases={"default"})
+    path, temporary = None, False
+    try:
+        path, temporary = _seed_erp(n_docs, data_dir)
+        last_created = DATA_START + timedelta(minutes=n_docs * DOC_MINUTES)
+        date_from = (last_created - timedelta(days=RECENT_DAYS)).date()
+        _seed_local(n_docs, last_created)
+        if "search_index" in needs:
+            _build_index()
+
+        user = get_user_model().objects.create_user("bench", password="bench")
+        client = Client()
+        client.force_login(user)
+
+        step = max(1, n_docs // SAMPLE_IDS)
+        env = {
+            "n_docs": n_docs,
+            "date_from": date_from,
+            "date_from_str": date_from.isoformat(),
+            "sample_ids": list(range(1, n_docs + 1, step))[:SAMPLE_IDS],
+            "client": client,
+        }
+        _, env["past_cursor"] = orders.build_past_page()
+        yield env
+    finally:
+        erp_standin.uninstall(erp.ERP_ALIAS, remove_file=temporary)
+        if original_erp is not None:
+            connections.settings[erp.ERP_ALIAS] = original_erp
+        teardown_databases(old_config, verbosity=verbosity)
+        overrides.disable()
+        if path and temporary and os.path.exists(path):
+            os.remove(path)
+
+
+def measure(bench, env, repeat=5, warmup=1):
+    """Corre el benchmark y devuelve {median_ms, min_ms, max_ms, runs}."""
+    samples = []
+    for i in range(warmup + repeat):
+        if bench.setup:
+            bench.setup(env)
+        started = time.perf_counter()
+        bench.fn(env)
+        elapsed = (time.perf_counter() - started) * 1000
+        if i >= warmup:
+            samples.append(elapsed)
+    return {
+        "median_ms": round(statistics.median(samples), 3),
+        "min_ms": round(min(samples), 3),
+        "max_ms": round(max(samples), 3),
+        "runs": repeat,
+    }
+
+
+def run(n_docs, benchmarks, repeat=5, warmup=1, data_dir=None, verbosity=0, progress=None):
+    """{nombre: resultado} de cada benchmark sobre un ERP de n_docs documentos."""
+    needs = set().union(*(b.needs for b in benchmarks)) if benchmarks else set()
+    results = {}
+    with environment(n_docs, data_dir=data_dir, needs=needs, verbosity=verbosity) as env:
+        for bench in benchmarks:
+            results[bench.name] = measure(bench, env, repeat=repeat, warmup=warmup)
+            if progress:
+                progress(n_docs, bench.name, results[bench.name])
+    return results
+
+
+def load_baseline(path):
+    if not os.path.exists(path):
+        return {}
+    with open(path, encoding="utf-8") as fh:
+        return json.load(fh)
+
+
+def save_baseline(path, results, baseline=None):
+    """Mezcla results ({n_docs: {nombre: resultado}}) en la línea base y la escribe."""
+    data = dict(baseline or {})
+    for n_docs, by_name in results.items():
+        data.setdefault(str(n_docs), {}).update(by_name)
+    with open(path, "w", encoding="utf-8") as fh:
+        json.dump(data, fh, indent=2, sort_keys=True)
+        fh.write("\n")
+    return data
+
+
+def compare(results, baseline, threshold=None, min_delta_ms=None):
+    """
+    [(n_docs, nombre, base_ms, actual_ms, cambio)] de los benchmarks cuya
+    mediana empeoró más que 'threshold' (fracción) Y más que min_delta_ms
+    (para que el ruido de los que tardan 1 ms no cuente como regresión).
+    """
+    threshold = conf.get("BENCH_THRESHOLD") if threshold is None else threshold
+    min_delta_ms = conf.get("BENCH_MIN_DELTA_MS") if min_delta_ms is None else min_delta_ms
+    regressions = []
+    for n_docs, by_name in results.items():
+        base = baseline.get(str(n_docs), {})
+        for name, result in by_name.items():
+            if name not in base:
+                continue
+            before, now = base[name]["median_ms"], result["median_ms"]
+            if now - before > min_delta_ms and now > before * (1 + threshold):
+                regressions.append((n_docs, name, before, now, (now - before) / before if before else float("inf")))
+    return regressions
+
+
+def baseline_path(path=None):
+    """Ruta de la línea base; relativa a BASE_DIR si settings lo define."""
+    path = path or conf.get("BENCH_BASELINE")
+    base_dir = getattr(settings, "BASE_DIR", None)
+    if not os.path.isabs(path) and base_dir:
+        path = os.path.join(base_dir, path)
+    return str(path)
@@ -0,0 +1,90 @@
+import logging
+import time
+
+from django.core.cache import caches
+from django.db.utils import OperationalError
+
+from .. import conf
+
+logger = logging.getLogger(__name__)
+
+KEY_PREFIX = "board:breaker"
+
+
+class ErpUnavailable(OperationalError):
+    """El circuito del ERP está abierto: ni se intenta el query."""
+
+
+def _cache():
+    return caches[conf.get("CACHE_ALIAS")]
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker compartido entre workers (estado en el cache compartido):
+      - cerrado: todo pasa; ERP_BREAKER_THRESHOLD fallas dentro de
+        ERP_BREAKER_WINDOW segundos lo abren;
+      - abierto: durante ERP_BREAKER_OPEN segundos se rechaza al instante
+        (ErpUnavailable) en vez de esperar a un servidor que no responde;
+      - medio abierto: pasado ese tiempo UN solo worker prueba; si sale bien
+        se cierra, si falla se abre otro periodo.
+    Uso: token = allow(); ... success(token) / failure(token).
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.fails_key = f"{KEY_PREFIX}:{name}:fails"
+        self.open_key = f"{KEY_PREFIX}:{name}:open_until"
+        self.probe_key = f"{KEY_PREFIX}:{name}:probe"
+
+    def allow(self):
+        """Lanza ErpUnavailable si el circuito está abierto; si no, un token para success/failure."""
+        state = _cache().get_many([self.fails_key, self.open_key])
+        open_until = state.get(self.open_key)
+        if open_until is None:
+            return ("closed", state.get(self.fails_key, 0))
+        if time.time() < open_until or not _cache().add(self.probe_key, 1, conf.get("ERP_BREAKER_OPEN")):
+            raise ErpUnavailable(f"ERP no disponible (circuito '{self.name}' abierto)")
+        return ("half_open", state.get(self.fails_key, 0))
+
+    def success(self, token):
+        mode, fails = token
+        if mode == "half_open" or fails:
+            # Solo se escribe si había algo que limpiar; el camino normal no toca el cache
+            _cache().delete_many([self.fails_key, self.open_key, self.probe_key])
+            if mode == "half_open":
+                logger.info("ERP respondió; circuito '%s' cerrado", self.name)
+
+    def failure(self, token):
+        mode, _ = token
+        cache = _cache()
+        if mode == "half_open":
+            self._open(cache)
+            return
+        cache.add(self.fails_key, 0, conf.get("ERP_BREAKER_WINDOW"))
+        try:
+            fails = cache.incr(self.fails_key)
+        except ValueError:
+            cache.set(self.fails_key, 1, conf.get("ERP_BREAKER_WINDOW"))
+            fails = 1
+        if fails >= conf.get("ERP_BREAKER_THRESHOLD"):
+            self._open(cache)
+
+    def _open(self, cache):
+        cache.set(self.open_key, time.time() + conf.get("ERP_BREAKER_OPEN"), None)
+        cache.delete(self.probe_key)
+        logger.warning("ERP sin respuesta; circuito '%s' abierto %ss", self.name, conf.get("ERP_BREAKER_OPEN"))
+
+    def status(self):
+        state = _cache().get_many([self.fails_key, self.open_key])
+        open_until = state.get(self.open_key)
+        if open_until is None:
+            name = "closed"
+        elif time.time() < open_until:
+            name = "open"
+        else:
+            name = "half_open"
+        return {"state": name, "failures": state.get(self.fails_key, 0), "open_until": open_until}
+
+
+erp_breaker = CircuitBreaker("erp")
@@ -0,0 +1,477 @@
+import hashlib
+import logging
+import threading
+import time
+
+from django.core.cache import caches
+from django.db import connections
+from django.db.utils import OperationalError
+from django.template.loader import render_to_string
+from django.utils import timezone, translation
+
+from .. import conf
+from . import events
+from . import search as search_index
+from .delta import card_signature
+from .erp import fetch_items_many, fetch_orders
+
+logger = logging.getLogger(__name__)
+
+KEY_PREFIX = "board:orders"
+INDEX_KEY = f"{KEY_PREFIX}:index"
+ITEMS_PREFIX = "board:items"
+ITEMS_INDEX_KEY = f"{ITEMS_PREFIX}:index"
+CARDS_PREFIX = "board:card"
+CARDS_INDEX_KEY = f"{CARDS_PREFIX}:index"
+BOARDS_PREFIX = "board:boards"
+BOARDS_INDEX_KEY = f"{BOARDS_PREFIX}:index"
+BOARDS_REFRESH_LOCK = f"{BOARDS_PREFIX}:refresh"
+STATS = (
+    "hits", "stale_hits", "misses", "refreshes", "evictions",
+    "items_hits", "items_misses", "items_evictions",
+    "cards_hits", "cards_misses", "cards_evictions",
+    "refresh_errors",
+)
+
+# Cuánto espera un worker en frío a que otro termine de cargar el mismo snapshot
+COLD_WAIT_SECONDS = 5
+COLD_WAIT_STEP = 0.05
+# Candado del índice de llaves: se suelta en milisegundos, así que se espera poco
+INDEX_LOCK_TIMEOUT = 5
+INDEX_LOCK_WAIT_SECONDS = 0.5
+INDEX_LOCK_WAIT_STEP = 0.005
+
+
+def _cache():
+    return caches[conf.get("CACHE_ALIAS")]
+
+
+class Snapshot(list):
+    """
+    Filas tal como las devuelve fetch_orders + de cuándo son. stale=True indica
+    que el ERP no respondió y se están sirviendo las últimas filas buenas
+    (o ninguna, si nunca hubo un snapshot con estos filtros).
+    """
+
+    def __init__(self, rows=(), fetched_at=None, stale=False):
+        super().__init__(rows)
+        self.fetched_at = fetched_at
+        self.stale = stale
+
+    @property
+    def age(self):
+        return time.time() - self.fetched_at if self.fetched_at else None
+
+    @classmethod
+    def like(cls, source, rows):
+        """Mismas marcas de frescura que 'source' sobre otras filas (p. ej. tarjetas)."""
+        return cls(rows, getattr(source, "fetched_at", None), getattr(source, "stale", False))
+
+
+def _served(entry):
+    return Snapshot(entry["rows"], entry.get("fetched_at"), stale=bool(entry.get("failed_at")))
+
+
+def _norm_date(val):
+    if val in (None, ""):
+        return None
+    if hasattr(val, "isoformat"):
+        return val.isoformat()
+    return str(val).strip()
+
+
+def normalize_filters(date_from=None, date_to=None, search=None, limit=None, doc_ids=None):
+    """
+    Tupla canónica (date_from, date_to, search, limit, doc_ids) para usar como llave:
+    fechas en ISO, búsqueda sin espacios, doc_ids ordenados y sin duplicados.
+    """
+    search = (str(search).strip() or None) if search else None
+    limit = int(limit) if limit else None
+    ids = tuple(sorted({int(d) for d in doc_ids})) if doc_ids else None
+    return (_norm_date(date_from), _norm_date(date_to), search, limit, ids)
+
+
+def _snapshot_key(filters):
+    digest = hashlib.sha1(repr(filters).encode("utf-8")).hexdigest()
+    return f"{KEY_PREFIX}:snap:{digest}"
+
+
+def _incr(name, delta=1):
+    cache = _cache()
+    key = f"{KEY_PREFIX}:stats:{name}"
+    cache.add(key, 0, None)
+    try:
+        cache.incr(key, delta)
+    except ValueError:
+        # Se evictó entre add() e incr(); no vale la pena reintentar un contador
+        pass
+
+
+def snapshot_stats():
+    """Contadores compartidos entre workers (hits, stale_hits, misses, refreshes, evictions)."""
+    cache = _cache()
+    values = cache.get_many([f"{KEY_PREFIX}:stats:{n}" for n in STATS])
+    stats = {n: values.get(f"{KEY_PREFIX}:stats:{n}", 0) for n in STATS}
+    served = stats["hits"] + stats["stale_hits"] + stats["misses"]
+    stats["hit_ratio"] = round((stats["hits"] + stats["stale_hits"]) / served, 4) if served else 0.0
+    items_served = stats["items_hits"] + stats["items_misses"]
+    stats["items_hit_ratio"] = round(stats["items_hits"] / items_served, 4) if items_served else 0.0
+    cards_served = stats["cards_hits"] + stats["cards_misses"]
+    stats["cards_hit_ratio"] = round(stats["cards_hits"] / cards_served, 4) if cards_served else 0.0
+    return stats
+
+
+def _remember(keys, index_key=INDEX_KEY, max_entries=None, stat="evictions"):
+    """
+    Registra las llaves en el índice y expulsa las más viejas (por escritura)
+    cuando se rebasa el máximo (ORDERS_CACHE_MAX_ENTRIES por default).
+    El get/modificar/set del índice se hace bajo un candado cache.add (igual que
+    el de la estampida en cached_fetch_orders) para que dos workers no se pisen
+    el índice. Si el candado no se libera a tiempo no se registra nada: cada
+    entrada tiene su propio TTL, así que lo peor es que viva hasta que venza.
+    """
+    cache = _cache()
+    lock_key = f"{index_key}:lock"
+    deadline = time.monotonic() + INDEX_LOCK_WAIT_SECONDS
+    while not cache.add(lock_key, 1, INDEX_LOCK_TIMEOUT):
+        if time.monotonic() >= deadline:
+            logger.warning("Índice %s ocupado; %d llaves quedan solo con su TTL", index_key, len(keys))
+            return
+        time.sleep(INDEX_LOCK_WAIT_STEP)
+    try:
+        index = cache.get(index_key) or {}
+        now = time.time()
+        for key in keys:
+            index[key] = now
+        if max_entries is None:
+            max_entries = conf.get("ORDERS_CACHE_MAX_ENTRIES")
+        if len(index) > max_entries:
+            evicted = sorted(index, key=index.get)[:len(index) - max_entries]
+            for k in evicted:
+                index.pop(k, None)
+            cache.delete_many(evicted)
+            _incr(stat, len(evicted))
+        cache.set(index_key, index, None)
+    finally:
+        cache.delete(lock_key)
+
+
+def _digest(rows):
+    return hashlib.sha1(repr(rows).encode("utf-8")).hexdigest()
+
+
+def _store(key, rows, digest):
+    ttl = conf.get("ORDERS_CACHE_TTL")
+    entry = {"rows": rows, "fetched_at": time.time(), "digest": digest}
+    _cache().set(key, entry, ttl + conf.get("ORDERS_CACHE_STALE_TTL"))
+    _remember([key])
+    return entry
+
+
+def orders_source():
+    """fetch_orders del ERP o del espejo local, según BOARD_ORDERS_SOURCE."""
+    if conf.get("ORDERS_SOURCE") == "mirror":
+        from .mirror import fetch_orders_mirror
+        return fetch_orders_mirror
+    return fetch_orders
+
+
+def _refresh(key, query, previous=None):
+    # Se consulta con los valores originales (datetime aware, etc.); la forma
+    # normalizada solo sirve para la llave.
+    try:
+        rows = orders_source()(**query, fail_silently=False)
+    except OperationalError as exc:
+        # ERP caído/lento (o circuito abierto): nunca pisar el último snapshot
+        # bueno con []; se conserva más tiempo y se marca como viejo
+        _incr("refresh_errors")
+        logger.warning("Refresco de snapshot falló: %s", exc)
+        if previous is None:
+            return {"rows": [], "fetched_at": None, "failed_at": time.time()}
+        entry = {**previous, "failed_at": time.time()}
+        _cache().set(key, entry, conf.get("ORDERS_CACHE_KEEP_ON_ERROR"))
+        if not previous.get("failed_at"):
+            events.publish()  # que los tableros muestren el aviso de datos viejos
+        return entry
+    _incr("refreshes")
+    digest = _digest(rows)
+    changed = previous is not None and previous.get("digest") != digest
+    if changed or (previous is not None and previous.get("failed_at")):
+        # El ERP cambió (o volvió): un solo refresco avisa a todos los tableros conectados
+        events.publish()
+    entry = _store(key, rows, digest)
+    if changed:
+        try:
+            # Un cliente renombrado (o folio corregido) en el ERP también cambia lo que encuentra la búsqueda
+            search_index.reindex_changed(previous["rows"], rows)
+        except Exception:
+            logger.exception("Reindexar búsqueda tras refresco falló")
+    return entry
+
+
+def cached_fetch_orders(date_from=None, date_to=None, search=None, limit=None, doc_ids=None):
+    """
+    Igual que erp.fetch_orders pero a través del cache compartido:
+      - fresco (edad < TTL): se sirve directo.
+      - vencido: UN solo worker (candado con cache.add) refresca; el resto sigue
+        sirviendo el snapshot anterior hasta que llegue el nuevo.
+      - en frío: el primero consulta al ERP y los demás esperan unos instantes
+        a que aparezca el snapshot antes de consultar por su cuenta.
+      - ERP caído: se sigue sirviendo el último snapshot bueno, marcado stale.
+    Devuelve un Snapshot (lista de filas + fetched_at / stale).
+    """
+    cache = _cache()
+    query = dict(date_from=date_from, date_to=date_to, search=search, limit=limit, doc_ids=doc_ids)
+    key = _snapshot_key(normalize_filters(**query))
+    lock_key = f"{key}:lock"
+    lock_timeout = conf.get("ORDERS_CACHE_LOCK_TIMEOUT")
+
+    entry = cache.get(key)
+    if entry is not None:
+        if time.time() - entry["fetched_at"] < conf.get("ORDERS_CACHE_TTL"):
+            _incr("hits")
+            return _served(entry)
+        if not cache.add(lock_key, 1, lock_timeout):
+            _incr("stale_hits")
+            return _served(entry)
+        try:
+            _incr("misses")
+            return _served(_refresh(key, query, previous=entry))
+        finally:
+            cache.delete(lock_key)
+
+    _incr("misses")
+    if not cache.add(lock_key, 1, lock_timeout):
+        deadline = time.monotonic() + COLD_WAIT_SECONDS
+        while time.monotonic() < deadline:
+            time.sleep(COLD_WAIT_STEP)
+            entry = cache.get(key)
+            if entry is not None:
+                return _served(entry)
+        return _served(_refresh(key, query))
+    try:
+        return _served(_refresh(key, query))
+    finally:
+        cache.delete(lock_key)
+
+
+# ====== Tableros activos (refresco para SSE) ======
+
+def remember_board(date_from=None, search=None, limit=None):
+    """
+    Anota los filtros de un tablero que pidió su snapshot, para que
+    refresh_boards() lo siga refrescando. Vive EVENTS_BOARD_TTL segundos y cada
+    petición del tablero (poll de respaldo, delta tras un aviso) lo renueva.
+    """
+    cache = _cache()
+    query = dict(date_from=date_from, search=search, limit=limit)
+    key = _snapshot_key(normalize_filters(**query)).replace(KEY_PREFIX, BOARDS_PREFIX, 1)
+    ttl = conf.get("EVENTS_BOARD_TTL")
+    if cache.add(key, query, ttl):
+        _remember([key], index_key=BOARDS_INDEX_KEY, stat="boards_evictions")
+    else:
+        cache.touch(key, ttl)
+
+
+def refresh_boards():
+    """
+    Pasa por cached_fetch_orders los snapshots de los tableros activos (ver
+    remember_board): si el ERP trajo cambios, _refresh publica y todos los
+    tableros conectados por SSE piden su delta, aunque ninguno esté pidiendo
+    datos. Uno por despliegue: el candado vence a los ORDERS_CACHE_TTL y no se
+    suelta, así que en cada periodo solo el primer proceso que llega refresca.
+    Devuelve cuántos tableros revisó, o None si el turno era de otro proceso.
+    """
+    cache = _cache()
+    if not cache.add(BOARDS_REFRESH_LOCK, 1, conf.get("ORDERS_CACHE_TTL")):
+        return None
+    boards = cache.get_many(list(cache.get(BOARDS_INDEX_KEY) or {}))
+    for query in boards.values():
+        try:
+            cached_fetch_orders(**query)
+        except Exception:
+            logger.exception("Refresco de tablero para SSE falló")
+    return len(boards)
+
+
+# ====== Partidas (items) por doc_id ======
+
+def _items_key(doc_id):
+    return f"{ITEMS_PREFIX}:{int(doc_id)}"
+
+
+def cached_fetch_items(doc_ids, pend_u=None):
+    """
+    {doc_id: items} leyendo primero del cache y pidiendo al ERP SOLO los que
+    faltan, todos en un query (fetch_items_many).
+    pend_u: {doc_id: unidades pendientes actuales}. Si el valor guardado junto a
+    las partidas no coincide, la entrada se considera inválida (el pedido se
+    surtió/modificó) y se vuelve a leer.
+    """
+    cache = _cache()
+    pend_u = pend_u or {}
+    keys = {d: _items_key(d) for d in doc_ids}
+    found = cache.get_many(keys.values())
+
+    result, missing = {}, []
+    for doc_id, key in keys.items():
+        entry = found.get(key)
+        if entry is not None and (doc_id not in pend_u or entry["pend_u"] == pend_u[doc_id]):
+            result[doc_id] = entry["items"]
+        else:
+            missing.append(doc_id)
+
+    if result:
+        _incr("items_hits", len(result))
+    if missing:
+        _incr("items_misses", len(missing))
+        try:
+            fetched = fetch_items_many(missing, fail_silently=False)
+        except OperationalError:
+            # No cachear una falla del ERP
+            return {**result, **{d: [] for d in missing}}
+        cache.set_many(
+            {keys[d]: {"items": fetched.get(d, []), "pend_u": pend_u.get(d)} for d in missing},
+            conf.get("ITEMS_CACHE_TTL"),
+        )
+        _remember(
+            [keys[d] for d in missing], index_key=ITEMS_INDEX_KEY,
+            max_entries=conf.get("ITEMS_CACHE_MAX_ENTRIES"), stat="items_evictions",
+        )
+        result.update(fetched)
+    return result
+
+
+def peek_items(doc_id):
+    """
+    Partidas de doc_id cuando todavía no se conoce su pend_u (para pedirlas a
+    la vez que la orden): ("cache", entrada) si hay entrada guardada; si no,
+    ("erp", partidas) recién leídas, o ("error", []) si el ERP falló.
+    Se completa con settle_items() al conocer pend_u.
+    """
+    entry = _cache().get(_items_key(doc_id))
+    if entry is not None:
+        return "cache", entry
+    try:
+        return "erp", fetch_items_many([doc_id], fail_silently=False).get(doc_id, [])
+    except OperationalError:
+        return "error", []
+
+
+def settle_items(doc_id, peeked, pend_u=None):
+    """
+    Resultado de peek_items() validado contra el pend_u actual, con las mismas
+    reglas que cached_fetch_items: lo leído del ERP se guarda con ese pend_u;
+    una entrada vieja (el pedido se surtió) se vuelve a leer.
+    """
+    source, value = peeked
+    if source == "error":
+        _incr("items_misses")
+        return []
+    if source == "erp":
+        _incr("items_misses")
+        key = _items_key(doc_id)
+        _cache().set(key, {"items": value, "pend_u": pend_u}, conf.get("ITEMS_CACHE_TTL"))
+        _remember(
+            [key], index_key=ITEMS_INDEX_KEY,
+            max_entries=conf.get("ITEMS_CACHE_MAX_ENTRIES"), stat="items_evictions",
+        )
+        return value
+    if pend_u is None or value["pend_u"] == pend_u:
+        _incr("items_hits")
+        return value["items"]
+    return cached_fetch_items([doc_id], {doc_id: pend_u})[doc_id]
+
+
+def invalidate_items(doc_ids):
+    """
+    Olvida las partidas cacheadas de doc_ids. Para cambios que el pend_u guardado
+    no delata (p. ej. se editó una partida y total_u cambió sin surtir nada).
+    """
+    if doc_ids:
+        _cache().delete_many([_items_key(d) for d in doc_ids])
+
+
+def prefetch_items(cards):
+    """
+    Precarga en segundo plano las partidas de las tarjetas visibles que aún no
+    están en cache, para que abrir el modal no cueste un viaje al ERP.
+    Un candado compartido evita que varios workers precarguen a la vez.
+    """
+    if not conf.get("ITEMS_PREFETCH") or not cards:
+        return None
+    cache = _cache()
+    pend_u = {c["pk"]: c.get("pend_u") for c in cards}
+    found = cache.get_many([_items_key(d) for d in pend_u])
+    missing = [
+        d for d in pend_u
+        if _items_key(d) not in found or found[_items_key(d)]["pend_u"] != pend_u[d]
+    ]
+    if not missing or not cache.add(f"{ITEMS_PREFIX}:prefetch:lock", 1, 60):
+        return None
+
+    def run():
+        try:
+            chunk = conf.get("ITEMS_PREFETCH_CHUNK")
+            for i in range(0, len(missing), chunk):
+                part = missing[i:i + chunk]
+                cached_fetch_items(part, {d: pend_u[d] for d in part})
+        except Exception:
+            logger.exception("Precarga de partidas falló")
+        finally:
+            cache.delete(f"{ITEMS_PREFIX}:prefetch:lock")
+            connections.close_all()
+
+    thread = threading.Thread(target=run, name="board-items-prefetch", daemon=True)
+    thread.start()
+    return thread
+
+
+# ====== Fragmentos HTML por tarjeta ======
+
+CARD_TEMPLATE = "board/_card.html"
+
+
+def _card_key(card, oob):
+    # La firma cubre todo lo que pinta la tarjeta (status, errores, fechas, folio...);
+    # idioma y zona horaria cambian cómo se formatean números y fechas
+    return ":".join((
+        CARDS_PREFIX,
+        str(conf.get("CARD_FRAGMENT_VERSION")),
+        translation.get_language() or "",
+        timezone.get_current_timezone_name(),
+        "oob" if oob else "in",
+        str(card["pk"]),
+        card_signature(card),
+    ))
+
+
+def render_cards(cards, oob=False):
+    """
+    HTML de cada tarjeta (en orden): un get_many al cache y solo se renderizan
+    las que cambiaron desde la última vez (o nunca se habían pintado).
+    """
+    if not conf.get("CARD_FRAGMENT_CACHE"):
+        return [render_to_string(CARD_TEMPLATE, {"o": c, "oob": oob}) for c in cards]
+
+    cache = _cache()
+    keys = [_card_key(c, oob) for c in cards]
+    found = cache.get_many(keys)
+
+    html, rendered = [], {}
+    for card, key in zip(cards, keys):
+        fragment = found.get(key)
+        if fragment is None:
+            fragment = rendered[key] = render_to_string(CARD_TEMPLATE, {"o": card, "oob": oob})
+        html.append(fragment)
+
+    if found:
+        _incr("cards_hits", len(found))
+    if rendered:
+        _incr("cards_misses", len(rendered))
+        cache.set_many(rendered, conf.get("CARD_FRAGMENT_TTL"))
+        _remember(
+            list(rendered), index_key=CARDS_INDEX_KEY,
+            max_entries=conf.get("CARD_FRAGMENT_MAX_ENTRIES"), stat="cards_evictions",
+        )
+    return html
@@ -0,0 +1,119 @@
+import hashlib
+import time
+
+from django.core.cache import caches
+
+from .. import conf
+
+KEY_PREFIX = "board:delta"
+
+
+def _cache():
+    return caches[conf.get("CACHE_ALIAS")]
+
+
+def board_key(view_mode, search, date_from):
+    """Identifica un tablero (misma vista + filtros) para comparar sus polls."""
+    raw = repr((view_mode or "relevantes", (search or "").strip(), str(date_from or "")))
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()[:16]
+
+
+def card_signature(card):
+    # updated_at se evalúa aparte contra 'since'; no forma parte de la firma
+    raw = repr(sorted((k, v) for k, v in card.items() if k != "updated_at"))
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+
+def board_etag(key, cards, variant=""):
+    """
+    Huella del tablero para ETag: por tarjeta, en orden, su pk, su firma (status,
+    campos de error y demás datos visibles) y updated_at. Mucho más barato que
+    renderizar; 'variant' separa respuestas distintas para el mismo tablero.
+    """
+    h = hashlib.sha1(f"{variant}:{key}".encode("utf-8"))
+    for card in cards:
+        updated_at = card.get("updated_at")
+        h.update(f"{card['pk']}:{card_signature(card)}:{updated_at.timestamp() if updated_at else ''};".encode("utf-8"))
+    return h.hexdigest()[:24]
+
+
+def track(key, cards, now=None):
+    """
+    Compara las tarjetas actuales contra las firmas guardadas del tablero y
+    anota cuándo apareció, cambió o desapareció cada una. El estado vive en el
+    cache compartido, así cualquier worker puede contestar el siguiente poll.
+
+    Estado: {"created": ts, "cards": {pk: [firma, added_at, changed_at]}, "removed": {pk: ts}}
+    """
+    now = now or time.time()
+    cache = _cache()
+    cache_key = f"{KEY_PREFIX}:{key}"
+    max_gap = conf.get("DELTA_MAX_GAP")
+
+    state = cache.get(cache_key)
+    dirty = state is None
+    if state is None:
+        state = {"created": now, "cards": {}, "removed": {}}
+
+    prev = state["cards"]
+    current = {}
+    for card in cards:
+        pk = card["pk"]
+        sig = card_signature(card)
+        old = prev.get(pk)
+        if old is None:
+            current[pk] = [sig, now, now]
+            state["removed"].pop(pk, None)
+            dirty = True
+        elif old[0] != sig:
+            current[pk] = [sig, old[1], now]
+            dirty = True
+        else:
+            current[pk] = old
+
+    for pk in prev.keys() - current.keys():
+        state["removed"][pk] = now
+        dirty = True
+    for pk, ts in list(state["removed"].items()):
+        if now - ts > max_gap:
+            del state["removed"][pk]
+            dirty = True
+
+    state["cards"] = current
+    if dirty:
+        cache.set(cache_key, state, max_gap * 2)
+    return state
+
+
+def changes_since(state, cards, since, now=None):
+    """
+    Qué necesita un cliente cuyo último render fue en 'since' (timestamp):
+    (agregadas, cambiadas, pks_removidos). Devuelve None cuando conviene un
+    render completo: historia insuficiente, hueco muy grande, demasiados cambios
+    o tarjetas nuevas que no caen al final del tablero.
+    """
+    now = now or time.time()
+    if since < state["created"] or now - since > conf.get("DELTA_MAX_GAP"):
+        return None
+
+    added, changed = [], []
+    for card in cards:
+        _, added_at, changed_at = state["cards"][card["pk"]]
+        updated_at = card.get("updated_at")
+        if added_at > since:
+            added.append(card)
+        elif changed_at > since or (updated_at and updated_at.timestamp() > since):
+            changed.append(card)
+
+    removed = [pk for pk, ts in state["removed"].items() if ts > since]
+
+    if len(added) + len(changed) + len(removed) > conf.get("DELTA_MAX_CARDS"):
+        return None
+    # Tablero vacío en el cliente ("Sin órdenes"): no hay dónde anexar tarjetas
+    if added and len(added) == len(cards):
+        return None
+    # Las agregadas se anexan al final de #cards: solo sirve si en el orden
+    # actual del tablero también van al final; si no, render completo
+    if added and [c["pk"] for c in cards[-len(added):]] != [c["pk"] for c in added]:
+        return None
+    return added, changed, removed
@@ -1,50 +1,30 @@
+import heapq
+import logging
+import threading
+import time
+import uuid
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import date, datetime
+from decimal import Decimal
+
+from django.core.cache import caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
 from django.db import connections
 from django.db.utils import OperationalError
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
 
-def fetch_orders(date_from=None, date_to=None, search=None, limit=None, doc_ids=None):
-    """
-    Lee pedidos del ERP (MSSQL) con filtros:
-      - date_from / date_to: rango de D.CFECHA (incluyente / excluyente según convenga)
-      - search: folio (numérico) o cliente (LIKE)
-      - limit: TOP n
-      - doc_ids: lista de CIDDOCUMENTO a incluir (acelera 'pasados')
-    Devuelve:
-      doc_id, folio, cliente, fecha_creacion, fecha_entrega, observ,
-      total_u, pend_u, vendedor, almacen_calc, metodo_entrega, status_erp
-    """
-    where = ["D.CIDCONCEPTODOCUMENTO = 2"]
-    params = []
+from .. import conf
+from . import metrics
+from .breaker import erp_breaker
 
-    if date_from:
-        where.append("D.CFECHA >= %s")
-        params.append(date_from)
-    if date_to:
-        where.append("D.CFECHA < %s")
-        params.append(date_to)
+logger = logging.getLogger(__name__)
 
-    # filtro por doc_ids (MUY útil para 'pasados')
-    if doc_ids:
-        # arma una lista de placeholders
-        placeholders = ",".join(["%s"] * len(doc_ids))
-        where.append(f"D.CIDDOCUMENTO IN ({placeholders})")
-        params.extend(doc_ids)
+ERP_ALIAS = "erp"
 
-    if search:
-        s_raw = str(search).strip()
-        s_digits = ''.join(ch for ch in s_raw if ch.isdigit())
-        if s_digits:
-            where.append("(D.CFOLIO = %s OR CAST(D.CFOLIO AS VARCHAR(50)) LIKE %s)")
-            params.extend([int(s_digits), f"%{s_digits}%"])
-        else:
-            where.append("D.CRAZONSOCIAL LIKE %s")
-            params.append(f"%{s_raw}%")
-
-    where_clause = " AND ".join(where)
-    top_clause = f"TOP ({int(limit)})" if limit else ""
-    order_in_cte = "ORDER BY D.CFECHA DESC" if limit else ""
-
-    # NOTA: limit -> ORDER BY en CTE; sin limit -> ORDER BY solo al final
-    sql = f"""
+# Query base de pedidos. Huecos: top_clause, where_clause, order_in_cte, limit_clause, order_by.
+ORDERS_SQL = """
     ;WITH base AS (
       SELECT {top_clause}
         D.CIDDOCUMENTO      AS doc_id,
@@ -61,6 +41,7 @@ def fetch_orders(date_from=None, date_to=None, search=None, limit=None, doc_ids=
       LEFT JOIN dbo.admAgentes A ON A.CIDAGENTE = D.CIDAGENTE
       WHERE {where_clause}
       {order_in_cte}
+      {limit_clause}
     ),
     almacenes AS (
       SELECT
@@ -80,35 +61,535 @@ def fetch_orders(date_from=None, date_to=None, search=None, limit=None, doc_ids=
     FROM base B
     LEFT JOIN almacenes A ON A.doc_id = B.doc_id
     ORDER BY
+      {order_by};
+    """
+
+# Folios no numéricos (NULL) al final, como siempre se mostró el tablero
+ORDER_BY_FOLIO = """CASE WHEN TRY_CONVERT(int, B.folio) IS NULL THEN 1 ELSE 0 END ASC,
       TRY_CONVERT(int, B.folio) ASC,
       B.folio ASC,
-      B.doc_id ASC;
+      B.doc_id ASC"""
+
+
+# SQLite (stand-in local del ERP, ver erp_standin) no tiene TRY_CONVERT
+SQLITE_TRY_INT = "(CASE WHEN typeof({col}) IN ('integer', 'real') THEN CAST({col} AS INTEGER) END)"
+
+
+def _vendor():
+    return connections[ERP_ALIAS].vendor
+
+
+def _for_vendor(sql):
+    """
+    Los queries están escritos para SQL Server. Para el stand-in local (SQLite)
+    se hacen los ajustes mínimos: sin ';' inicial, sin esquema dbo., sin TRY_CONVERT.
+    """
+    if _vendor() != "sqlite":
+        return sql
+    sql = sql.lstrip().lstrip(";").replace("dbo.", "")
+    return sql.replace("TRY_CONVERT(int, B.folio)", SQLITE_TRY_INT.format(col="B.folio"))
+
+
+def _limit_clauses(limit):
+    """(top_clause, limit_clause) según el motor: TOP (n) en SQL Server, LIMIT n en SQLite."""
+    if not limit:
+        return "", ""
+    if _vendor() == "sqlite":
+        return "", f"LIMIT {int(limit)}"
+    return f"TOP ({int(limit)})", ""
+
+
+def fetch_orders(date_from=None, date_to=None, search=None, limit=None, doc_ids=None, fail_silently=True):
     """
+    Lee pedidos del ERP (MSSQL) con filtros:
+      - date_from / date_to: rango de D.CFECHA (incluyente / excluyente según convenga)
+      - search: folio (numérico) o cliente (LIKE)
+      - limit: TOP n
+      - doc_ids: lista de CIDDOCUMENTO a incluir (acelera 'pasados')
+      - fail_silently: si el ERP no responde devuelve [] (default) en vez de propagar
+    Devuelve filas OrderRow (se leen como dict), ya en el orden por folio
+    que muestra el tablero:
+      doc_id, folio, cliente, fecha_creacion, fecha_entrega, observ,
+      total_u, pend_u, vendedor, almacen_calc, metodo_entrega, status_erp
+    """
+    if doc_ids:
+        return _fetch_orders_by_ids(date_from, date_to, search, limit, doc_ids, fail_silently)
+    return _fetch_orders_query(date_from, date_to, search, limit, None, fail_silently)
+
+
+def _fetch_orders_query(date_from, date_to, search, limit, doc_ids, fail_silently):
+    where = ["D.CIDCONCEPTODOCUMENTO = 2"]
+    params = []
+
+    if date_from:
+        where.append("D.CFECHA >= %s")
+        params.append(date_from)
+    if date_to:
+        where.append("D.CFECHA < %s")
+        params.append(date_to)
+
+    # filtro por doc_ids (MUY útil para 'pasados'); llega ya en bloque de tamaño fijo
+    if doc_ids:
+        # arma una lista de placeholders
+        placeholders = ",".join(["%s"] * len(doc_ids))
+        where.append(f"D.CIDDOCUMENTO IN ({placeholders})")
+        params.extend(doc_ids)
+
+    if search:
+        s_raw = str(search).strip()
+        s_digits = ''.join(ch for ch in s_raw if ch.isdigit())
+        if s_digits:
+            where.append("(D.CFOLIO = %s OR CAST(D.CFOLIO AS VARCHAR(50)) LIKE %s)")
+            params.extend([int(s_digits), f"%{s_digits}%"])
+        else:
+            where.append("D.CRAZONSOCIAL LIKE %s")
+            params.append(f"%{s_raw}%")
+
+    where_clause = " AND ".join(where)
+    top_clause, limit_clause = _limit_clauses(limit)
+    order_in_cte = "ORDER BY D.CFECHA DESC" if limit else ""
+
+    # NOTA: limit -> ORDER BY en CTE; sin limit -> ORDER BY solo al final
+    sql = ORDERS_SQL.format(
+        top_clause=top_clause,
+        where_clause=where_clause,
+        order_in_cte=order_in_cte,
+        limit_clause=limit_clause,
+        order_by=ORDER_BY_FOLIO,
+    )
+    return _run_orders(sql, params, fail_silently, variant=_orders_variant(date_from or date_to, doc_ids, search, limit))
+
+
+def _orders_variant(dates, doc_ids, search, limit):
+    """Etiqueta acotada de la forma del SQL (para métricas): 'date+ids32+top', 'cliente', 'all'..."""
+    parts = []
+    if dates:
+        parts.append("date")
+    if doc_ids:
+        parts.append(f"ids{len(doc_ids)}")
+    if search:
+        parts.append("folio" if any(ch.isdigit() for ch in str(search)) else "cliente")
+    if limit:
+        parts.append("top")
+    return "+".join(parts) or "all"
+
 
+# ====== doc_ids en bloques de tamaño fijo ======
+# Cada longitud distinta de IN (...) es un texto SQL distinto para SQL Server
+# (plan nuevo, recompilación). Rellenando a unos cuantos tamaños fijos el plan
+# cache solo ve len(ERP_DOC_ID_BUCKETS) variantes, y los bloques grandes nunca
+# se acercan al límite de 2100 parámetros.
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _executor():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ThreadPoolExecutor(
+                max_workers=conf.get("ERP_CHUNK_WORKERS"), thread_name_prefix="erp-chunk",
+            )
+    return _pool
+
+
+def _pad_ids(ids):
+    """Rellena (repitiendo el último id) hasta el siguiente tamaño de bloque."""
+    bucket = next((b for b in conf.get("ERP_DOC_ID_BUCKETS") if b >= len(ids)), len(ids))
+    return ids + [ids[-1]] * (bucket - len(ids))
+
+
+def _folio_sort_key(r):
+    # Mismo orden que ORDER_BY_FOLIO: TRY_CONVERT(int, folio) (NULL al final), folio, doc_id
+    folio = r['folio']
+    if isinstance(folio, (int, float, Decimal)):
+        num = int(folio)
+    else:
+        try:
+            num = int(str(folio).strip())
+        except (TypeError, ValueError):
+            num = None
+    return (num is None, num or 0, str(folio), r['doc_id'])
+
+
+def _chunk_worker(args):
+    # Cada hilo del pool conserva su propia conexión (el gateway la revisa)
+    return _fetch_orders_query(*args)
+
+
+def _fetch_orders_by_ids(date_from, date_to, search, limit, doc_ids, fail_silently):
+    ids = list(dict.fromkeys(int(d) for d in doc_ids))
+    size = conf.get("ERP_DOC_ID_BUCKETS")[-1]
+    chunks = [ids[i:i + size] for i in range(0, len(ids), size)]
+
+    if len(chunks) == 1:
+        return _fetch_orders_query(date_from, date_to, search, limit, _pad_ids(chunks[0]), fail_silently)
+
+    # Bloques independientes en paralelo; se mezclan en el orden por folio del query original
+    jobs = [(date_from, date_to, search, limit, _pad_ids(c), False) for c in chunks]
     try:
-        with connections['erp'].cursor() as cur:
-            cur.execute(sql, params)
-            cols = [c[0] for c in cur.description]
-            rows = [dict(zip(cols, r)) for r in cur.fetchall()]
+        with metrics.timer("board_erp_query_seconds", timing="erp", op="orders", variant="chunked"):
+            parts = list(_executor().map(_chunk_worker, jobs))
     except OperationalError:
+        if not fail_silently:
+            raise
         return []
 
-    # Post-proceso
-    for r in rows:
-        obs = (r.get('observ') or '').strip()
-        r['metodo_entrega'] = (
-            'Paquetería' if '1' in obs else
-            'Repartidor' if '2' in obs else
-            'Sucursal'   if '3' in obs else
-            'Desconocido'
-        )
-        r['status_erp'] = 'SURTIDO' if r['pend_u'] < r['total_u'] else 'PENDIENTE'
+    if limit:
+        # TOP n global = los n más recientes de todos los bloques
+        rows = sorted((r for part in parts for r in part), key=lambda r: r['fecha_creacion'], reverse=True)
+        return sorted(rows[:int(limit)], key=_folio_sort_key)
+    # Cada bloque ya viene ordenado por folio: basta mezclarlos
+    return list(heapq.merge(*parts, key=_folio_sort_key))
+
+
+def fetch_orders_after(doc_id, limit=1000, fail_silently=True):
+    """
+    Lote incremental para el espejo local: los siguientes 'limit' pedidos con
+    CIDDOCUMENTO > doc_id (marca de agua), en orden de doc_id.
+    """
+    top_clause, limit_clause = _limit_clauses(limit)
+    sql = ORDERS_SQL.format(
+        top_clause=top_clause,
+        where_clause="D.CIDCONCEPTODOCUMENTO = 2 AND D.CIDDOCUMENTO > %s",
+        order_in_cte="ORDER BY D.CIDDOCUMENTO ASC",
+        limit_clause=limit_clause,
+        order_by="B.doc_id ASC",
+    )
+    return _run_orders(sql, [int(doc_id or 0)], fail_silently, op="orders_after", variant="watermark")
+
+
+def _metodo_entrega(observ):
+    obs = (observ or '').strip()
+    return (
+        'Paquetería' if '1' in obs else
+        'Repartidor' if '2' in obs else
+        'Sucursal'   if '3' in obs else
+        'Desconocido'
+    )
+
+
+def _status_erp(pend_u, total_u):
+    return 'SURTIDO' if pend_u < total_u else 'PENDIENTE'
+
+
+def as_date(val):
+    """Fecha (date) de un valor del ERP o de un filtro: date, datetime (aware -> local) o texto ISO."""
+    if val in (None, ""):
+        return None
+    if isinstance(val, datetime):
+        return timezone.localtime(val).date() if timezone.is_aware(val) else val.date()
+    if isinstance(val, date):
+        return val
+    s = str(val).strip()
+    dt = parse_datetime(s)
+    return dt.date() if dt else parse_date(s)
+
+
+def folio_parts(val):
+    """Folio como texto ('1234' en vez de '1234.0') + su valor numérico para ordenar."""
+    if val is None:
+        return None, None
+    try:
+        num = int(float(str(val).strip()))
+    except (TypeError, ValueError):
+        return str(val).strip(), None
+    return str(num), num
+
+
+# Columnas de ORDERS_SQL, en el orden del SELECT final
+ORDER_FIELDS = (
+    "doc_id", "folio", "cliente", "fecha_creacion", "fecha_entrega", "observ",
+    "referencia", "total_u", "pend_u", "vendedor", "almacen_calc",
+)
+
+
+class OrderRow:
+    """
+    Fila de pedido compacta: __slots__ en vez de un dict por fila, y los
+    campos calculados (metodo_entrega, status_erp) en la misma pasada en que
+    se lee el cursor. Se usa como el dict de siempre (row["folio"],
+    row.get("almacen_calc")), así que el resto del código no cambia.
+    Se comparte entre hilos (coalescing): tratarla como de solo lectura.
+    """
+
+    __slots__ = ORDER_FIELDS + ("metodo_entrega", "status_erp")
+
+    def __init__(self, doc_id, folio, cliente, fecha_creacion, fecha_entrega, observ,
+                 referencia, total_u, pend_u, vendedor, almacen_calc):
+        self.doc_id = doc_id
+        self.folio = folio
+        self.cliente = cliente
+        self.fecha_creacion = fecha_creacion
+        self.fecha_entrega = fecha_entrega
+        self.observ = observ
+        self.referencia = referencia
+        self.total_u = total_u
+        self.pend_u = pend_u
+        self.vendedor = vendedor
+        self.almacen_calc = almacen_calc
+        self.metodo_entrega = _metodo_entrega(observ)
+        self.status_erp = _status_erp(pend_u, total_u)
+
+    @classmethod
+    def reader(cls, cols):
+        """tupla del cursor -> OrderRow, para las columnas 'cols' del query."""
+        if tuple(cols) == ORDER_FIELDS:
+            return lambda t: cls(*t)
+        positions = [cols.index(name) if name in cols else None for name in ORDER_FIELDS]
+        return lambda t: cls(*(None if i is None else t[i] for i in positions))
+
+    def __getitem__(self, key):
+        if key not in self.__slots__:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def get(self, key, default=None):
+        return getattr(self, key) if key in self.__slots__ else default
+
+    def __contains__(self, key):
+        return key in self.__slots__
+
+    def keys(self):
+        return self.__slots__
+
+    def values(self):
+        return tuple(getattr(self, name) for name in self.__slots__)
+
+    def __eq__(self, other):
+        if isinstance(other, OrderRow):
+            return self.values() == other.values()
+        return NotImplemented
+
+    __hash__ = None
+
+    def __repr__(self):
+        # Estable: lo usa el digest del cache de snapshots
+        return f"OrderRow{self.values()!r}"
+
+    def __reduce__(self):
+        # Pickle compacto para el cache: solo la tupla de valores
+        return _order_row, (self.values(),)
+
+
+def _order_row(values):
+    row = OrderRow.__new__(OrderRow)
+    for name, value in zip(OrderRow.__slots__, values):
+        setattr(row, name, value)
+    return row
+
+
+def _set_query_timeout(conn):
+    # pyodbc (mssql-django): Connection.timeout es el timeout por query en segundos;
+    # al vencer, el driver cancela y lanza OperationalError (HYT00).
+    # SQLite (stand-in) no tiene equivalente y se queda como está.
+    raw = conn.connection
+    timeout = conf.get("ERP_QUERY_TIMEOUT")
+    if timeout and hasattr(raw, "timeout") and raw.timeout != timeout:
+        raw.timeout = timeout
+
+
+class ErpBusy(OperationalError):
+    """No se liberó un lugar para consultar el ERP dentro de ERP_QUEUE_TIMEOUT."""
+
+
+class ErpGateway:
+    """
+    Todo query al ERP pasa por aquí (ver _execute). En orden:
+      1) coalescing: si este proceso ya está corriendo el MISMO query (sql +
+         parámetros), se espera ese resultado en vez de lanzar otro;
+      2) circuit breaker (breaker.erp_breaker): si está abierto, falla al instante;
+      3) límite global de queries simultáneos (ERP_MAX_CONCURRENT, compartido
+         entre workers vía cache.add); quien no alcanza lugar reintenta cada
+         QUEUE_STEP s (sondeo, sin orden de llegada) hasta ERP_QUEUE_TIMEOUT
+         y luego recibe ErpBusy;
+      4) la conexión del hilo, revisada cada ERP_CONN_CHECK_INTERVAL s, con
+         timeout por query.
+
+    El límite solo es global si CACHE_ALIAS es un cache compartido (Redis,
+    memcached, DB). Con LocMemCache cada proceso cuenta sus propios lugares
+    (el total real es ERP_MAX_CONCURRENT x procesos) y con DummyCache no hay
+    límite; se avisa una vez en el log.
+
+    La persistencia de la conexión se configura en settings, no aquí:
+        DATABASES["erp"] = {..., "CONN_MAX_AGE": 300, "CONN_HEALTH_CHECKS": True}
+    """
+
+    SLOT_PREFIX = "board:erp:slot"
+    QUEUE_STEP = 0.05
+    STATS = ("executed", "coalesced", "queued", "busy", "reconnects")
+
+    def __init__(self):
+        self._inflight = {}
+        self._lock = threading.Lock()
+        self._warned_local = False
+        self.stats = dict.fromkeys(self.STATS, 0)
+
+    def _count(self, name, delta=1):
+        with self._lock:
+            self.stats[name] += delta
+
+    def execute(self, sql, params, row_factory=None):
+        key = (sql, tuple(params), row_factory)
+        with self._lock:
+            future = self._inflight.get(key)
+            leader = future is None
+            if leader:
+                future = self._inflight[key] = Future()
+        if not leader:
+            self._count("coalesced")
+            cols, rows = future.result()
+            return cols, list(rows)
+
+        try:
+            result = self._execute(sql, params, row_factory)
+        except BaseException as exc:
+            future.set_exception(exc)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+
+    def _execute(self, sql, params, row_factory=None):
+        token = erp_breaker.allow()
+        slot = self._acquire_slot()
+        try:
+            conn = self._connection()
+            try:
+                with conn.cursor() as cur:
+                    _set_query_timeout(conn)
+                    cur.execute(_for_vendor(sql), params)
+                    cols = [c[0] for c in cur.description]
+                    rows = _fetch_rows(cur, cols, row_factory)
+            except OperationalError:
+                erp_breaker.failure(token)
+                raise
+        finally:
+            self._release_slot(slot)
+        erp_breaker.success(token)
+        self._count("executed")
+        return cols, rows
+
+    # --- Lugares (semáforo global en el cache compartido) ---
+
+    def _acquire_slot(self):
+        limit = conf.get("ERP_MAX_CONCURRENT")
+        if not limit:
+            return None
+        cache = caches[conf.get("CACHE_ALIAS")]
+        if not self._warned_local and isinstance(cache, (LocMemCache, DummyCache)):
+            self._warned_local = True
+            logger.warning(
+                "ERP_MAX_CONCURRENT=%s con %s: el límite de queries al ERP es por proceso, no global",
+                limit, type(cache).__name__,
+            )
+        # Si un worker muere con un lugar tomado, el lugar caduca solo
+        hold = (conf.get("ERP_QUERY_TIMEOUT") or 60) * 2
+        token = uuid.uuid4().hex
+        deadline = time.monotonic() + conf.get("ERP_QUEUE_TIMEOUT")
+        waited = False
+        while True:
+            for i in range(limit):
+                key = f"{self.SLOT_PREFIX}:{i}"
+                if cache.add(key, token, hold):
+                    if waited:
+                        self._count("queued")
+                    return key, token
+            if time.monotonic() >= deadline:
+                self._count("busy")
+                raise ErpBusy(f"ERP saturado: {limit} queries en curso")
+            waited = True
+            time.sleep(self.QUEUE_STEP)
+
+    def _release_slot(self, slot):
+        if slot is None:
+            return
+        key, token = slot
+        cache = caches[conf.get("CACHE_ALIAS")]
+        # Solo si sigue siendo nuestro (pudo caducar y tomarlo otro)
+        if cache.get(key) == token:
+            cache.delete(key)
+
+    # --- Conexión persistente con revisión periódica ---
+
+    def _connection(self):
+        conn = connections[ERP_ALIAS]
+        # Fuera de un request (pool de bloques, precarga, SSE) nadie llama a
+        # close_old_connections: el gateway descarta la conexión rota u obsoleta
+        now = time.monotonic()
+        if conn.connection is not None and now - getattr(conn, "_gateway_checked_at", 0) >= conf.get("ERP_CONN_CHECK_INTERVAL"):
+            if not conn.in_atomic_block:
+                conn.close_if_unusable_or_obsolete()
+                if conn.connection is None:
+                    self._count("reconnects")
+            conn._gateway_checked_at = now
+        return conn
+
+
+gateway = ErpGateway()
+
+
+def _fetch_rows(cur, cols, row_factory=None):
+    """
+    Lee el cursor en bloques de ERP_FETCH_SIZE; con row_factory(cols) cada
+    bloque se convierte al vuelo, así nunca conviven todas las tuplas crudas
+    con todas las filas ya armadas.
+    """
+    make = row_factory(cols) if row_factory else None
+    size = conf.get("ERP_FETCH_SIZE")
+    rows = []
+    while True:
+        batch = cur.fetchmany(size)
+        if not batch:
+            return rows
+        rows.extend(map(make, batch) if make else batch)
+
+
+def _execute(sql, params, row_factory=None):
+    """
+    Único punto de acceso al ERP (ver ErpGateway). ErpUnavailable (circuito
+    abierto) y ErpBusy (sin lugar) son OperationalError, como un ERP caído.
+    Devuelve (columnas, filas); con row_factory las filas ya vienen convertidas.
+    """
+    return gateway.execute(sql, params, row_factory)
+
+
+def gateway_stats():
+    """Contadores del gateway en este proceso + lugares ocupados en todo el sistema."""
+    limit = conf.get("ERP_MAX_CONCURRENT") or 0
+    busy = caches[conf.get("CACHE_ALIAS")].get_many([f"{ErpGateway.SLOT_PREFIX}:{i}" for i in range(limit)])
+    with gateway._lock:
+        stats = dict(gateway.stats)
+    stats.update({"in_flight": len(busy), "max_concurrent": limit, "coalescing": len(gateway._inflight)})
+    return stats
+
+
+def _timed_execute(sql, params, op, variant, row_factory=None):
+    """_execute + histograma de duración, filas devueltas y entrada 'erp' del Server-Timing."""
+    with metrics.timer("board_erp_query_seconds", timing="erp", op=op, variant=variant):
+        cols, rows = _execute(sql, params, row_factory)
+    metrics.inc("board_erp_rows_total", len(rows), op=op, variant=variant)
+    return cols, rows
+
+
+def _run_orders(sql, params, fail_silently=True, op="orders", variant="all"):
+    """Filas OrderRow (campos calculados incluidos), armadas mientras se lee el cursor."""
+    try:
+        _, rows = _timed_execute(sql, params, op, variant, row_factory=OrderRow.reader)
+    except OperationalError:
+        if not fail_silently:
+            raise
+        return []
     return rows
 
 
-def fetch_items(doc_id):
-    sql = """
+ITEMS_SQL = """
     SELECT
+      M.CIDDOCUMENTO     AS doc_id,
       P.CCODIGOPRODUCTO  AS codigo,
       P.CNOMBREPRODUCTO  AS descripcion,
       AL.CCODIGOALMACEN  AS almacen,
@@ -116,13 +597,34 @@ def fetch_items(doc_id):
     FROM dbo.admMovimientos M
     JOIN dbo.admProductos  P  ON P.CIDPRODUCTO  = M.CIDPRODUCTO
     JOIN dbo.admAlmacenes  AL ON AL.CIDALMACEN  = M.CIDALMACEN
-    WHERE M.CIDDOCUMENTO = %s
-    ORDER BY P.CCODIGOPRODUCTO;
+    WHERE M.CIDDOCUMENTO IN ({placeholders})
+    ORDER BY M.CIDDOCUMENTO, P.CCODIGOPRODUCTO;
+    """
+
+
+def fetch_items(doc_id):
+    return fetch_items_many([doc_id]).get(doc_id, [])
+
+
+def fetch_items_many(doc_ids, fail_silently=True):
+    """
+    Partidas de varios documentos en UN query; agrupadas en Python.
+    Devuelve {doc_id: [ {codigo, descripcion, almacen, unidades}, ... ]}
+    (los doc_ids sin movimientos quedan con lista vacía).
     """
+    doc_ids = list(dict.fromkeys(doc_ids))
+    grouped = {d: [] for d in doc_ids}
+    if not doc_ids:
+        return grouped
+    sql = ITEMS_SQL.format(placeholders=",".join(["%s"] * len(doc_ids)))
     try:
-        with connections['erp'].cursor() as cur:
-            cur.execute(sql, [doc_id])
-            cols = [c[0] for c in cur.description]
-            return [dict(zip(cols, r)) for r in cur.fetchall()]
+        # IN (...) de longitud variable: la etiqueta se agrupa en potencias de 2
+        cols, raw = _timed_execute(sql, doc_ids, "items", f"ids{1 << (len(doc_ids) - 1).bit_length()}")
     except OperationalError:
-        return []
+        if not fail_silently:
+            raise
+        return {d: [] for d in doc_ids}
+    for r in raw:
+        item = dict(zip(cols, r))
+        grouped.setdefault(item.pop('doc_id'), []).append(item)
+    return grouped
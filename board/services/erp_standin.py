@@ -0,0 +1,155 @@
+"""
+ERP de reemplazo (SQLite) con las tablas y columnas de CONTPAQi que usan los
+queries de erp.py. Sirve para pruebas y benchmarks locales sin SQL Server:
+se registra como una conexión más y erp.ERP_ALIAS se apunta a ella.
+"""
+import os
+import random
+import tempfile
+from datetime import datetime, timedelta
+
+from django.db import connections, transaction
+
+ALIAS = "erp_standin"
+
+SCHEMA = (
+    """
+    CREATE TABLE admAgentes (
+      CIDAGENTE      INTEGER PRIMARY KEY,
+      CNOMBREAGENTE  VARCHAR(60)
+    )
+    """,
+    """
+    CREATE TABLE admAlmacenes (
+      CIDALMACEN      INTEGER PRIMARY KEY,
+      CCODIGOALMACEN  VARCHAR(30)
+    )
+    """,
+    """
+    CREATE TABLE admProductos (
+      CIDPRODUCTO      INTEGER PRIMARY KEY,
+      CCODIGOPRODUCTO  VARCHAR(30),
+      CNOMBREPRODUCTO  VARCHAR(60)
+    )
+    """,
+    """
+    CREATE TABLE admDocumentos (
+      CIDDOCUMENTO            INTEGER PRIMARY KEY,
+      CIDCONCEPTODOCUMENTO    INTEGER,
+      CFOLIO                  REAL,
+      CRAZONSOCIAL            VARCHAR(60),
+      CFECHA                  TIMESTAMP,
+      CFECHAENTREGARECEPCION  TIMESTAMP,
+      COBSERVACIONES          TEXT,
+      CREFERENCIA             VARCHAR(20),
+      CTOTALUNIDADES          REAL,
+      CUNIDADESPENDIENTES     REAL,
+      CIDAGENTE               INTEGER
+    )
+    """,
+    """
+    CREATE TABLE admMovimientos (
+      CIDMOVIMIENTO  INTEGER PRIMARY KEY,
+      CIDDOCUMENTO   INTEGER,
+      CIDALMACEN     INTEGER,
+      CIDPRODUCTO    INTEGER,
+      CUNIDADES      REAL
+    )
+    """,
+    "CREATE INDEX admMovimientos_doc ON admMovimientos (CIDDOCUMENTO)",
+    "CREATE INDEX admDocumentos_fecha ON admDocumentos (CFECHA)",
+)
+
+
+def install(alias=ALIAS, path=None):
+    """
+    Registra (o re-registra) la conexión 'alias' apuntando a un archivo SQLite
+    (temporal si no se indica). Archivo y no ':memory:' para que los hilos del
+    pool de erp.py vean los mismos datos. Devuelve la ruta.
+    """
+    if path is None:
+        fd, path = tempfile.mkstemp(prefix="erp_standin_", suffix=".sqlite3")
+        os.close(fd)
+    uninstall(alias, remove_file=False)
+    default = connections.settings["default"]
+    connections.settings.update(connections.configure_settings({
+        "default": default,
+        alias: {"ENGINE": "django.db.backends.sqlite3", "NAME": path},
+    }))
+    return path
+
+
+def uninstall(alias=ALIAS, remove_file=True):
+    if alias not in connections.settings:
+        return
+    path = connections.settings[alias]["NAME"]
+    if hasattr(connections._connections, alias):
+        connections[alias].close()
+        delattr(connections._connections, alias)
+    del connections.settings[alias]
+    if remove_file and os.path.exists(path):
+        os.remove(path)
+
+
+def create_schema(alias=ALIAS):
+    with connections[alias].cursor() as cur:
+        for stmt in SCHEMA:
+            cur.execute(stmt)
+
+
+def seed(n_docs, alias=ALIAS, start=None, seed=7, batch=10000):
+    """
+    Llena el stand-in con n_docs documentos deterministas: casi todos pedidos
+    (concepto 2), algunos de otro concepto, folios únicos (algunos NULL),
+    fechas distintas por documento (cada 13 minutos desde 'start') y 1-4
+    movimientos en 1-3 almacenes. Inserta en lotes de 'batch' documentos para
+    que 500k no vivan completos en memoria.
+    """
+    rnd = random.Random(seed)
+    start = start or datetime(2025, 8, 1, 8, 0)
+    agentes = [(i, f"Agente {i}") for i in range(1, 6)]
+    almacenes = [(i, str(i)) for i in range(1, 4)]
+    productos = [(i, f"P{i:04d}", f"Producto {i}") for i in range(1, 51)]
+
+    with transaction.atomic(using=alias), connections[alias].cursor() as cur:
+        cur.executemany("INSERT INTO admAgentes VALUES (%s, %s)", agentes)
+        cur.executemany("INSERT INTO admAlmacenes VALUES (%s, %s)", almacenes)
+        cur.executemany("INSERT INTO admProductos VALUES (%s, %s, %s)", productos)
+
+        docs, movs, n_movs = [], [], 0
+
+        def flush():
+            cur.executemany(
+                "INSERT INTO admDocumentos VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)", docs,
+            )
+            cur.executemany("INSERT INTO admMovimientos VALUES (%s, %s, %s, %s, %s)", movs)
+            docs.clear()
+            movs.clear()
+
+        for doc_id in range(1, n_docs + 1):
+            total = rnd.randint(1, 20)
+            pend = rnd.choice([0, total, rnd.randint(0, total)])
+            docs.append((
+                doc_id,
+                2 if doc_id % 11 else 3,
+                None if doc_id % 97 == 0 else float(1000 + (doc_id * 7919) % (n_docs * 10)),
+                f"Cliente {rnd.randint(1, n_docs // 3 + 1)}",
+                (start + timedelta(minutes=doc_id * 13)).strftime("%Y-%m-%d %H:%M:%S"),
+                None,
+                rnd.choice(["1", "2", "3", ""]),
+                f"REF{doc_id}",
+                float(total),
+                float(pend),
+                rnd.choice(agentes)[0],
+            ))
+            for _ in range(rnd.randint(1, 4)):
+                n_movs += 1
+                movs.append((
+                    n_movs, doc_id, rnd.choice(almacenes)[0],
+                    rnd.choice(productos)[0], float(rnd.randint(1, 5)),
+                ))
+            if len(docs) >= batch:
+                flush()
+        if docs:
+            flush()
+    return list(range(1, n_docs + 1))
@@ -0,0 +1,110 @@
+import asyncio
+import logging
+
+from asgiref.sync import sync_to_async
+from django.core.cache import caches
+from django.db import connections
+
+from .. import conf
+
+logger = logging.getLogger(__name__)
+
+VERSION_KEY = "board:events:version"
+
+
+def _cache():
+    return caches[conf.get("CACHE_ALIAS")]
+
+
+def publish():
+    """
+    Avisa a todos los tableros conectados que algo cambió. Es solo un contador
+    en el cache compartido: cualquier worker (WSGI o ASGI) puede publicar y los
+    watchers de cada proceso ASGI lo detectan en menos de EVENTS_POLL segundos.
+    """
+    cache = _cache()
+    cache.add(VERSION_KEY, 0, None)
+    try:
+        return cache.incr(VERSION_KEY)
+    except ValueError:
+        cache.set(VERSION_KEY, 1, None)
+        return 1
+
+
+class Broadcaster:
+    """
+    Fan-out por proceso: un solo watcher revisa la versión global y reparte el
+    evento a las colas de todos los clientes SSE conectados a este proceso.
+    Solo avisa cuando publish() subió el contador. Cada ORDERS_CACHE_TTL
+    además intenta tomar el turno de cache.refresh_boards(): un solo proceso
+    del despliegue refresca los snapshots de los tableros activos y, si el ERP
+    trajo cambios, cache._refresh publica. El watcher solo vive mientras hay
+    suscriptores.
+    """
+
+    def __init__(self):
+        self.subscribers = set()
+        self.task = None
+
+    def subscribe(self):
+        queue = asyncio.Queue(maxsize=1)
+        self.subscribers.add(queue)
+        if self.task is None or self.task.done():
+            self.task = asyncio.get_running_loop().create_task(self._watch())
+        return queue
+
+    def unsubscribe(self, queue):
+        self.subscribers.discard(queue)
+
+    def _notify(self, version):
+        for queue in list(self.subscribers):
+            if queue.full():
+                # El cliente aún no consume el aviso anterior; uno basta
+                continue
+            queue.put_nowait(version)
+
+    async def _refresh_boards(self):
+        try:
+            await sync_to_async(_refresh_boards, thread_sensitive=False)()
+        except Exception:
+            logger.exception("Refresco de tableros para SSE falló")
+
+    async def _watch(self):
+        cache = _cache()
+        poll = conf.get("EVENTS_POLL")
+        refresh_every = conf.get("ORDERS_CACHE_TTL")
+        version = await cache.aget(VERSION_KEY, 0)
+        loop = asyncio.get_running_loop()
+        next_refresh = loop.time() + refresh_every
+        while self.subscribers:
+            await asyncio.sleep(poll)
+            if loop.time() >= next_refresh:
+                # Si el ERP trajo cambios, cache._refresh publica y lo vemos abajo
+                await self._refresh_boards()
+                next_refresh = loop.time() + refresh_every
+            current = await cache.aget(VERSION_KEY, 0)
+            if current != version:
+                version = current
+                self._notify(version)
+
+
+def _refresh_boards():
+    from .cache import refresh_boards
+
+    try:
+        return refresh_boards()
+    finally:
+        # Hilo del executor, no de una petición: nadie más cierra sus conexiones al ERP
+        connections.close_all()
+
+
+_broadcasters = {}
+
+
+def broadcaster():
+    """Un Broadcaster por event loop (normalmente uno por proceso ASGI)."""
+    loop = asyncio.get_running_loop()
+    if loop not in _broadcasters:
+        _broadcasters.clear()
+        _broadcasters[loop] = Broadcaster()
+    return _broadcasters[loop]
@@ -0,0 +1,156 @@
+"""
+Exportación del historial de órdenes finalizadas (CSV / XLSX) para rangos de
+decenas de miles de órdenes. Los estados locales (tabla caliente + archivo)
+se recorren con iterator() (cursor del servidor) en orden de
+fecha_finalizacion, y el ERP se consulta por bloques de EXPORT_CHUNK
+doc_ids: en memoria solo vive el bloque en curso.
+"""
+import csv
+import heapq
+import importlib.util
+from datetime import date, datetime, timedelta
+from itertools import islice
+
+from django.utils import timezone
+
+from .. import conf
+from ..models import OrdenUIState, OrdenUIStateArchivo
+from . import search as search_index
+from .cache import orders_source
+
+COLUMNS = (
+    "Documento", "Folio", "Cliente", "Vendedor", "Almacén", "Método de entrega", "Fecha de creación",
+    "Visto por primera vez", "Fecha de finalización", "Minutos", "Error", "Responsable", "Error resuelto",
+    "Comentarios",
+)
+
+STATE_FIELDS = (
+    "doc_id", "folio", "first_seen_at", "fecha_finalizacion", "almacen", "vendedor",
+    "has_error", "error_responsable__nombre", "error_resuelto", "error_comentarios",
+)
+
+
+def date_range(date_from=None, date_to=None):
+    """(desde, hasta) incluyentes; default los últimos 30 días. ValueError si el rango es inválido."""
+    date_to = date_to or timezone.localdate()
+    date_from = date_from or date_to - timedelta(days=30)
+    if date_from > date_to:
+        raise ValueError("date_from posterior a date_to")
+    if (date_to - date_from).days > conf.get("EXPORT_MAX_DAYS"):
+        raise ValueError(f"Rango mayor a {conf.get('EXPORT_MAX_DAYS')} días")
+    return date_from, date_to
+
+
+def _states(date_from, date_to, search=None):
+    """Estados finalizados en el rango, de ambas tablas, mezclados por (fecha_finalizacion, doc_id)."""
+    tz = timezone.get_current_timezone()
+    start = timezone.make_aware(datetime.combine(date_from, datetime.min.time()), tz)
+    end = timezone.make_aware(datetime.combine(date_to + timedelta(days=1), datetime.min.time()), tz)
+    streams = []
+    for model in (OrdenUIState, OrdenUIStateArchivo):
+        qs = model.objects.filter(is_finalizado=True, fecha_finalizacion__gte=start, fecha_finalizacion__lt=end)
+        if search:
+            qs = qs.filter(doc_id__in=search_index.matching(search).values("doc_id"))
+        streams.append(
+            qs.order_by("fecha_finalizacion", "doc_id").values(*STATE_FIELDS)
+            .iterator(chunk_size=conf.get("EXPORT_CHUNK"))
+        )
+    return heapq.merge(*streams, key=lambda s: (s["fecha_finalizacion"], s["doc_id"]))
+
+
+def _local(dt):
+    # Hora local sin tzinfo: así la muestran CSV y Excel
+    return timezone.localtime(dt).replace(tzinfo=None) if dt else None
+
+
+def _row(state, erp_row):
+    erp_row = erp_row or {}
+    first_seen, finished = state["first_seen_at"], state["fecha_finalizacion"]
+    created = erp_row.get("fecha_creacion")
+    return (
+        state["doc_id"],
+        state["folio"] or "",
+        erp_row.get("cliente") or "",
+        state["vendedor"] or erp_row.get("vendedor") or "",
+        state["almacen"] or erp_row.get("almacen_calc") or "",
+        erp_row.get("metodo_entrega") or "",
+        created.date() if isinstance(created, datetime) else created,
+        _local(first_seen),
+        _local(finished),
+        int((finished - first_seen).total_seconds() // 60) if first_seen and finished else None,
+        "Sí" if state["has_error"] else "No",
+        (state["error_responsable__nombre"] or "") if state["has_error"] else "",
+        ("Sí" if state["error_resuelto"] else "No") if state["has_error"] else "",
+        state["error_comentarios"] if state["has_error"] else "",
+    )
+
+
+def iter_rows(date_from, date_to, search=None):
+    """
+    Tuplas (ver COLUMNS) de las finalizadas en el rango; una consulta al ERP por
+    bloque. La búsqueda se resuelve con el índice local si está activo
+    (BOARD_SEARCH_INDEX); si no, la filtra el ERP dentro de cada bloque.
+    """
+    use_index = bool(search) and conf.get("SEARCH_INDEX")
+    erp_search = None if use_index else search
+    states = _states(date_from, date_to, search=search if use_index else None)
+    size = conf.get("EXPORT_CHUNK")
+    fetch = orders_source()
+    while True:
+        batch = list(islice(states, size))
+        if not batch:
+            return
+        # Sin fail_silently: un export con huecos del ERP es peor que uno cortado
+        erp_rows = {
+            r["doc_id"]: r
+            for r in fetch(doc_ids=[s["doc_id"] for s in batch], search=erp_search, fail_silently=False)
+        }
+        for state in batch:
+            if erp_search and state["doc_id"] not in erp_rows:
+                continue
+            yield _row(state, erp_rows.get(state["doc_id"]))
+
+
+class _Echo:
+    """'Archivo' para csv.writer que devuelve la línea en vez de escribirla."""
+
+    def write(self, value):
+        return value
+
+
+def _csv_cell(value):
+    if isinstance(value, datetime):
+        return value.strftime("%Y-%m-%d %H:%M")
+    if isinstance(value, date):
+        return value.isoformat()
+    return "" if value is None else value
+
+
+def iter_csv(rows):
+    """Líneas CSV: BOM (Excel reconoce UTF-8) + encabezado antes de cualquier query, luego una por fila."""
+    writer = csv.writer(_Echo())
+    yield "\ufeff" + writer.writerow(COLUMNS)
+    for row in rows:
+        yield writer.writerow([_csv_cell(v) for v in row])
+
+
+def xlsx_available():
+    """openpyxl es opcional: sin él solo hay CSV."""
+    return importlib.util.find_spec("openpyxl") is not None
+
+
+def write_xlsx(rows, fileobj):
+    """
+    Libro XLSX en fileobj con openpyxl en modo write_only (las filas se van
+    a disco, la memoria no crece con el rango). Solo el CSV se envía en
+    streaming: un XLSX es un zip que recién es válido al cerrarse, así que la
+    vista lo arma entero en un archivo temporal antes de responder. Requiere openpyxl.
+    """
+    from openpyxl import Workbook
+
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet("Pedidos finalizados")
+    sheet.append(COLUMNS)
+    for row in rows:
+        sheet.append(row)
+    workbook.save(fileobj)
@@ -0,0 +1,277 @@
+import asyncio
+import contextvars
+import functools
+import hashlib
+import logging
+import time
+from contextlib import contextmanager
+
+from asgiref.sync import sync_to_async
+from django.core.cache import caches
+from django.http import StreamingHttpResponse
+from django.shortcuts import render as _django_render
+from django.template.loader import get_template
+
+from .. import conf
+
+logger = logging.getLogger(__name__)
+
+KEY_PREFIX = "board:metrics"
+INDEX_KEY = f"{KEY_PREFIX}:series"
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# nombre -> (tipo, ayuda, etiquetas)
+METRICS = {
+    "board_erp_query_seconds": (
+        "histogram", "Duración de queries al ERP vista por quien llama (incluye cola del gateway).", ("op", "variant"),
+    ),
+    "board_erp_rows_total": ("counter", "Filas devueltas por el ERP.", ("op", "variant")),
+    "board_build_seconds": (
+        "histogram", "Fases de build_cards / build_past_page (fetch, ui_load, ui_save, assemble).", ("phase",),
+    ),
+    "board_view_seconds": ("histogram", "Tiempo por vista (total y render de template).", ("view", "phase")),
+}
+
+# Se re-registran las series cada tanto por si otro proceso pisó el índice
+REGISTER_EVERY = 60
+
+_timings = contextvars.ContextVar("board_server_timing", default=None)
+_known = {"series": set(), "since": 0.0}
+
+
+def _cache():
+    return caches[conf.get("CACHE_ALIAS")]
+
+
+def _series_id(name, labels):
+    raw = repr((name, sorted(labels.items())))
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()[:16]
+
+
+def _register(sid, name, labels):
+    now = time.monotonic()
+    if now - _known["since"] > REGISTER_EVERY:
+        _known["series"].clear()
+        _known["since"] = now
+    if sid in _known["series"]:
+        return
+    cache = _cache()
+    index = cache.get(INDEX_KEY) or {}
+    if sid not in index:
+        index[sid] = (name, labels)
+        cache.set(INDEX_KEY, index, None)
+    _known["series"].add(sid)
+
+
+def _add(key, amount):
+    cache = _cache()
+    try:
+        cache.incr(key, amount)
+    except ValueError:
+        if not cache.add(key, amount, None):
+            cache.incr(key, amount)
+
+
+def observe(name, value, **labels):
+    """Una observación de histograma (segundos) en los contadores compartidos entre workers."""
+    if not conf.get("METRICS_ENABLED"):
+        return
+    try:
+        sid = _series_id(name, labels)
+        _register(sid, name, labels)
+        bucket = next((i for i, le in enumerate(BUCKETS) if value <= le), len(BUCKETS))
+        _add(f"{KEY_PREFIX}:{sid}:b{bucket}", 1)
+        _add(f"{KEY_PREFIX}:{sid}:count", 1)
+        _add(f"{KEY_PREFIX}:{sid}:sum_us", int(value * 1_000_000))
+    except Exception:
+        # Las métricas nunca deben tumbar un request
+        logger.exception("No se pudo registrar la métrica %s", name)
+
+
+def inc(name, amount=1, **labels):
+    if not conf.get("METRICS_ENABLED") or not amount:
+        return
+    try:
+        sid = _series_id(name, labels)
+        _register(sid, name, labels)
+        _add(f"{KEY_PREFIX}:{sid}:value", int(amount))
+    except Exception:
+        logger.exception("No se pudo registrar la métrica %s", name)
+
+
+def _note(entry, seconds):
+    timings = _timings.get()
+    if timings is not None:
+        timings[entry] = timings.get(entry, 0.0) + seconds
+
+
+@contextmanager
+def timer(name, timing=None, **labels):
+    """
+    Mide el bloque y lo observa en el histograma 'name'. 'timing' es la entrada
+    del Server-Timing del request en curso (se suman si se repite).
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        observe(name, elapsed, **labels)
+        if timing:
+            _note(timing, elapsed)
+
+
+def _view_name(request, fallback):
+    match = getattr(request, "resolver_match", None)
+    return (match.url_name if match and match.url_name else None) or fallback
+
+
+def render(request, template_name, context=None, *args, **kwargs):
+    """django.shortcuts.render + tiempo de render en board_view_seconds{phase="render"}."""
+    with timer("board_view_seconds", timing="render", view=_view_name(request, template_name), phase="render"):
+        return _django_render(request, template_name, context, *args, **kwargs)
+
+
+async def arender(request, template_name, context=None, *args, **kwargs):
+    """render() para vistas async: el template corre en el hilo del ORM (puede tocar la DB)."""
+    return await sync_to_async(render)(request, template_name, context, *args, **kwargs)
+
+
+def stream_render(request, template_name, items, context=None, content_type="text/html; charset=utf-8"):
+    """
+    StreamingHttpResponse con el template renderizado por partes: part="head",
+    un part="item" por elemento de 'items' (iterable perezoso de dicts que se
+    agregan al contexto) y part="tail". La memoria no depende de cuántos
+    elementos haya. board_view_seconds{phase="stream"} mide hasta el último byte.
+    """
+    template = get_template(template_name)
+    base = dict(context or {})
+
+    def chunks():
+        yield template.render({**base, "part": "head"}, request)
+        for item in items:
+            yield template.render({**base, **item, "part": "item"}, request)
+        yield template.render({**base, "part": "tail"}, request)
+
+    return stream_response(request, chunks(), content_type, fallback=template_name)
+
+
+def stream_response(request, chunks, content_type, fallback="stream"):
+    """StreamingHttpResponse de 'chunks' (iterable perezoso) medido hasta el último byte (phase="stream")."""
+    view = _view_name(request, fallback)
+
+    def timed():
+        with timer("board_view_seconds", view=view, phase="stream"):
+            yield from chunks
+
+    return StreamingHttpResponse(timed(), content_type=content_type)
+
+
+def track_view(view_func):
+    """
+    Decorador de dispatch: tiempo total de la vista, render de TemplateResponse
+    y, con METRICS_SERVER_TIMING, cabecera Server-Timing con el desglose del
+    request (erp, ui_load, ui_save, assemble, render, total). Sirve también
+    para vistas async: dispatch devuelve la corrutina y se mide al esperarla.
+    """
+    @functools.wraps(view_func)
+    def wrapper(request, *args, **kwargs):
+        token = _timings.set({})
+        started = time.perf_counter()
+        try:
+            response = view_func(request, *args, **kwargs)
+        except BaseException:
+            _timings.reset(token)
+            raise
+        if asyncio.iscoroutine(response):
+            return _finish_async(response, request, view_func, token, started)
+        try:
+            return _finish(response, request, view_func, started)
+        finally:
+            _timings.reset(token)
+
+    return wrapper
+
+
+async def _finish_async(coro, request, view_func, token, started):
+    try:
+        return _finish(await coro, request, view_func, started)
+    finally:
+        _timings.reset(token)
+
+
+def _finish(response, request, view_func, started):
+    name = _view_name(request, getattr(view_func, "__name__", "view"))
+    if hasattr(response, "render") and not getattr(response, "is_rendered", True):
+        with timer("board_view_seconds", timing="render", view=name, phase="render"):
+            response.render()
+    total = time.perf_counter() - started
+    observe("board_view_seconds", total, view=name, phase="total")
+    if conf.get("METRICS_SERVER_TIMING") and not getattr(response, "streaming", False):
+        timings = _timings.get()
+        timings["total"] = total
+        response["Server-Timing"] = ", ".join(
+            f"{entry};dur={seconds * 1000:.1f}" for entry, seconds in timings.items()
+        )
+    return response
+
+
+def _fmt_labels(labels, **extra):
+    items = {**labels, **extra}
+    if not items:
+        return ""
+    body = ",".join(
+        '{}="{}"'.format(k, str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for k, v in items.items()
+    )
+    return "{" + body + "}"
+
+
+def _fmt_le(le):
+    return "+Inf" if le is None else repr(float(le))
+
+
+def export(extra_gauges=None):
+    """
+    Texto de exposición Prometheus (version 0.0.4) con todas las series
+    registradas por cualquier worker. extra_gauges: {nombre: (ayuda, valor)}.
+    """
+    cache = _cache()
+    index = cache.get(INDEX_KEY) or {}
+    by_metric = {}
+    for sid, (name, labels) in index.items():
+        by_metric.setdefault(name, []).append((sid, labels))
+
+    keys = []
+    for name, series in by_metric.items():
+        kind = METRICS.get(name, ("counter",))[0]
+        for sid, _ in series:
+            if kind == "histogram":
+                keys += [f"{KEY_PREFIX}:{sid}:b{i}" for i in range(len(BUCKETS) + 1)]
+                keys += [f"{KEY_PREFIX}:{sid}:count", f"{KEY_PREFIX}:{sid}:sum_us"]
+            else:
+                keys.append(f"{KEY_PREFIX}:{sid}:value")
+    values = cache.get_many(keys) if keys else {}
+
+    lines = []
+    for name in sorted(by_metric):
+        kind, help_text, _ = METRICS.get(name, ("counter", name, ()))
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        for sid, labels in sorted(by_metric[name], key=lambda s: sorted(s[1].items())):
+            if kind == "histogram":
+                cumulative = 0
+                for i, le in enumerate(BUCKETS + (None,)):
+                    cumulative += values.get(f"{KEY_PREFIX}:{sid}:b{i}", 0)
+                    lines.append(f"{name}_bucket{_fmt_labels(labels, le=_fmt_le(le))} {cumulative}")
+                total_us = values.get(f"{KEY_PREFIX}:{sid}:sum_us", 0)
+                lines.append(f"{name}_sum{_fmt_labels(labels)} {total_us / 1_000_000:.6f}")
+                lines.append(f"{name}_count{_fmt_labels(labels)} {values.get(f'{KEY_PREFIX}:{sid}:count', 0)}")
+            else:
+                lines.append(f"{name}{_fmt_labels(labels)} {values.get(f'{KEY_PREFIX}:{sid}:value', 0)}")
+
+    for name, (help_text, value) in sorted((extra_gauges or {}).items()):
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} gauge")
+        lines.append(f"{name} {value}")
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,179 @@
+import logging
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .. import conf
+from ..models import ErpDocumento, ErpMirrorEstado
+from . import events
+from . import search as search_index
+from .cache import invalidate_items
+from .erp import ORDER_FIELDS, OrderRow, as_date, fetch_orders, fetch_orders_after, folio_parts
+
+logger = logging.getLogger(__name__)
+
+MIRROR_NAME = "admDocumentos"
+MIRROR_FIELDS = (
+    "folio", "folio_num", "cliente", "fecha_creacion", "fecha_entrega", "observ",
+    "referencia", "total_u", "pend_u", "vendedor", "almacen_calc", "abierto",
+)
+# Campos que también viven en el índice de búsqueda (services.search)
+SEARCH_FIELDS = ("folio", "cliente", "fecha_creacion")
+RECHECK_CHUNK = 500
+
+
+def _to_mirror(row):
+    folio, folio_num = folio_parts(row["folio"])
+    return ErpDocumento(
+        doc_id=row["doc_id"],
+        folio=folio,
+        folio_num=folio_num,
+        cliente=row.get("cliente") or "",
+        fecha_creacion=as_date(row["fecha_creacion"]),
+        fecha_entrega=as_date(row.get("fecha_entrega")),
+        observ=row.get("observ") or "",
+        referencia=row.get("referencia") or "",
+        total_u=row.get("total_u") or 0,
+        pend_u=row.get("pend_u") or 0,
+        vendedor=row.get("vendedor"),
+        almacen_calc=row.get("almacen_calc"),
+        abierto=(row.get("pend_u") or 0) > 0,
+    )
+
+
+def _upsert(rows):
+    """Inserta o actualiza filas del ERP en el espejo. Devuelve cuántas cambiaron."""
+    if not rows:
+        return 0
+    incoming = {r["doc_id"]: _to_mirror(r) for r in rows}
+    existing = {d.doc_id: d for d in ErpDocumento.objects.filter(doc_id__in=incoming)}
+    to_create, to_update, items_changed, search_changed = [], [], [], []
+    for doc_id, new in incoming.items():
+        old = existing.get(doc_id)
+        if old is None:
+            to_create.append(new)
+            continue
+        if any(getattr(old, f) != getattr(new, f) for f in MIRROR_FIELDS):
+            # Unidades distintas = se surtió o se editaron partidas
+            if (old.total_u, old.pend_u) != (new.total_u, new.pend_u):
+                items_changed.append(doc_id)
+            if any(getattr(old, f) != getattr(new, f) for f in SEARCH_FIELDS):
+                search_changed.append(doc_id)
+            for f in MIRROR_FIELDS:
+                setattr(old, f, getattr(new, f))
+            old.synced_at = timezone.now()
+            to_update.append(old)
+    with transaction.atomic():
+        ErpDocumento.objects.bulk_create(to_create, ignore_conflicts=True)
+        ErpDocumento.objects.bulk_update(to_update, MIRROR_FIELDS + ("synced_at",))
+        if search_changed:
+            search_index.index_orders([r for r in rows if r["doc_id"] in search_changed])
+    invalidate_items(items_changed)
+    return len(to_create) + len(to_update)
+
+
+def _recheck(doc_ids):
+    """
+    Vuelve a leer del ERP los doc_ids dados, en bloques. Los que el ERP ya no
+    devuelve (borrados o movidos a otro concepto) se quitan del espejo.
+    Devuelve (actualizados, eliminados).
+    """
+    actualizados = eliminados = 0
+    for i in range(0, len(doc_ids), RECHECK_CHUNK):
+        chunk = doc_ids[i:i + RECHECK_CHUNK]
+        rows = fetch_orders(doc_ids=chunk, fail_silently=False)
+        actualizados += _upsert(rows)
+        gone = set(chunk) - {r["doc_id"] for r in rows}
+        if gone:
+            eliminados += ErpDocumento.objects.filter(doc_id__in=gone).delete()[0]
+            invalidate_items(gone)
+    return actualizados, eliminados
+
+
+def sync_mirror(batch=None, reconcile=False):
+    """
+    Una pasada de sincronización:
+      1) documentos nuevos por marca de agua (CIDDOCUMENTO > watermark), en lotes;
+      2) re-verifica los pedidos abiertos recientes (CUNIDADESPENDIENTES puede bajar);
+      3) con reconcile=True, re-verifica TODOS los documentos recientes (también
+         los cerrados), para enterarse de los que se borraron en el ERP.
+    En 2) y 3) lo que el ERP ya no devuelve se elimina del espejo.
+    Devuelve {"nuevos": n, "actualizados": n, "eliminados": n, "watermark": id}.
+    """
+    batch = batch or conf.get("MIRROR_BATCH")
+    state, _ = ErpMirrorEstado.objects.get_or_create(nombre=MIRROR_NAME)
+    state.last_sync_at = timezone.now()
+    nuevos = 0
+    try:
+        while True:
+            rows = fetch_orders_after(state.watermark, limit=batch, fail_silently=False)
+            if not rows:
+                break
+            nuevos += _upsert(rows)
+            state.watermark = max(r["doc_id"] for r in rows)
+            if len(rows) < batch:
+                break
+
+        since = timezone.localdate() - timedelta(days=conf.get("MIRROR_RECHECK_DAYS"))
+        recent = ErpDocumento.objects.filter(fecha_creacion__gte=since)
+        if not reconcile:
+            recent = recent.filter(abierto=True)
+        actualizados, eliminados = _recheck(list(recent.order_by("doc_id").values_list("doc_id", flat=True)))
+    except Exception as exc:
+        logger.warning("Sync del espejo ERP falló: %s", exc)
+        state.last_error = str(exc)
+        state.save()
+        raise
+
+    state.last_success_at = timezone.now()
+    state.last_error = ""
+    state.save()
+    if nuevos or actualizados or eliminados:
+        events.publish()  # los tableros conectados por SSE piden su delta
+    return {"nuevos": nuevos, "actualizados": actualizados, "eliminados": eliminados, "watermark": state.watermark}
+
+
+def mirror_status():
+    """Lag del espejo (segundos desde la última sync exitosa) para monitoreo/alertas."""
+    state = ErpMirrorEstado.objects.filter(nombre=MIRROR_NAME).first()
+    if state is None or state.last_success_at is None:
+        lag = None
+    else:
+        lag = (timezone.now() - state.last_success_at).total_seconds()
+    return {
+        "lag_seconds": lag,
+        "watermark": state.watermark if state else 0,
+        "last_sync_at": state.last_sync_at.isoformat() if state and state.last_sync_at else None,
+        "last_error": state.last_error if state else "",
+        "healthy": lag is not None and lag <= conf.get("MIRROR_MAX_LAG"),
+    }
+
+
+def fetch_orders_mirror(date_from=None, date_to=None, search=None, limit=None, doc_ids=None, fail_silently=True):
+    """
+    Misma firma y mismas filas que erp.fetch_orders, pero leyendo del espejo
+    local (ErpDocumento). No toca el ERP (fail_silently solo por compatibilidad).
+    """
+    qs = ErpDocumento.objects.all()
+    if date_from:
+        qs = qs.filter(fecha_creacion__gte=as_date(date_from))
+    if date_to:
+        qs = qs.filter(fecha_creacion__lt=as_date(date_to))
+    if doc_ids:
+        qs = qs.filter(doc_id__in=doc_ids)
+    if search:
+        s_raw = str(search).strip()
+        s_digits = ''.join(ch for ch in s_raw if ch.isdigit())
+        if s_digits:
+            qs = qs.filter(Q(folio_num=int(s_digits)) | Q(folio__contains=s_digits))
+        else:
+            qs = qs.filter(cliente__icontains=s_raw)
+    if limit:
+        ids = qs.order_by("-fecha_creacion").values_list("pk", flat=True)[:int(limit)]
+        qs = ErpDocumento.objects.filter(pk__in=list(ids))
+
+    # Mismas filas (OrderRow) y mismo orden por folio (no numéricos al final) que el ERP
+    qs = qs.order_by(F("folio_num").asc(nulls_last=True), "folio", "doc_id").values_list(*ORDER_FIELDS)
+    return [OrderRow(*values) for values in qs.iterator(chunk_size=conf.get("ERP_FETCH_SIZE"))]
@@ -1,14 +1,31 @@
+import asyncio
+import heapq
+from itertools import islice
+
+from asgiref.sync import sync_to_async
+from django.db import transaction
+from django.db.models import Q
 from django.utils import timezone
+from django.utils.dateparse import parse_datetime
 from datetime import datetime, timedelta
-from .erp import fetch_orders, fetch_items
-from ..models import OrdenUIState
+from .cache import Snapshot, cached_fetch_orders, orders_source, peek_items, remember_board, settle_items
+from .erp import fetch_orders
+from . import archive, metrics, rollup
+from . import search as search_index
+from .. import conf
+from ..models import OrdenUIState, OrdenUIStateArchivo
 
 def build_cards(date_from=None, search=None, view_mode="relevantes", limit=None):
     """
     - Relevantes: trae del ERP por fecha mínima (hoy por defecto) y opcional búsqueda.
     - Pasados: NO barrer el ERP completo; tomar doc_ids finalizados (local) y
-      luego pedir SOLO esos doc_ids al ERP.
+      luego pedir SOLO esos doc_ids al ERP. Aquí solo la primera página; las
+      siguientes se piden con build_past_page(cursor=...).
     - 'first_seen_at' fija la hora visible (ERP trae 00:00).
+    - Las lecturas al ERP pasan por el cache compartido (services.cache), así
+      varias pantallas con los mismos filtros comparten un solo query.
+    - La búsqueda se resuelve con el índice local (services.search) a doc_ids;
+      al ERP solo se piden esos, sin LIKE '%...%' sobre admDocumentos.
     """
     tz = timezone.get_current_timezone()
     today = timezone.localdate()
@@ -21,121 +38,322 @@ def build_cards(date_from=None, search=None, view_mode="relevantes", limit=None)
             date_from = datetime.combine(today, datetime.min.time())
             date_from = timezone.make_aware(date_from, tz)
 
-        raw_orders = fetch_orders(date_from=date_from, search=search, limit=limit)
+        with metrics.timer("board_build_seconds", timing="fetch", phase="fetch"):
+            if search and conf.get("SEARCH_INDEX"):
+                doc_ids = search_index.resolve(search, date_from=date_from)
+                raw_orders = cached_fetch_orders(date_from=date_from, limit=limit, doc_ids=doc_ids) if doc_ids else Snapshot()
+            else:
+                raw_orders = cached_fetch_orders(date_from=date_from, search=search, limit=limit)
+                remember_board(date_from=date_from, search=search, limit=limit)
         target_doc_ids = [r['doc_id'] for r in raw_orders]
 
-    # ====== RUTA PASADOS (rápida por doc_ids) ======
+    # ====== RUTA PASADOS: primera página del historial (ver build_past_page) ======
     else:  # "pasados"
-        # Tomamos de la DB local SOLO los finalizados de días previos (y opcional límite)
-        qs = (OrdenUIState.objects
-              .filter(is_finalizado=True, fecha_finalizacion__lt=timezone.now().replace(hour=0, minute=0, second=0, microsecond=0))
-              .order_by('-fecha_finalizacion'))
-
-        # Si quieres paginar, ajusta este límite (ej. últimos 500)
-        MAX_DOCS = 500
-        ui_rows = list(qs.values_list('doc_id', flat=True)[:MAX_DOCS])
-
-        if not ui_rows:
-            raw_orders = []
-            target_doc_ids = []
-        else:
-            # Puedes además recortar por rango de fechas del ERP (opcional), pero al ir por doc_ids ya es rápido
-            raw_orders = fetch_orders(search=search, limit=None, doc_ids=ui_rows)
-            target_doc_ids = ui_rows
+        cards, _ = build_past_page(search=search)
+        return cards
+
+    # ====== Estados locales: 1 lectura + escrituras en lote (constante por llamada) ======
+    existing = _load_ui_states(raw_orders, target_doc_ids)
+
+    with metrics.timer("board_build_seconds", timing="assemble", phase="assemble"):
+        cards = []
+        for r in raw_orders:
+            card = _make_card(r, existing[r['doc_id']], tz)
+            status = card["status"]
+            fecha_final = card["fecha_finalizacion"]
+
+            # Filtro de vista (relevantes): finalizados solo si fue hoy
+            if status == 'FINALIZADO':
+                if not fecha_final or fecha_final.date() != today:
+                    continue
+
+            cards.append(card)
+        # Sin sort: el ERP (y el espejo) ya entregan el orden por folio del tablero
+
+    # Las tarjetas heredan la frescura del snapshot (stale si el ERP no respondió)
+    return Snapshot.like(raw_orders, cards)
+
+
+def _make_card(r, ui, tz):
+    """Arma el dict de tarjeta a partir de la fila del ERP y su OrdenUIState."""
+    is_final = bool(ui and ui.is_finalizado)
+    fecha_final = ui.fecha_finalizacion if is_final else None
+    status = 'FINALIZADO' if is_final else r['status_erp']
+
+    # Combinar fecha ERP + hora de first_seen_at
+    erp_dt = r['fecha_creacion']
+    date_part = erp_dt.date() if hasattr(erp_dt, "date") else erp_dt
+    seen_local = timezone.localtime(ui.first_seen_at)
+    combined = datetime.combine(date_part, seen_local.time())
+    if timezone.is_naive(combined):
+        combined = timezone.make_aware(combined, tz)
+
+    # Normaliza folio a int si se puede
+    folio_val = r['folio']
+    try:
+        folio_val = int(str(folio_val).strip())
+    except Exception:
+        pass
+
+    return {
+        "pk": r['doc_id'],
+        "folio": folio_val,
+        "cliente": r['cliente'],
+        "fecha_creacion": combined,
+        "fecha_finalizacion": fecha_final,
+        "vendedor": r['vendedor'],
+        "status": status,
+        "almacen": r.get('almacen_calc') or 'Mixto',
+        "fecha_entrega": r['fecha_entrega'],
+        "metodo_entrega": r['metodo_entrega'],
+        "pend_u": r['pend_u'],
+
+        # === NUEVO: estado de error (proveniente de OrdenUIState) ===
+        "has_error": bool(ui and getattr(ui, "has_error", False)),
+        "error_responsable": (
+            ui.error_responsable.nombre if (ui and getattr(ui, "error_responsable", None)) else None
+        ),
+        "error_resuelto": bool(ui and getattr(ui, "error_resuelto", False)),
+        "error_comentarios": (ui.error_comentarios if (ui and getattr(ui, "error_comentarios", "")) else ""),
+        "is_finalizado": bool(ui and getattr(ui, "is_finalizado", False)),
+        "updated_at": ui.updated_at,
+        "version": ui.version,
+    }
+
+
+def make_cards(rows, states):
+    """Tarjetas de filas del ERP ya leídas con sus estados {doc_id: ui} ya cargados (sin queries)."""
+    tz = timezone.get_current_timezone()
+    return [_make_card(r, states[r["doc_id"]], tz) for r in rows]
+
+
+def _past_base_qs(model=OrdenUIState):
+    # Finalizados de días previos (los de hoy salen en 'relevantes')
+    today_start = timezone.make_aware(
+        datetime.combine(timezone.localdate(), datetime.min.time()), timezone.get_current_timezone()
+    )
+    return model.objects.filter(is_finalizado=True, fecha_finalizacion__lt=today_start)
+
+
+def encode_cursor(fecha_finalizacion, doc_id):
+    return f"{fecha_finalizacion.isoformat()}~{doc_id}"
+
+
+def decode_cursor(cursor):
+    """'<fecha_finalizacion iso>~<doc_id>' -> (datetime, doc_id); ValueError si no es válido."""
+    fecha_raw, _, doc_raw = (cursor or "").partition("~")
+    fecha = parse_datetime(fecha_raw)
+    if fecha is None or not doc_raw.isdigit():
+        raise ValueError(f"Cursor inválido: {cursor!r}")
+    return fecha, int(doc_raw)
+
+
+def build_past_page(search=None, cursor=None, page_size=None):
+    """
+    Historial ('pasados') paginado por keyset sobre (fecha_finalizacion, doc_id)
+    descendente. Cada página lee solo su ventana de la DB local y pide solo esos
+    doc_ids al ERP, así que el costo por página es constante sin importar cuánta
+    historia haya. Devuelve (cards, next_cursor); next_cursor es None al final.
+    """
+    page_size = page_size or conf.get("PAST_PAGE_SIZE")
+    window_filter = Q()
+    if search and conf.get("SEARCH_INDEX"):
+        # Filtrar en la ventana del keyset: páginas completas aunque haya búsqueda
+        window_filter &= Q(doc_id__in=search_index.matching(search).values("doc_id"))
+        search = None
+    if cursor:
+        fecha, doc_id = decode_cursor(cursor)
+        window_filter &= Q(fecha_finalizacion__lt=fecha) | Q(fecha_finalizacion=fecha, doc_id__lt=doc_id)
+    with metrics.timer("board_build_seconds", timing="ui_load", phase="ui_load"):
+        # Misma ventana en la tabla caliente y en el archivo; se mezclan por el keyset
+        windows = [
+            list(
+                _past_base_qs(model).filter(window_filter).order_by("-fecha_finalizacion", "-doc_id")
+                .values_list("doc_id", "fecha_finalizacion")[:page_size]
+            )
+            for model in (OrdenUIState, OrdenUIStateArchivo)
+        ]
+        window = list(islice(heapq.merge(*windows, key=lambda w: (w[1], w[0]), reverse=True), page_size))
+    if not window:
+        return [], None
+
+    next_cursor = encode_cursor(window[-1][1], window[-1][0]) if len(window) == page_size else None
+    doc_ids = [doc_id for doc_id, _ in window]
+    with metrics.timer("board_build_seconds", timing="fetch", phase="fetch"):
+        raw_orders = cached_fetch_orders(search=search, limit=None, doc_ids=doc_ids)
+
+    # El ERP regresa por folio; la página se muestra en el orden del keyset
+    by_id = {r["doc_id"]: r for r in raw_orders}
+    rows = [by_id[d] for d in doc_ids if d in by_id]
+
+    tz = timezone.get_current_timezone()
+    existing = _load_ui_states(rows, doc_ids)
+    with metrics.timer("board_build_seconds", timing="assemble", phase="assemble"):
+        cards = [_make_card(r, existing[r["doc_id"]], tz) for r in rows]
+    return Snapshot.like(raw_orders, [c for c in cards if c["status"] == "FINALIZADO"]), next_cursor
+
+
+def iter_past_cards(search=None, page_size=None):
+    """
+    Todo el historial ('pasados') página por página, para renders grandes que
+    se envían en streaming: en memoria solo vive la página en curso.
+    """
+    cursor = None
+    while True:
+        cards, cursor = build_past_page(search=search, cursor=cursor, page_size=page_size)
+        yield from cards
+        if cursor is None:
+            return
 
-    # ====== Carga estados existentes solo de los doc_ids que sí tenemos ======
-    existing = { s.doc_id: s for s in OrdenUIState.objects.filter(doc_id__in=target_doc_ids) }
 
-    cards = []
-    to_save = []
+def _load_ui_states(raw_orders, target_doc_ids):
+    """
+    {doc_id: OrdenUIState} para todas las filas del ERP, con error_responsable
+    ya unido. Crea los faltantes (first_seen_at) y persiste folio / first_seen_at
+    en lote dentro de una transacción:
+      - bulk_create(ignore_conflicts=True): si otro worker insertó el mismo doc_id
+        primero, gana su fila y se relee (su first_seen_at es el bueno);
+      - bulk_update solo de las filas que realmente cambiaron.
+    Las órdenes vistas por primera vez se agregan también al índice de búsqueda.
+    Las archivadas (services.archive) se devuelven tal cual, sin tocarlas.
+    """
+    with metrics.timer("board_build_seconds", timing="ui_load", phase="ui_load"):
+        existing = {
+            s.doc_id: s
+            for s in OrdenUIState.objects.select_related("error_responsable").filter(doc_id__in=target_doc_ids)
+        }
+        # Las que no están en la tabla caliente pueden estar archivadas: se leen, no se recrean
+        archived = archive.archived_states([d for d in target_doc_ids if d not in existing])
 
+    now = timezone.now()
+    to_create = {}
+    to_update = {}
+    rollup_before = {}
     for r in raw_orders:
         doc_id = r['doc_id']
+        folio = _folio_text(r['folio'])
         ui = existing.get(doc_id)
-
-        # first_seen_at
+        if doc_id in archived:
+            continue
         if ui is None:
-            ui = OrdenUIState(doc_id=doc_id, first_seen_at=timezone.now())
-            existing[doc_id] = ui
-            to_save.append(ui)
-        elif ui.first_seen_at is None:
-            ui.first_seen_at = timezone.now()
-            to_save.append(ui)
-
-        is_final = bool(ui and ui.is_finalizado)
-        fecha_final = ui.fecha_finalizacion if is_final else None
-        status = 'FINALIZADO' if is_final else r['status_erp']
-
-        # Combinar fecha ERP + hora de first_seen_at
-        erp_dt = r['fecha_creacion']
-        date_part = erp_dt.date() if hasattr(erp_dt, "date") else erp_dt
-        seen_local = timezone.localtime(ui.first_seen_at)
-        combined = datetime.combine(date_part, seen_local.time())
-        if timezone.is_naive(combined):
-            combined = timezone.make_aware(combined, tz)
-
-        # Filtro de vista
-        if view_mode == "relevantes":
-            if status == 'FINALIZADO':
-                if not fecha_final or fecha_final.date() != today:
-                    continue
-        else:  # pasados
-            if not (status == 'FINALIZADO' and fecha_final and fecha_final.date() < today):
-                continue
-
-        # Normaliza folio a int si se puede
-        folio_val = r['folio']
-        try:
-            folio_val = int(str(folio_val).strip())
-        except Exception:
-            pass
-
-        # === NUEVO: persistir folio en OrdenUIState si el modelo lo tiene ===
-        try:
-            if hasattr(ui, "folio") and ui.folio != folio_val:
-                ui.folio = folio_val
-                if ui not in to_save:
-                    to_save.append(ui)
-        except Exception:
-            # Seguridad: no fallar si aún no existe el campo en la DB
-            pass
-
-        cards.append({
-            "pk": doc_id,
-            "folio": folio_val,
-            "cliente": r['cliente'],
-            "fecha_creacion": combined,
-            "fecha_finalizacion": fecha_final,
-            "vendedor": r['vendedor'],
-            "status": status,
-            "almacen": r.get('almacen_calc') or 'Mixto',
-            "fecha_entrega": r['fecha_entrega'],
-            "metodo_entrega": r['metodo_entrega'],
-
-            # === NUEVO: estado de error (proveniente de OrdenUIState) ===
-            "has_error": bool(ui and getattr(ui, "has_error", False)),
-            "error_responsable": (
-                ui.error_responsable.nombre if (ui and getattr(ui, "error_responsable", None)) else None
-            ),
-            "error_resuelto": bool(ui and getattr(ui, "error_resuelto", False)),
-            "error_comentarios": (ui.error_comentarios if (ui and getattr(ui, "error_comentarios", "")) else ""),
-            "is_finalizado": bool(ui and getattr(ui, "is_finalizado", False)),
-        })
-
-    # Guarda first_seen_at si faltaba
-    for obj in to_save:
-        obj.save()
-
-    # Orden estable por folio asc + desempate por pk
-    def _as_int(val, big=10**12):
-        try:
-            return int(str(val).strip())
-        except Exception:
-            return big
-    cards.sort(key=lambda r: (_as_int(r.get("folio")), int(r.get("pk", 0))))
-
-    return cards
-
-
-def get_order_items(doc_id):
-    return fetch_items(doc_id)
+            if doc_id not in to_create:
+                to_create[doc_id] = OrdenUIState(doc_id=doc_id, first_seen_at=now, folio=folio)
+            continue
+        if ui.first_seen_at is None:
+            if ui.is_finalizado:
+                # Su rango de duración en los resúmenes cambia con first_seen_at
+                rollup_before[doc_id] = rollup.contributions(ui)
+            ui.first_seen_at = now
+            to_update[doc_id] = ui
+        if folio is not None and ui.folio != folio:
+            ui.folio = folio
+            to_update[doc_id] = ui
+
+    if to_create or to_update:
+        with metrics.timer("board_build_seconds", timing="ui_save", phase="ui_save"), transaction.atomic():
+            if to_create:
+                OrdenUIState.objects.bulk_create(to_create.values(), ignore_conflicts=True)
+                search_index.index_orders([r for r in raw_orders if r['doc_id'] in to_create], only_new=True)
+            if to_update:
+                OrdenUIState.objects.bulk_update(to_update.values(), ["first_seen_at", "folio"])
+                for doc_id, before in rollup_before.items():
+                    rollup.apply(before, to_update[doc_id])
+        if to_create:
+            existing.update({
+                s.doc_id: s
+                for s in OrdenUIState.objects.select_related("error_responsable").filter(doc_id__in=to_create)
+            })
+    existing.update(archived)
+    return existing
+
+
+def _folio_text(raw):
+    """Folio como se guarda en OrdenUIState.folio ('1234', no '1234.0')."""
+    if raw is None:
+        return None
+    try:
+        return str(int(float(str(raw).strip())))
+    except (TypeError, ValueError):
+        return str(raw).strip()
+
+
+KPI_STATUSES = (("PENDIENTE", "Pendientes"), ("SURTIDO", "Surtidos"), ("FINALIZADO", "Finalizados"))
+
+
+def build_kpis(cards):
+    """
+    Conteos por status + desgloses por almacén y por método de entrega, en una
+    sola pasada sobre las tarjetas ya construidas (mismas que se muestran).
+    """
+    totals = dict.fromkeys((s for s, _ in KPI_STATUSES), 0)
+    por_almacen, por_metodo = {}, {}
+    for c in cards:
+        status = c["status"]
+        totals[status] = totals.get(status, 0) + 1
+        for bucket, label in ((por_almacen, c["almacen"]), (por_metodo, c["metodo_entrega"])):
+            row = bucket.get(label)
+            if row is None:
+                row = bucket[label] = {"label": label, "total": 0, **dict.fromkeys(totals, 0)}
+            row[status] = row.get(status, 0) + 1
+            row["total"] += 1
+
+    return {
+        "kpis": [{"label": label, "value": totals[status]} for status, label in KPI_STATUSES],
+        "por_almacen": sorted(por_almacen.values(), key=lambda r: str(r["label"])),
+        "por_metodo": sorted(por_metodo.values(), key=lambda r: -r["total"]),
+    }
+
+
+def _offload(func):
+    """
+    ERP y cache en un hilo del pool (corren en paralelo entre sí); lo que toca
+    la DB local (el espejo) por el hilo único del ORM, como el ORM async.
+    """
+    return sync_to_async(func, thread_sensitive=func is not fetch_orders)
+
+
+async def afetch_row(doc_id, source=None):
+    """
+    La fila de doc_id desde orders_source() (ERP en un hilo del pool), o None.
+    'source' fija otra fetch_orders (p. ej. la impresión lee siempre el ERP).
+    """
+    rows = await _offload(source or orders_source())(doc_ids=[doc_id])
+    return rows[0] if rows else None
+
+
+async def abuild_card(doc_id, ui=None, row=None):
+    """
+    Una sola tarjeta por doc_id (modal, toggles, errores, impresión) sin
+    importar el tamaño del tablero y sin filtro de vista: la fila del ERP y el
+    OrdenUIState se piden a la vez (hilo + ORM async); solo una orden nunca
+    vista hace un paso más. Con 'row' (ya leída por la vista) no se vuelve a
+    pedir al ERP. None si el ERP no trae el documento.
+    """
+    if ui is None:
+        ui_query = OrdenUIState.objects.select_related("error_responsable").filter(doc_id=doc_id).afirst()
+        if row is None:
+            row, ui = await asyncio.gather(afetch_row(doc_id), ui_query)
+        else:
+            ui = await ui_query
+    elif row is None:
+        row = await afetch_row(doc_id)
+    if row is None:
+        return None
+    if ui is None or ui.first_seen_at is None:
+        ui = (await sync_to_async(_load_ui_states)([row], [doc_id]))[doc_id]
+    return _make_card(row, ui, timezone.get_current_timezone())
+
+
+async def awith_items(doc_id, order, *others):
+    """
+    Espera a la vez 'order' (corrutina que da la fila o tarjeta, con 'pend_u'),
+    las partidas de doc_id y las corrutinas 'others'; la latencia es la del más
+    lento y no la suma. Las partidas se validan contra el pend_u de la orden al
+    final (ver cache.peek_items). Devuelve (orden, partidas, *others).
+    """
+    order, peeked, *rest = await asyncio.gather(
+        order, sync_to_async(peek_items, thread_sensitive=False)(doc_id), *others,
+    )
+    pend_u = order.get("pend_u") if order else None
+    items = await sync_to_async(settle_items, thread_sensitive=False)(doc_id, peeked, pend_u)
+    return (order, items, *rest)
@@ -0,0 +1,375 @@
+"""
+Resúmenes de finalización y errores mantenidos al vuelo: cada cambio de un
+OrdenUIState resta lo que la orden aportaba antes y suma lo que aporta
+después, en la misma transacción que guarda la orden. Los reportes leen unas
+cuantas filas indexadas (ResumenFinalizacion / ResumenError) en vez de
+recorrer órdenes; rebuild() los recalcula desde cero (backfill).
+"""
+from collections import defaultdict
+from itertools import chain
+from datetime import timedelta
+
+from django.db import IntegrityError, transaction
+from django.db.models import F, Sum
+from django.db.models.signals import pre_delete
+from django.dispatch import receiver
+from django.utils import timezone
+
+from ..models import EmpleadoResponsable, OrdenUIState, OrdenUIStateArchivo, ResumenError, ResumenFinalizacion
+from . import archive
+
+# Límite superior (minutos) de cada rango de duración first_seen_at -> fecha_finalizacion;
+# el índice len(DURATION_BUCKETS) es "más de una semana" y -1 "sin first_seen_at"
+DURATION_BUCKETS = (5, 15, 30, 60, 120, 240, 480, 1440, 2880, 10080)
+NO_DURATION = -1
+
+FIN_DIMS = ("almacen", "vendedor")
+
+
+def _minutes(ui):
+    if not ui.first_seen_at or not ui.fecha_finalizacion:
+        return None
+    return max(0, int((ui.fecha_finalizacion - ui.first_seen_at).total_seconds() // 60))
+
+
+def _bucket(minutes):
+    if minutes is None:
+        return NO_DURATION
+    return next((i for i, edge in enumerate(DURATION_BUCKETS) if minutes <= edge), len(DURATION_BUCKETS))
+
+
+def contributions(ui):
+    """
+    {(modelo, llave): {campo: valor}} que esta orden aporta a los resúmenes.
+    Solo cuentan las finalizadas (los errores solo existen en finalizadas).
+    """
+    if not ui.is_finalizado or not ui.fecha_finalizacion:
+        return {}
+    fecha = timezone.localdate(ui.fecha_finalizacion)
+    minutes = _minutes(ui)
+    out = {
+        (ResumenFinalizacion, (
+            ("fecha", fecha), ("almacen", ui.almacen or ""), ("vendedor", ui.vendedor or ""),
+            ("bucket", _bucket(minutes)),
+        )): {"finalizados": 1, "minutos_total": minutes or 0},
+    }
+    if ui.has_error:
+        out[(ResumenError, (("fecha", fecha), ("responsable_id", ui.error_responsable_id)))] = {
+            "errores": 1, "resueltos": int(bool(ui.error_resuelto)),
+        }
+    return out
+
+
+def _bump(model, key, deltas):
+    """Suma 'deltas' a la fila 'key' (UPDATE ... SET x = x + n); la crea si no existe."""
+    key = dict(key)
+    increments = {field: F(field) + delta for field, delta in deltas.items()}
+    if model.objects.filter(**key).update(**increments):
+        return
+    try:
+        with transaction.atomic():
+            model.objects.create(**key, **deltas)
+    except IntegrityError:
+        # Otro worker la creó entre el UPDATE y el INSERT
+        model.objects.filter(**key).update(**increments)
+
+
+@receiver(pre_delete, sender=EmpleadoResponsable)
+def fold_deleted_responsable(sender, instance, **kwargs):
+    """
+    Al borrar un responsable, sus órdenes pasan a "sin responsable" (SET_NULL)
+    y sus filas de ResumenError se borran en cascada: antes se suman a la fila
+    sin responsable de cada día, como lo contaría rebuild(). Corre dentro de la
+    transacción del delete.
+    """
+    for row in ResumenError.objects.filter(responsable=instance):
+        _bump(
+            ResumenError, (("fecha", row.fecha), ("responsable_id", None)),
+            {"errores": row.errores, "resueltos": row.resueltos},
+        )
+
+
+def apply(before, ui):
+    """Aplica la diferencia entre 'before' (contributions() previo) y el estado actual de ui."""
+    apply_many([(before, ui)])
+
+
+def apply_many(changes):
+    """apply() de varias órdenes [(before, ui)]: un UPDATE por fila de resumen afectada."""
+    diff = defaultdict(lambda: defaultdict(int))
+    for before, ui in changes:
+        for target, values in before.items():
+            for field, value in values.items():
+                diff[target][field] -= value
+        for target, values in contributions(ui).items():
+            for field, value in values.items():
+                diff[target][field] += value
+    for (model, key), deltas in diff.items():
+        deltas = {field: delta for field, delta in deltas.items() if delta}
+        if deltas:
+            _bump(model, key, deltas)
+
+
+class VersionConflict(Exception):
+    """La orden cambió desde la versión que vio el cliente; .ui trae el estado actual."""
+
+    def __init__(self, ui):
+        super().__init__(f"Orden {ui.doc_id}: la DB ya va en la versión {ui.version}")
+        self.ui = ui
+
+
+# Columnas que un cambio puede tocar (version / updated_at las pone el UPDATE)
+STATE_FIELDS = tuple(
+    f.attname for f in OrdenUIState._meta.concrete_fields
+    if not f.primary_key and f.attname not in ("version", "updated_at")
+)
+UPDATE_RETRIES = 5
+
+
+def _current(doc_id):
+    """OrdenUIState de doc_id con error_responsable; lo restaura del archivo o lo inserta si falta."""
+    qs = OrdenUIState.objects.select_related("error_responsable").filter(doc_id=doc_id)
+    ui = qs.first()
+    if ui is None:
+        # Una orden archivada regresa a la tabla caliente para modificarse
+        with transaction.atomic():
+            archive.restore(doc_id)
+        # Upsert: si otro request la insertó primero gana su fila (sin IntegrityError)
+        OrdenUIState.objects.bulk_create(
+            [OrdenUIState(doc_id=doc_id, first_seen_at=timezone.now())], ignore_conflicts=True,
+        )
+        ui = qs.first()
+    return ui
+
+
+def update_ui(doc_id, change, version=None):
+    """
+    Cambia el OrdenUIState de doc_id sin bloquear filas: lee, aplica change(ui)
+    y escribe solo las columnas que cambiaron en un UPDATE condicionado a la
+    versión leída (version = version + 1); los resúmenes se ajustan en la
+    misma transacción. Si devuelve False, change(ui) no guarda nada.
+    'version' es la que vio el cliente: si la DB ya va en otra, VersionConflict.
+    Sin ella, si otro request escribió entre la lectura y el UPDATE se vuelve a
+    aplicar change sobre el estado nuevo. Devuelve (ui, guardado), con
+    error_responsable ya cargado (las vistas async no pueden hacer ese query perezoso).
+    """
+    for _ in range(UPDATE_RETRIES):
+        ui = _current(doc_id)
+        if version is not None and ui.version != version:
+            raise VersionConflict(ui)
+        before = contributions(ui)
+        old = {f: getattr(ui, f) for f in STATE_FIELDS}
+        if change(ui) is False:
+            return ui, False
+        # Como _load_ui_states: la duración se mide desde que la orden apareció
+        if ui.first_seen_at is None:
+            ui.first_seen_at = timezone.now()
+        changed = {f: getattr(ui, f) for f in STATE_FIELDS if getattr(ui, f) != old[f]}
+        if not changed:
+            return ui, True
+
+        now = timezone.now()
+        with transaction.atomic():
+            updated = OrdenUIState.objects.filter(pk=ui.pk, version=ui.version).update(
+                **changed, version=F("version") + 1, updated_at=now,
+            )
+            if updated:
+                apply(before, ui)
+        if updated:
+            ui.version += 1
+            ui.updated_at = now
+            return ui, True
+    raise VersionConflict(_current(doc_id))
+
+
+def update_many(doc_ids, change, fields):
+    """
+    update_ui para varias órdenes: una transacción, un SELECT ... FOR UPDATE
+    (los UPDATE condicionados de update_ui esperan y luego ven la versión
+    nueva), un bulk_update de 'fields' y los resúmenes ajustados en conjunto. Las
+    archivadas se restauran y las nunca vistas se crean. change(ui) igual que
+    en update_ui; solo las que de verdad cambiaron se escriben y suben de
+    versión. Devuelve ({doc_id: ui}, [doc_ids guardados]).
+    """
+    doc_ids = list(dict.fromkeys(doc_ids))
+    locked = OrdenUIState.objects.select_for_update().select_related("error_responsable")
+    now = timezone.now()
+    with transaction.atomic():
+        states = {ui.doc_id: ui for ui in locked.filter(doc_id__in=doc_ids)}
+        missing = [d for d in doc_ids if d not in states]
+        if missing:
+            for doc_id in missing:
+                archive.restore(doc_id)
+            OrdenUIState.objects.bulk_create(
+                [OrdenUIState(doc_id=d, first_seen_at=now) for d in missing], ignore_conflicts=True,
+            )
+            states.update({ui.doc_id: ui for ui in locked.filter(doc_id__in=missing)})
+
+        changes = []
+        for doc_id in doc_ids:
+            ui = states[doc_id]
+            before = contributions(ui)
+            old = {f: getattr(ui, f) for f in STATE_FIELDS}
+            if change(ui) is False:
+                continue
+            if ui.first_seen_at is None:
+                ui.first_seen_at = now
+            # Como update_ui: sin cambios reales no se escribe ni sube la versión
+            # (las otras pantallas con esa orden recibirían un 409 injusto)
+            if all(getattr(ui, f) == old[f] for f in STATE_FIELDS):
+                continue
+            # bulk_update no pasa por auto_now; la versión sube como en update_ui
+            ui.updated_at = now
+            ui.version += 1
+            changes.append((before, ui))
+        if changes:
+            OrdenUIState.objects.bulk_update(
+                [ui for _, ui in changes], list(dict.fromkeys([*fields, "first_seen_at", "updated_at", "version"])),
+            )
+            apply_many(changes)
+    return states, [ui.doc_id for _, ui in changes]
+
+
+def set_dimensions(ui, row):
+    """Fija en ui el almacén / vendedor del ERP (como los muestra la tarjeta) al finalizar."""
+    if row is not None:
+        ui.almacen = (row.get("almacen_calc") or "Mixto")[:10]
+        ui.vendedor = (row.get("vendedor") or "")[:255]
+
+
+# ====== Backfill ======
+
+def backfill_dimensions(fetch_rows, batch=500):
+    """
+    Llena almacen / vendedor de finalizadas que no los tienen (anteriores a los
+    resúmenes). fetch_rows(doc_ids) -> filas del ERP. Devuelve cuántas se llenaron.
+    """
+    filled = 0
+    for model in (OrdenUIState, OrdenUIStateArchivo):
+        pending = model.objects.filter(is_finalizado=True, almacen__isnull=True)
+        last = 0
+        while True:
+            chunk = list(pending.filter(pk__gt=last).order_by("pk").only("pk", "doc_id")[:batch])
+            if not chunk:
+                break
+            last = chunk[-1].pk
+            rows = {r["doc_id"]: r for r in fetch_rows([u.doc_id for u in chunk])}
+            for ui in chunk:
+                set_dimensions(ui, rows.get(ui.doc_id))
+            found = [ui for ui in chunk if ui.doc_id in rows]
+            model.objects.bulk_update(found, ["almacen", "vendedor"])
+            filled += len(found)
+    return filled
+
+
+def rebuild(chunk_size=2000):
+    """
+    Recalcula ambos resúmenes desde OrdenUIState y su archivo (sin tocar el ERP). Todo en
+    una transacción: los reportes nunca ven tablas a medio llenar.
+    Devuelve (filas de finalización, filas de error).
+    """
+    totals = defaultdict(lambda: defaultdict(int))
+    fields = (
+        "is_finalizado", "fecha_finalizacion", "first_seen_at", "almacen", "vendedor",
+        "has_error", "error_responsable_id", "error_resuelto",
+    )
+    with transaction.atomic():
+        states = chain.from_iterable(
+            model.objects.filter(is_finalizado=True).only(*fields).iterator(chunk_size=chunk_size)
+            for model in (OrdenUIState, OrdenUIStateArchivo)
+        )
+        for ui in states:
+            for target, values in contributions(ui).items():
+                for field, value in values.items():
+                    totals[target][field] += value
+
+        ResumenFinalizacion.objects.all().delete()
+        ResumenError.objects.all().delete()
+        rows = {ResumenFinalizacion: [], ResumenError: []}
+        for (model, key), values in totals.items():
+            rows[model].append(model(**dict(key), **values))
+        for model, objs in rows.items():
+            model.objects.bulk_create(objs, batch_size=1000)
+    return len(rows[ResumenFinalizacion]), len(rows[ResumenError])
+
+
+# ====== Reportes ======
+
+def _median(buckets):
+    """Mediana aproximada (minutos) a partir de {bucket: finalizados}, interpolando dentro del rango."""
+    counts = [(b, n) for b, n in sorted(buckets.items()) if b != NO_DURATION and n > 0]
+    total = sum(n for _, n in counts)
+    if not total:
+        return None
+    half, seen = total / 2, 0
+    for b, n in counts:
+        if seen + n >= half:
+            lower = DURATION_BUCKETS[b - 1] if b > 0 else 0
+            if b >= len(DURATION_BUCKETS):
+                return float(lower)
+            return round(lower + (half - seen) / n * (DURATION_BUCKETS[b] - lower), 1)
+        seen += n
+    return None
+
+
+def _range(date_from, date_to):
+    today = timezone.localdate()
+    date_to = date_to or today
+    date_from = date_from or date_to - timedelta(days=30)
+    return date_from, date_to
+
+
+def finalization_report(date_from=None, date_to=None, by=("fecha", "almacen")):
+    """
+    Finalizados por las dimensiones 'by' (fecha, almacen, vendedor) entre
+    date_from y date_to (incluyentes; default últimos 30 días), con minutos
+    promedio y mediana de first_seen_at a fecha_finalizacion.
+    """
+    by = [d for d in by if d in ("fecha",) + FIN_DIMS]
+    date_from, date_to = _range(date_from, date_to)
+    qs = (
+        ResumenFinalizacion.objects.filter(fecha__gte=date_from, fecha__lte=date_to)
+        .values(*by, "bucket")
+        .annotate(n=Sum("finalizados"), m=Sum("minutos_total"))
+    )
+    groups = defaultdict(lambda: {"finalizados": 0, "con_duracion": 0, "minutos": 0, "buckets": defaultdict(int)})
+    for r in qs:
+        g = groups[tuple(r[d] for d in by)]
+        g["finalizados"] += r["n"]
+        g["buckets"][r["bucket"]] += r["n"]
+        if r["bucket"] != NO_DURATION:
+            g["con_duracion"] += r["n"]
+            g["minutos"] += r["m"]
+
+    report = []
+    for key in sorted(groups, key=lambda k: tuple(str(v) for v in k)):
+        g = groups[key]
+        report.append({
+            **{d: (v.isoformat() if d == "fecha" else v) for d, v in zip(by, key)},
+            "finalizados": g["finalizados"],
+            "minutos_promedio": round(g["minutos"] / g["con_duracion"], 1) if g["con_duracion"] else None,
+            "minutos_mediana": _median(g["buckets"]),
+        })
+    return report
+
+
+def error_report(date_from=None, date_to=None, by_day=False):
+    """Errores y resueltos por EmpleadoResponsable (y por día con by_day) en el rango."""
+    date_from, date_to = _range(date_from, date_to)
+    dims = ["fecha"] if by_day else []
+    qs = (
+        ResumenError.objects.filter(fecha__gte=date_from, fecha__lte=date_to)
+        .values(*dims, "responsable_id", "responsable__nombre")
+        .annotate(errores=Sum("errores"), resueltos=Sum("resueltos"))
+        .order_by(*dims, F("responsable__nombre").asc(nulls_last=True))
+    )
+    return [
+        {
+            **({"fecha": r["fecha"].isoformat()} if by_day else {}),
+            "responsable_id": r["responsable_id"],
+            "responsable": r["responsable__nombre"] or "Sin responsable",
+            "errores": r["errores"],
+            "resueltos": r["resueltos"],
+        }
+        for r in qs if r["errores"]
+    ]
@@ -0,0 +1,173 @@
+import unicodedata
+
+from django.db import transaction
+from django.db.models import Count, Q
+
+from .. import conf
+from ..models import IndiceBusqueda, IndiceTrigrama
+from .erp import as_date, folio_parts
+
+GRAM = 3
+
+
+def normalize(text):
+    """Minúsculas, sin acentos y con espacios colapsados: 'José  Pérez' -> 'jose perez'."""
+    text = unicodedata.normalize("NFKD", str(text or ""))
+    text = "".join(ch for ch in text if not unicodedata.combining(ch))
+    return " ".join(text.lower().split())
+
+
+def trigrams(text):
+    return {text[i:i + GRAM] for i in range(len(text) - GRAM + 1)}
+
+
+def parse_query(query):
+    """
+    Misma regla que erp.fetch_orders: si la búsqueda trae dígitos es por folio
+    (solo los dígitos); si no, por cliente. Devuelve (campo, término) o (None, None).
+    """
+    s_raw = str(query or "").strip()
+    s_digits = "".join(ch for ch in s_raw if ch.isdigit())
+    if s_digits:
+        return "folio", s_digits
+    term = normalize(s_raw)
+    return ("texto", term) if term else (None, None)
+
+
+def _entry(row):
+    folio, folio_num = folio_parts(row.get("folio"))
+    cliente = (row.get("cliente") or "")[:255]
+    return IndiceBusqueda(
+        doc_id=row["doc_id"],
+        folio=folio,
+        folio_num=folio_num,
+        cliente=cliente,
+        texto=normalize(cliente),
+        fecha_creacion=as_date(row.get("fecha_creacion")),
+    )
+
+
+def _grams(entry):
+    return trigrams(entry.folio or "") | trigrams(entry.texto)
+
+
+def index_orders(rows, only_new=False):
+    """
+    Agrega/actualiza filas del ERP en el índice. Con only_new=True (órdenes que
+    el tablero ve por primera vez) no se lee nada: solo inserciones en lote que
+    ignoran lo ya indexado. Debe correr dentro de una transacción.
+    """
+    incoming = {r["doc_id"]: _entry(r) for r in rows}
+    if not incoming:
+        return 0
+
+    if only_new:
+        fresh = list(incoming.values())
+        stale = []
+    else:
+        existing = {e.doc_id: e for e in IndiceBusqueda.objects.filter(doc_id__in=incoming)}
+        fresh, stale = [], []
+        for doc_id, new in incoming.items():
+            old = existing.get(doc_id)
+            if old is None:
+                fresh.append(new)
+            elif (old.folio, old.cliente, old.fecha_creacion) != (new.folio, new.cliente, new.fecha_creacion):
+                new.pk = old.pk
+                stale.append(new)
+
+    if fresh:
+        IndiceBusqueda.objects.bulk_create(fresh, ignore_conflicts=True)
+    if stale:
+        IndiceBusqueda.objects.bulk_update(stale, ["folio", "folio_num", "cliente", "texto", "fecha_creacion"])
+        IndiceTrigrama.objects.filter(doc_id__in=[e.doc_id for e in stale]).delete()
+    grams = [IndiceTrigrama(gram=g, doc_id=e.doc_id) for e in fresh + stale for g in _grams(e)]
+    if grams:
+        IndiceTrigrama.objects.bulk_create(grams, ignore_conflicts=True)
+    return len(fresh) + len(stale)
+
+
+def matching(query):
+    """
+    QuerySet de IndiceBusqueda que coincide con la búsqueda (sin ejecutar), con
+    la misma regla que el LIKE '%x%' del ERP (subcadena en folio o cliente):
+      - término >= 3 caracteres: doc_ids que tienen TODOS sus trigramas
+        (lecturas por índice de board_trigrama_uniq) y luego verificación exacta;
+      - 1-2 caracteres: no alcanzan un trigrama, subcadena directa sobre la
+        tabla local (quien la usa ordena por fecha y corta con un límite).
+    Folio numérico además coincide exacto con folio_num (como D.CFOLIO = n).
+    """
+    field, term = parse_query(query)
+    if field is None:
+        return IndiceBusqueda.objects.none()
+
+    cond = Q(**{f"{field}__contains": term})
+    if len(term) >= GRAM:
+        grams = trigrams(term)
+        candidates = (
+            IndiceTrigrama.objects.filter(gram__in=grams)
+            .values("doc_id")
+            .annotate(n=Count("gram"))
+            .filter(n=len(grams))
+            .values("doc_id")
+        )
+        cond &= Q(doc_id__in=candidates)
+    if field == "folio":
+        cond |= Q(folio_num=int(term))
+    return IndiceBusqueda.objects.filter(cond)
+
+
+def reindex_changed(previous, rows):
+    """
+    Reindexa las filas cuyo cliente, folio o fecha cambiaron respecto a
+    'previous' (filas anteriores del mismo documento). Las que no estaban en
+    'previous' no se tocan: las nuevas las indexa el tablero al verlas.
+    Devuelve cuántas se reindexaron.
+    """
+    before = {r["doc_id"]: r for r in previous}
+    changed = [
+        r for r in rows
+        if r["doc_id"] in before
+        and any(before[r["doc_id"]].get(f) != r.get(f) for f in ("cliente", "folio", "fecha_creacion"))
+    ]
+    if not changed:
+        return 0
+    with transaction.atomic():
+        return index_orders(changed)
+
+
+def resolve(query, date_from=None, limit=None):
+    """doc_ids que coinciden (más recientes primero), acotados a SEARCH_MAX_RESULTS."""
+    qs = matching(query)
+    if date_from:
+        qs = qs.filter(fecha_creacion__gte=as_date(date_from))
+    limit = int(limit or conf.get("SEARCH_MAX_RESULTS"))
+    return list(qs.order_by("-fecha_creacion", "-doc_id").values_list("doc_id", flat=True)[:limit])
+
+
+def suggest(query, limit=None):
+    """Sugerencias para el typeahead: [{doc_id, folio, cliente}], sin tocar el ERP."""
+    limit = int(limit or conf.get("SEARCH_SUGGEST_LIMIT"))
+    return list(
+        matching(query)
+        .order_by("-fecha_creacion", "-doc_id")
+        .values("doc_id", "folio", "cliente")[:limit]
+    )
+
+
+def rebuild(fetch_batch, batch=1000, start=0):
+    """
+    Llena el índice desde cero o continúa desde 'start' (CIDDOCUMENTO):
+    fetch_batch(after_doc_id, limit) -> filas del ERP en orden de doc_id.
+    Devuelve (indexados, último doc_id).
+    """
+    total, last = 0, start
+    while True:
+        rows = fetch_batch(last, batch)
+        if not rows:
+            break
+        with transaction.atomic():
+            total += index_orders(rows)
+        last = max(r["doc_id"] for r in rows)
+        if len(rows) < batch:
+            break
+    return total, last
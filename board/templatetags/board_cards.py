@@ -0,0 +1,12 @@
+from django import template
+from django.utils.safestring import mark_safe
+
+from ..services.cache import render_cards as _render_cards
+
+register = template.Library()
+
+
+@register.simple_tag
+def render_cards(cards, oob=False):
+    """{% render_cards orders %}: tarjetas desde el cache de fragmentos (ver services.cache)."""
+    return mark_safe("".join(_render_cards(cards or [], oob=oob)))
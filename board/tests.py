@@ -1,3 +1,1747 @@
-from django.test import TestCase
+import asyncio
+import contextlib
+import os
+import pickle
+import tempfile
+import threading
+import time
+from datetime import datetime
+from unittest import mock
+from urllib.parse import unquote
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.db.models import F, Sum
+from django.db.utils import OperationalError
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from .models import (
+    EmpleadoResponsable, ErpDocumento, ErpMirrorEstado, IndiceBusqueda, OrdenUIState, OrdenUIStateArchivo, ResumenError, ResumenFinalizacion,
+)
+from .services import cache as board_cache
+from .services import archive, bench, breaker, delta, erp, erp_standin, events, export, metrics, mirror, orders, rollup
+from .services import search as search_index
+from . import conf, views, views_sse
+
+
+def _erp_row(doc_id, **extra):
+    row = {
+        "doc_id": doc_id,
+        "folio": float(1000 + doc_id),
+        "cliente": f"Cliente {doc_id}",
+        "fecha_creacion": datetime(2025, 8, 27),
+        "fecha_entrega": None,
+        "observ": "1",
+        "referencia": "",
+        "total_u": 5.0,
+        "pend_u": 2.0,
+        "vendedor": "Vendedor",
+        "almacen_calc": "1",
+        "metodo_entrega": "Paquetería",
+        "status_erp": "SURTIDO",
+    }
+    row.update(extra)
+    return row
+
+
+class BuildCardsQueryCountTests(TestCase):
+    """build_cards debe hacer un número constante de queries locales, sin importar cuántas órdenes haya."""
+
+    def _build(self, rows):
+        with mock.patch.object(orders, "cached_fetch_orders", return_value=rows):
+            return orders.build_cards(date_from="2025-08-27")
+
+    def _count(self, rows):
+        # Los trigramas del índice de búsqueda se insertan en lotes del motor
+        # (en SQLite crecen con las filas); se cuentan aparte
+        with CaptureQueriesContext(connection) as ctx:
+            cards = self._build(rows)
+        return len([q for q in ctx.captured_queries if "board_indicetrigrama" not in q["sql"]]), cards
+
+    def test_first_seen_orders_are_created_in_bulk(self):
+        small, cards = self._count([_erp_row(i) for i in range(1, 4)])
+        self.assertEqual(len(cards), 3)
+        OrdenUIState.objects.all().delete()
+        # 70 filas caben en un solo INSERT de SQLite (999 parámetros / 13 columnas)
+        large, cards = self._count([_erp_row(i) for i in range(1, 71)])
+        self.assertEqual(len(cards), 70)
+        self.assertEqual(small, large)
+        # select + archivo (solo por las nunca vistas) + (savepoint) insert + índice
+        # de búsqueda (release) + releer creados
+        self.assertLessEqual(large, 7)
+        self.assertEqual(OrdenUIState.objects.filter(first_seen_at__isnull=False).count(), 70)
+        self.assertEqual(OrdenUIState.objects.get(doc_id=1).folio, "1001")
+
+    def test_steady_state_poll_does_not_write(self):
+        rows = [_erp_row(i) for i in range(1, 40)]
+        self._build(rows)
+        with self.assertNumQueries(1):
+            self._build(rows)
+
+    def test_error_responsable_is_joined(self):
+        rows = [_erp_row(i) for i in range(1, 30)]
+        self._build(rows)
+        resp = EmpleadoResponsable.objects.create(nombre="Ana")
+        OrdenUIState.objects.update(has_error=True, error_responsable=resp)
+        with self.assertNumQueries(1):
+            cards = self._build(rows)
+        self.assertTrue(all(c["error_responsable"] == "Ana" for c in cards))
+
+    def test_concurrent_insert_of_same_doc_id_keeps_first_row(self):
+        first_seen = timezone.make_aware(datetime(2025, 8, 27, 9, 30))
+        real_bulk_create = OrdenUIState.objects.bulk_create
+
+        def racing_bulk_create(objs, **kwargs):
+            # Otro worker insertó doc 2 entre nuestra lectura y el bulk_create
+            OrdenUIState.objects.create(doc_id=2, first_seen_at=first_seen)
+            return real_bulk_create(objs, **kwargs)
+
+        with mock.patch.object(OrdenUIState.objects, "bulk_create", side_effect=racing_bulk_create):
+            cards = self._build([_erp_row(1), _erp_row(2)])
+
+        self.assertEqual(OrdenUIState.objects.filter(doc_id=2).count(), 1)
+        self.assertEqual(OrdenUIState.objects.get(doc_id=2).first_seen_at, first_seen)
+        self.assertEqual(cards[1]["fecha_creacion"].time(), timezone.localtime(first_seen).time())
+
+
+class FastPathCardTests(TestCase):
+    """La tarjeta de una sola orden (abuild_card) es idéntica a la del tablero completo."""
+
+    def setUp(self):
+        self.rows = {d: _erp_row(d, pend_u=float(d % 3), total_u=2.0) for d in range(1, 5)}
+        patcher = mock.patch.object(
+            orders, "orders_source",
+            return_value=lambda doc_ids=None, **kw: [dict(self.rows[d]) for d in doc_ids if d in self.rows],
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _board(self):
+        with mock.patch.object(orders, "cached_fetch_orders", return_value=[dict(r) for r in self.rows.values()]):
+            return {c["pk"]: c for c in orders.build_cards(date_from="2025-08-27")}
+
+    def test_fast_path_matches_board_card(self):
+        # doc 4 se ve primero por el camino rápido (lo da de alta él)
+        first = async_to_sync(orders.abuild_card)(4)
+        self._board()
+        ana = EmpleadoResponsable.objects.create(nombre="Ana")
+        noon = timezone.make_aware(datetime.combine(timezone.localdate(), datetime.min.time()).replace(hour=12))
+        OrdenUIState.objects.filter(doc_id=2).update(is_finalizado=True, fecha_finalizacion=noon)
+        OrdenUIState.objects.filter(doc_id=3).update(has_error=True, error_responsable=ana, error_comentarios="faltó")
+
+        board = self._board()
+        self.assertEqual(sorted(board), [1, 2, 3, 4])
+        self.assertEqual(first, board[4])
+        for doc_id, card in board.items():
+            self.assertEqual(async_to_sync(orders.abuild_card)(doc_id), card)
+        self.assertEqual(board[2]["status"], "FINALIZADO")
+        self.assertEqual(board[3]["error_responsable"], "Ana")
+
+    def test_missing_document(self):
+        self.assertIsNone(async_to_sync(orders.abuild_card)(404))
+
+
+class BuildKpisTests(SimpleTestCase):
+    """Conteos por status y desgloses por almacén / método de entrega en una sola pasada."""
+
+    def test_breakdowns_by_almacen_and_metodo(self):
+        cards = [
+            {"status": "PENDIENTE", "almacen": "1", "metodo_entrega": "Paquetería"},
+            {"status": "SURTIDO", "almacen": "1", "metodo_entrega": "Repartidor"},
+            {"status": "SURTIDO", "almacen": "Mixto", "metodo_entrega": "Paquetería"},
+            {"status": "FINALIZADO", "almacen": "2", "metodo_entrega": "Paquetería"},
+            {"status": "PENDIENTE", "almacen": "2", "metodo_entrega": "Sucursal"},
+        ]
+        kpis = orders.build_kpis(cards)
+        self.assertEqual(
+            kpis["kpis"],
+            [{"label": "Pendientes", "value": 2}, {"label": "Surtidos", "value": 2}, {"label": "Finalizados", "value": 1}],
+        )
+        self.assertEqual(kpis["por_almacen"], [
+            {"label": "1", "total": 2, "PENDIENTE": 1, "SURTIDO": 1, "FINALIZADO": 0},
+            {"label": "2", "total": 2, "PENDIENTE": 1, "SURTIDO": 0, "FINALIZADO": 1},
+            {"label": "Mixto", "total": 1, "PENDIENTE": 0, "SURTIDO": 1, "FINALIZADO": 0},
+        ])
+        self.assertEqual([(r["label"], r["total"]) for r in kpis["por_metodo"]][0], ("Paquetería", 3))
+        self.assertEqual(
+            {r["label"]: r["total"] for r in kpis["por_metodo"]},
+            {"Paquetería": 3, "Repartidor": 1, "Sucursal": 1},
+        )
+        self.assertEqual(sum(r["total"] for r in kpis["por_metodo"]), len(cards))
+
+    def test_empty_board(self):
+        kpis = orders.build_kpis([])
+        self.assertEqual([k["value"] for k in kpis["kpis"]], [0, 0, 0])
+        self.assertEqual((kpis["por_almacen"], kpis["por_metodo"]), ([], []))
+
+
+@override_settings(CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}})
+class ConditionalPollTests(TestCase):
+    """Los parciales que se consultan por polling contestan 304 mientras el tablero no cambie."""
+
+    def setUp(self):
+        self.rows = [_erp_row(i) for i in range(1, 6)]
+        patches = [
+            mock.patch.object(orders, "cached_fetch_orders", side_effect=lambda **kw: [dict(r) for r in self.rows]),
+            mock.patch.object(views, "prefetch_items"),
+        ]
+        for p in patches:
+            p.start()
+            self.addCleanup(p.stop)
+
+    def _get(self, view, etag=None):
+        headers = {"If-None-Match": etag} if etag else {}
+        request = RequestFactory().get("/", {"date_from": "2025-08-27"}, headers=headers)
+        return view.as_view()(request)
+
+    def test_board_and_kpis_answer_304_until_something_changes(self):
+        for view in (views.BoardPartialView, views.OrdersCardsPartialView, views.KpisPartialView):
+            first = self._get(view)
+            self.assertEqual(first.status_code, 200)
+            self.assertTrue(first["ETag"])
+            again = self._get(view, first["ETag"])
+            self.assertEqual(again.status_code, 304)
+            self.assertEqual(again.content, b"")
+
+        etag = self._get(views.BoardPartialView)["ETag"]
+        OrdenUIState.objects.filter(doc_id=3).update(has_error=True)
+        self.assertEqual(self._get(views.BoardPartialView, etag).status_code, 200)
+
+    def test_etag_differs_per_view_and_filters(self):
+        board = self._get(views.BoardPartialView)["ETag"]
+        cards = self._get(views.OrdersCardsPartialView)["ETag"]
+        self.assertNotEqual(board, cards)
+        request = RequestFactory().get("/", {"date_from": "2025-08-28"}, headers={"If-None-Match": board})
+        self.assertEqual(views.BoardPartialView.as_view()(request).status_code, 200)
+
+
+@override_settings(CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}})
+class DeltaTests(SimpleTestCase):
+    """track() recuerda firmas por tablero y changes_since() arma el delta o pide render completo."""
+
+    def setUp(self):
+        delta._cache().clear()
+
+    def _cards(self, *pks, **changes):
+        return [{"pk": pk, "status": changes.get(str(pk), "SURTIDO")} for pk in pks]
+
+    def test_added_changed_and_removed_since_last_poll(self):
+        state = delta.track("k", self._cards(1, 2, 3), now=100)
+        self.assertEqual(delta.changes_since(state, self._cards(1, 2, 3), 100, now=101), ([], [], []))
+
+        cards = self._cards(1, 3, 4, **{"3": "FINALIZADO"})
+        state = delta.track("k", cards, now=110)
+        added, changed, removed = delta.changes_since(state, cards, 105, now=111)
+        self.assertEqual([c["pk"] for c in added], [4])
+        self.assertEqual([c["pk"] for c in changed], [3])
+        self.assertEqual(removed, [2])
+        # Un cliente que ya vio ese poll no recibe nada
+        self.assertEqual(delta.changes_since(state, cards, 110, now=111), ([], [], []))
+
+    def test_state_is_shared_through_the_cache(self):
+        delta.track("k", self._cards(1, 2), now=100)
+        state = delta.track("k", self._cards(1, 2), now=120)
+        self.assertEqual(state["created"], 100)
+        self.assertEqual(sorted(state["cards"]), [1, 2])
+
+    def test_full_render_when_history_is_missing_or_too_old(self):
+        state = delta.track("k", self._cards(1, 2), now=100)
+        self.assertIsNone(delta.changes_since(state, self._cards(1, 2), 90, now=101))
+        with override_settings(BOARD_DELTA_MAX_GAP=10):
+            self.assertIsNone(delta.changes_since(state, self._cards(1, 2), 100, now=200))
+
+    def test_full_render_when_added_cards_are_not_last(self):
+        delta.track("k", self._cards(2, 3), now=100)
+        cards = self._cards(1, 2, 3)
+        state = delta.track("k", cards, now=110)
+        self.assertIsNone(delta.changes_since(state, cards, 105, now=111))
+
+        cards = self._cards(1, 2, 3, 4)
+        state = delta.track("k", cards, now=120)
+        added, _, _ = delta.changes_since(state, cards, 115, now=121)
+        self.assertEqual([c["pk"] for c in added], [4])
+
+
+@override_settings(CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}})
+class DeltaPollTests(TestCase):
+    """El poll con 'since' del mismo tablero contesta solo swaps out-of-band."""
+
+    def setUp(self):
+        delta._cache().clear()
+        self.rows = [_erp_row(i) for i in range(1, 4)]
+        patches = [
+            mock.patch.object(orders, "cached_fetch_orders", side_effect=lambda **kw: [dict(r) for r in self.rows]),
+            mock.patch.object(views, "prefetch_items"),
+        ]
+        for p in patches:
+            p.start()
+            self.addCleanup(p.stop)
+
+    def _get(self, **params):
+        request = RequestFactory().get("/", {"date_from": "2025-08-27", **params})
+        return views.OrdersCardsPartialView.as_view()(request)
+
+    def _since(self, response):
+        html = response.content.decode()
+        key = delta.board_key("relevantes", None, "2025-08-27")
+        self.assertIn(f'data-key="{key}"', html)
+        since = html.split('id="last-ts" value="', 1)[1].split('"', 1)[0]
+        return {"key": key, "since": since}
+
+    def test_delta_response_is_out_of_band(self):
+        params = self._since(self._get())
+        OrdenUIState.objects.filter(doc_id=2).update(has_error=True)
+        self.rows = self.rows[:2] + [_erp_row(4)]
+
+        response = self._get(**params)
+        html = response.content.decode()
+        self.assertEqual(response["HX-Reswap"], "none")
+        self.assertIn('id="card-2"', html)
+        self.assertIn('hx-swap-oob="delete"', html)
+        self.assertIn('id="card-3"', html)
+        self.assertIn('hx-swap-oob="beforeend:#cards"', html)
+        self.assertNotIn('id="card-1"', html)
+
+    def test_added_card_in_the_middle_forces_full_render(self):
+        params = self._since(self._get())
+        self.rows = [self.rows[0], _erp_row(9), *self.rows[1:]]
+
+        response = self._get(**params)
+        self.assertFalse(response.has_header("HX-Reswap"))
+        html = response.content.decode()
+        self.assertLess(html.index('id="card-1"'), html.index('id="card-9"'))
+        self.assertLess(html.index('id="card-9"'), html.index('id="card-2"'))
+
+    def test_other_board_key_gets_full_render(self):
+        params = self._since(self._get())
+        response = self._get(**{**params, "key": "otro"})
+        self.assertFalse(response.has_header("HX-Reswap"))
+        self.assertIn('id="card-1"', response.content.decode())
+
+
+class MirrorSyncTests(TestCase):
+    """Espejo de admDocumentos: marca de agua, re-verificación de abiertos, reconciliación y lag."""
+
+    def setUp(self):
+        today = datetime.combine(timezone.localdate(), datetime.min.time())
+        self.erp = {d: _erp_row(d, fecha_creacion=today) for d in range(1, 8)}
+        self.erp[2]["pend_u"] = 0.0  # ya surtido: no se re-verifica en pasadas normales
+        self.after_calls = []
+
+        def after(doc_id, limit=1000, fail_silently=True):
+            self.after_calls.append(doc_id)
+            return [dict(self.erp[d]) for d in sorted(self.erp) if d > doc_id][:limit]
+
+        def by_ids(doc_ids=None, fail_silently=True, **kw):
+            return [dict(self.erp[d]) for d in doc_ids if d in self.erp]
+
+        patches = [
+            mock.patch.object(mirror, "fetch_orders_after", side_effect=after),
+            mock.patch.object(mirror, "fetch_orders", side_effect=by_ids),
+        ]
+        for p in patches:
+            p.start()
+            self.addCleanup(p.stop)
+
+    def test_new_documents_follow_the_watermark_in_batches(self):
+        result = mirror.sync_mirror(batch=3)
+        self.assertEqual((result["nuevos"], result["watermark"]), (7, 7))
+        self.assertEqual(self.after_calls, [0, 3, 6])
+        self.assertEqual(ErpDocumento.objects.count(), 7)
+
+        self.erp[8] = _erp_row(8, fecha_creacion=self.erp[1]["fecha_creacion"])
+        self.after_calls.clear()
+        result = mirror.sync_mirror(batch=3)
+        self.assertEqual((result["nuevos"], result["watermark"]), (1, 8))
+        self.assertEqual(self.after_calls, [7])
+
+    def test_open_orders_are_rechecked_and_closed(self):
+        mirror.sync_mirror()
+        self.erp[3]["pend_u"] = 0.0
+        result = mirror.sync_mirror()
+        self.assertEqual(result["actualizados"], 1)
+        doc = ErpDocumento.objects.get(doc_id=3)
+        self.assertEqual((doc.pend_u, doc.abierto), (0.0, False))
+        self.assertEqual(mirror.sync_mirror()["actualizados"], 0)
+
+    def test_documents_gone_from_the_erp_are_removed(self):
+        mirror.sync_mirror()
+        del self.erp[4]  # abierto: se nota en la siguiente pasada
+        del self.erp[2]  # cerrado: solo lo detecta la reconciliación
+        self.assertEqual(mirror.sync_mirror()["eliminados"], 1)
+        self.assertTrue(ErpDocumento.objects.filter(doc_id=2).exists())
+
+        self.assertEqual(mirror.sync_mirror(reconcile=True)["eliminados"], 1)
+        self.assertEqual(sorted(ErpDocumento.objects.values_list("doc_id", flat=True)), [1, 3, 5, 6, 7])
+
+    @override_settings(CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}})
+    def test_changed_units_invalidate_cached_items(self):
+        mirror.sync_mirror()
+        board_cache._cache().set_many({board_cache._items_key(d): {"items": [], "pend_u": 2.0} for d in (3, 5)})
+        self.erp[3]["total_u"] = 9.0  # partida editada, mismo pend_u
+        self.erp[5]["referencia"] = "otra"
+        mirror.sync_mirror()
+        self.assertIsNone(board_cache._cache().get(board_cache._items_key(3)))
+        self.assertIsNotNone(board_cache._cache().get(board_cache._items_key(5)))
+
+    def test_renamed_cliente_is_reindexed(self):
+        mirror.sync_mirror()
+        search_index.index_orders([self.erp[d] for d in (3, 6)])
+        self.erp[3]["cliente"] = "Abarrotes Lupita"
+        self.erp[6]["pend_u"] = 0.0
+        mirror.sync_mirror()
+        self.assertEqual(IndiceBusqueda.objects.get(doc_id=3).cliente, "Abarrotes Lupita")
+        self.assertEqual(search_index.resolve("lupita"), [3])
+
+    def test_status_reports_lag_and_last_error(self):
+        self.assertEqual((mirror.mirror_status()["lag_seconds"], mirror.mirror_status()["healthy"]), (None, False))
+        mirror.sync_mirror()
+        status = mirror.mirror_status()
+        self.assertLess(status["lag_seconds"], 5)
+        self.assertTrue(status["healthy"])
+
+        ErpMirrorEstado.objects.update(last_success_at=timezone.now() - timezone.timedelta(minutes=10))
+        mirror.fetch_orders_after.side_effect = OperationalError("ERP caído")
+        with self.assertRaises(OperationalError):
+            mirror.sync_mirror()
+        status = mirror.mirror_status()
+        self.assertGreater(status["lag_seconds"], 590)
+        self.assertFalse(status["healthy"])
+        self.assertEqual(status["last_error"], "ERP caído")
+
+
+@override_settings(
+    CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}},
+    BOARD_EVENTS_POLL=0.01, BOARD_EVENTS_KEEPALIVE=0.05,
+)
+class BoardEventsTests(SimpleTestCase):
+    """Un watcher por proceso reparte cada publish() a los clientes SSE sin tocar ERP ni base."""
+
+    def setUp(self):
+        events._cache().clear()
+        events._broadcasters.clear()
+        patcher = mock.patch.object(orders, "build_cards", side_effect=AssertionError("no debe consultar"))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    async def test_publish_reaches_every_subscriber_once(self):
+        hub = events.broadcaster()
+        first, second = hub.subscribe(), hub.subscribe()
+        await asyncio.sleep(0.03)
+        events.publish()
+        events.publish()
+        version = await asyncio.wait_for(first.get(), 1)
+        self.assertIn(version, (1, 2))
+        self.assertIn(await asyncio.wait_for(second.get(), 1), (1, 2))
+
+        hub.unsubscribe(first)
+        hub.unsubscribe(second)
+        await asyncio.wait_for(hub.task, 1)
+        self.assertTrue(hub.task.done())
+
+    async def test_idle_watcher_does_not_notify(self):
+        hub = events.broadcaster()
+        queue = hub.subscribe()
+        await asyncio.sleep(0.1)
+        self.assertTrue(queue.empty())
+        hub.unsubscribe(queue)
+        await asyncio.wait_for(hub.task, 1)
+
+    async def test_event_stream(self):
+        request = RequestFactory().get("/events/")
+        response = await views_sse.BoardEventsView.as_view()(request)
+        self.assertEqual(response["Content-Type"], "text/event-stream")
+        stream = response.streaming_content
+        self.assertEqual(await anext(stream), b"retry: 3000\n\n")
+        self.assertEqual(await asyncio.wait_for(anext(stream), 1), b": keepalive\n\n")
+
+        version = events.publish()
+        chunk = await asyncio.wait_for(anext(stream), 1)
+        while chunk == b": keepalive\n\n":
+            chunk = await asyncio.wait_for(anext(stream), 1)
+        self.assertEqual(chunk, f"event: board\ndata: {version}\n\n".encode())
+
+
+class BoardRefreshTests(SimpleTestCase):
+    """Un solo refresco por despliegue lleva los cambios del ERP a los tableros SSE inactivos."""
+
+    def setUp(self):
+        board_cache._cache().clear()
+        events._broadcasters.clear()
+        self.rows = [_erp_row(1)]
+        patches = [
+            mock.patch.object(board_cache, "orders_source", return_value=lambda **kw: [dict(r) for r in self.rows]),
+            mock.patch.object(board_cache.search_index, "reindex_changed"),
+        ]
+        for p in patches:
+            p.start()
+            self.addCleanup(p.stop)
+
+    def _age_snapshot(self, date_from):
+        cache = board_cache._cache()
+        key = board_cache._snapshot_key(board_cache.normalize_filters(date_from=date_from))
+        entry = cache.get(key)
+        cache.set(key, {**entry, "fetched_at": entry["fetched_at"] - 3600}, None)
+
+    def test_refreshes_active_boards_once_per_period(self):
+        board_cache.remember_board(date_from="2025-08-27")
+        board_cache.cached_fetch_orders(date_from="2025-08-27")
+        self.rows.append(_erp_row(2))
+        self._age_snapshot("2025-08-27")
+
+        version = board_cache._cache().get(events.VERSION_KEY, 0)
+        self.assertEqual(board_cache.refresh_boards(), 1)
+        self.assertEqual(board_cache._cache().get(events.VERSION_KEY), version + 1)
+        self.assertEqual(len(board_cache.cached_fetch_orders(date_from="2025-08-27")), 2)
+        # Otro proceso en el mismo periodo no vuelve a consultar
+        self.assertIsNone(board_cache.refresh_boards())
+
+    def test_forgotten_boards_are_not_refreshed(self):
+        with override_settings(BOARD_EVENTS_BOARD_TTL=0.01):
+            board_cache.remember_board(date_from="2025-08-27")
+        time.sleep(0.05)
+        self.assertEqual(board_cache.refresh_boards(), 0)
+
+    @override_settings(BOARD_ORDERS_CACHE_TTL=0.05, BOARD_EVENTS_POLL=0.01)
+    async def test_watcher_publishes_erp_changes_without_requests(self):
+        board_cache.remember_board(date_from="2025-08-27")
+        board_cache.cached_fetch_orders(date_from="2025-08-27")
+        hub = events.broadcaster()
+        queue = hub.subscribe()
+        self.rows.append(_erp_row(2))
+
+        self.assertTrue(await asyncio.wait_for(queue.get(), 2))
+        hub.unsubscribe(queue)
+        await asyncio.wait_for(hub.task, 1)
+
+
+class OrderRowTests(SimpleTestCase):
+    def _row(self, **extra):
+        values = {**{name: None for name in erp.ORDER_FIELDS}, "doc_id": 7, "folio": 1007.0,
+                  "observ": " 2 ", "total_u": 5.0, "pend_u": 2.0, **extra}
+        return erp.OrderRow(*(values[name] for name in erp.ORDER_FIELDS))
+
+    def test_reads_like_the_old_dict(self):
+        row = self._row()
+        self.assertEqual(row["doc_id"], 7)
+        self.assertEqual(row.get("metodo_entrega"), "Repartidor")
+        self.assertEqual(row["status_erp"], "SURTIDO")
+        self.assertIsNone(row.get("no_existe"))
+        with self.assertRaises(KeyError):
+            row["no_existe"]
+        self.assertEqual(dict(row)["folio"], 1007.0)
+
+    def test_pickles_compactly_and_compares_by_value(self):
+        row = self._row(pend_u=5.0)
+        clone = pickle.loads(pickle.dumps(row, pickle.HIGHEST_PROTOCOL))
+        self.assertEqual(clone, row)
+        self.assertEqual(clone["status_erp"], "PENDIENTE")
+        self.assertNotIn(b"metodo_entrega", pickle.dumps(row, pickle.HIGHEST_PROTOCOL))
+
+    def test_reader_maps_columns_by_name(self):
+        cols = ["folio", "doc_id", "pend_u", "total_u"]
+        row = erp.OrderRow.reader(cols)((1001.0, 1, 0.0, 3.0))
+        self.assertEqual((row["doc_id"], row["folio"], row["cliente"]), (1, 1001.0, None))
+        self.assertEqual(row["status_erp"], "SURTIDO")
+
+
+class BulkPrintStreamingTests(TestCase):
+    def setUp(self):
+        self.user = get_user_model().objects.create_user("print")
+        self.client.force_login(self.user)
+        self.calls = []
+
+        def fetch_orders(doc_ids=None, **kwargs):
+            self.calls.append(list(doc_ids))
+            return [erp.OrderRow(*(_erp_row(d)[name] for name in erp.ORDER_FIELDS)) for d in doc_ids if d != 4]
+
+        patches = [
+            mock.patch.object(views.erp_service, "fetch_orders", side_effect=fetch_orders),
+            mock.patch.object(views, "cached_fetch_items", side_effect=lambda ids, pend: {d: [] for d in ids}),
+        ]
+        for p in patches:
+            p.start()
+            self.addCleanup(p.stop)
+
+    @override_settings(BOARD_PRINT_STREAM_CHUNK=2)
+    def test_streams_in_chunks_in_requested_order(self):
+        response = self.client.get("/orders/print/", {"ids": "5,1,4,3,2"})
+        self.assertTrue(response.streaming)
+        self.assertEqual(self.calls, [[5, 1]])  # solo el primer bloque antes de responder
+        body = b"".join(response.streaming_content).decode()
+        self.assertEqual(self.calls, [[5, 1], [4, 3], [2]])
+        self.assertEqual(body.count('class="print-page"'), 4)
+        self.assertLess(body.index("Cliente 5"), body.index("Cliente 1"))
+        self.assertLess(body.index("Cliente 3"), body.index("Cliente 2"))
+        self.assertIn("</html>", body)
+
+    def test_nothing_found_is_still_a_404(self):
+        self.assertEqual(self.client.get("/orders/print/", {"ids": "4"}).status_code, 404)
+
+
+@override_settings(CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}})
+class BulkPrintTests(TestCase):
+    """Muchas órdenes en un documento A4: un query de pedidos, uno de partidas y uno de estados."""
+
+    def setUp(self):
+        self.client.force_login(get_user_model().objects.create_user("bulkprint"))
+        self.addCleanup(board_cache._cache().clear)
+        self.order_calls, self.item_calls = [], []
+
+        def board_rows(**kwargs):
+            return [
+                _erp_row(1, almacen_calc="1"),
+                _erp_row(2, almacen_calc="2"),
+                _erp_row(3, almacen_calc="2", status_erp="PENDIENTE"),
+                _erp_row(4, almacen_calc="2"),
+            ]
+
+        def fetch_orders(doc_ids=None, **kwargs):
+            self.order_calls.append(list(doc_ids))
+            return [_erp_row(d) for d in doc_ids]
+
+        def fetch_items(doc_ids, fail_silently=True):
+            self.item_calls.append(sorted(doc_ids))
+            return {d: [
+                {"codigo": "B", "descripcion": "Segundo", "almacen": "1", "unidades": 1.0},
+                {"codigo": "Z", "descripcion": "Otro almacén", "almacen": "2", "unidades": 1.0},
+                {"codigo": "A", "descripcion": "Primero", "almacen": "1", "unidades": 1.0},
+            ] for d in doc_ids}
+
+        patches = [
+            mock.patch.object(orders, "cached_fetch_orders", side_effect=board_rows),
+            mock.patch.object(views.erp_service, "fetch_orders", side_effect=fetch_orders),
+            mock.patch.object(board_cache, "fetch_items_many", side_effect=fetch_items),
+        ]
+        for p in patches:
+            p.start()
+            self.addCleanup(p.stop)
+
+    def _body(self, params):
+        response = self.client.get("/orders/print/", params)
+        self.assertEqual(response.status_code, 200)
+        return b"".join(response.streaming_content).decode()
+
+    def test_ids_print_one_page_each_with_batched_reads(self):
+        seen = timezone.make_aware(datetime(2025, 8, 27, 9, 15))
+        OrdenUIState.objects.create(doc_id=2, first_seen_at=seen)
+        with CaptureQueriesContext(connection) as ctx:
+            body = self._body({"ids": "3,1,2"})
+        self.assertEqual(self.order_calls, [[3, 1, 2]])
+        self.assertEqual(self.item_calls, [[1, 2, 3]])
+        self.assertEqual(
+            len([q for q in ctx.captured_queries if 'FROM "board_ordenuistate"' in q["sql"]]), 1,
+        )
+        self.assertEqual(body.count('class="print-page"'), 3)
+        self.assertLess(body.index("Cliente 3"), body.index("Cliente 1"))
+        # La hora de creación es la que registró la app, no el 00:00 del ERP
+        self.assertIn("Creado: 27/08/2025 09:15", body)
+        # Partidas por almacén y luego por código
+        page = body[body.index("Cliente 1"):]
+        self.assertLess(page.index("Primero"), page.index("Segundo"))
+        self.assertLess(page.index("Segundo"), page.index("Otro almacén"))
+
+    def test_board_filters_pick_almacen_and_status(self):
+        self._body({"view": "relevantes", "almacen": "2", "status": "SURTIDO"})
+        self.assertEqual(self.order_calls, [[2, 4]])
+
+    @override_settings(BOARD_PRINT_MAX_ORDERS=2)
+    def test_caps_the_number_of_orders(self):
+        self.assertEqual(self._body({"ids": "1,2,3"}).count('class="print-page"'), 2)
+        self.order_calls.clear()
+        self._body({"view": "relevantes"})
+        self.assertEqual(self.order_calls, [[1, 2]])
+
+    def test_requires_login(self):
+        self.client.logout()
+        self.assertEqual(self.client.get("/orders/print/", {"ids": "1"}).status_code, 302)
+
+
+@override_settings(CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}})
+class AsyncViewsTests(TestCase):
+    """Las vistas async piden orden, partidas y DB local a la vez: tardan lo del más lento."""
+
+    def setUp(self):
+        self.client.force_login(get_user_model().objects.create_user("async"))
+        self.addCleanup(board_cache._cache().clear)
+        self.item_calls = []
+        # Orden y partidas se esperan una a la otra: solo pasan si están en vuelo a la vez
+        self.rendezvous = None
+        self.met = []
+
+        def meet():
+            if self.rendezvous is None:
+                return
+            try:
+                self.rendezvous.wait()
+                self.met.append(True)
+            except threading.BrokenBarrierError:
+                self.met.append(False)
+
+        def orders_rows(doc_ids=None, **kwargs):
+            meet()
+            return [_erp_row(int(d)) for d in doc_ids if int(d) != 404]
+
+        def items(doc_ids, fail_silently=True):
+            self.item_calls.append(list(doc_ids))
+            meet()
+            return {d: [{"codigo": "P1", "descripcion": "Producto", "almacen": "1", "unidades": 2.0}] for d in doc_ids}
+
+        patches = [
+            mock.patch.object(orders, "orders_source", return_value=orders_rows),
+            mock.patch.object(views.erp_service, "fetch_orders", side_effect=orders_rows),
+            mock.patch.object(board_cache, "fetch_items_many", side_effect=items),
+        ]
+        for p in patches:
+            p.start()
+            self.addCleanup(p.stop)
+
+    def _overlapped(self, method, url):
+        """La respuesta de una petición en la que orden y partidas tuvieron que coincidir."""
+        self.rendezvous, self.met = threading.Barrier(2, timeout=5), []
+        try:
+            response = getattr(self.client, method)(url)
+        finally:
+            self.rendezvous = None
+        self.assertEqual(self.met, [True, True])
+        return response
+
+    def test_detail_overlaps_order_and_items(self):
+        response = self._overlapped("get", "/orders/7/detail/")
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, "Cliente 7")
+        self.assertContains(response, "P1")
+        # Las partidas quedaron en cache con el pend_u de la orden: el segundo modal no las relee
+        self.client.get("/orders/7/detail/")
+        self.assertEqual(self.item_calls, [[7]])
+
+    def test_print_overlaps_and_404(self):
+        response = self._overlapped("get", "/orders/7/print/")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.client.get("/orders/404/print/").status_code, 404)
+        self.assertEqual(self.client.get("/orders/abc/print/").status_code, 404)
+
+    def test_complete_toggle_is_async(self):
+        response = self.client.post("/orders/7/complete/", {"context": "detail"})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["HX-Trigger"], "refreshKpis")
+        self.assertTrue(OrdenUIState.objects.get(doc_id=7).is_finalizado)
+        self.assertEqual(self.client.get("/orders/7/complete/").status_code, 405)
+        resp = EmpleadoResponsable.objects.create(nombre="Ana")
+        self.assertEqual(self.client.post("/orders/7/error/toggle/").status_code, 200)
+        saved = self.client.post("/orders/7/error/save/", {"error_responsable": str(resp.pk)})
+        self.assertContains(saved, "Ana")
+        self.assertEqual(OrdenUIState.objects.get(doc_id=7).error_responsable, resp)
+        self.assertEqual(self.client.post("/orders/7/complete/", {"context": "card"}).status_code, 200)
+        self.assertFalse(OrdenUIState.objects.get(doc_id=7).is_finalizado)
+
+
+@override_settings(CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}})
+class RollupTests(TestCase):
+    """Los resúmenes siguen a cada toggle y coinciden con un rebuild desde cero."""
+
+    def setUp(self):
+        self.client.force_login(get_user_model().objects.create_user("rollup"))
+        self.addCleanup(board_cache._cache().clear)
+        self.ana = EmpleadoResponsable.objects.create(nombre="Ana")
+
+        def source(doc_ids=None, **kwargs):
+            return [_erp_row(int(d), almacen_calc="2" if int(d) % 2 else "1") for d in doc_ids]
+
+        patches = [
+            mock.patch.object(orders, "orders_source", return_value=source),
+            mock.patch.object(board_cache, "fetch_items_many", return_value={}),
+        ]
+        for p in patches:
+            p.start()
+            self.addCleanup(p.stop)
+
+    def _snapshot(self):
+        fin = sorted(ResumenFinalizacion.objects.exclude(finalizados=0).values_list(
+            "fecha", "almacen", "vendedor", "bucket", "finalizados", "minutos_total",
+        ))
+        err = sorted(ResumenError.objects.exclude(errores=0).values_list(
+            "fecha", "responsable_id", "errores", "resueltos",
+        ), key=str)
+        return fin, err
+
+    def _report(self):
+        return self.client.get("/reports/", {"by": "almacen"}).json()
+
+    def test_toggles_keep_summaries_in_sync_with_rebuild(self):
+        for doc_id in (1, 2, 3):
+            self.client.post(f"/orders/{doc_id}/complete/", {"context": "card"})
+        self.assertEqual(
+            [(r["almacen"], r["finalizados"]) for r in self._report()["finalizacion"]], [("1", 1), ("2", 2)],
+        )
+        self.assertEqual(OrdenUIState.objects.get(doc_id=3).vendedor, "Vendedor")
+
+        # Reabrir resta; los errores solo cuentan en finalizadas
+        self.client.post("/orders/3/complete/", {"context": "card"})
+        self.assertEqual(self.client.post("/orders/3/error/toggle/").status_code, 403)
+        self.client.post("/orders/1/error/toggle/")
+        self.client.post("/orders/1/error/save/", {"error_responsable": str(self.ana.pk), "error_resuelto": "on"})
+        self.client.post("/orders/2/error/toggle/")
+
+        report = self._report()
+        self.assertEqual(
+            [(r["almacen"], r["finalizados"]) for r in report["finalizacion"]], [("1", 1), ("2", 1)],
+        )
+        self.assertEqual(
+            [(r["responsable"], r["errores"], r["resueltos"]) for r in report["errores"]],
+            [("Ana", 1, 1), ("Sin responsable", 1, 0)],
+        )
+
+        incremental = self._snapshot()
+        rollup.rebuild()
+        self.assertEqual(self._snapshot(), incremental)
+
+        # Apagar el error de la 1 lo quita del resumen de Ana
+        self.client.post("/orders/1/error/toggle/")
+        self.assertEqual([r["responsable"] for r in self._report()["errores"]], ["Sin responsable"])
+
+    def test_deleting_responsable_folds_into_sin_responsable(self):
+        for doc_id in (1, 2):
+            self.client.post(f"/orders/{doc_id}/complete/", {"context": "card"})
+            self.client.post(f"/orders/{doc_id}/error/toggle/")
+        self.client.post("/orders/1/error/save/", {"error_responsable": str(self.ana.pk), "error_resuelto": "on"})
+
+        # Borrar a Ana no falla: su fila se suma a la "sin responsable" ya existente del día
+        self.ana.delete()
+        self.assertIsNone(OrdenUIState.objects.get(doc_id=1).error_responsable_id)
+        self.assertEqual(
+            [(r["responsable"], r["errores"], r["resueltos"]) for r in self._report()["errores"]],
+            [("Sin responsable", 2, 1)],
+        )
+        incremental = self._snapshot()
+        rollup.rebuild()
+        self.assertEqual(self._snapshot(), incremental)
+
+    def test_duration_buckets_and_median(self):
+        now = timezone.now()
+        for doc_id, minutes in ((1, 3), (2, 20), (3, 50), (4, 90)):
+            OrdenUIState.objects.create(
+                doc_id=doc_id, is_finalizado=True, almacen="1", vendedor="V",
+                first_seen_at=now - timezone.timedelta(minutes=minutes), fecha_finalizacion=now,
+            )
+        OrdenUIState.objects.create(doc_id=5, is_finalizado=True, almacen="1", vendedor="V", fecha_finalizacion=now)
+        rollup.rebuild()
+        [row] = rollup.finalization_report(by=("almacen",))
+        self.assertEqual(row["finalizados"], 5)
+        self.assertEqual(row["minutos_promedio"], 40.8)
+        # Mediana de 3, 20, 50, 90 interpolada en el rango (15, 30]
+        self.assertEqual(row["minutos_mediana"], 30.0)
+
+
+@override_settings(CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}})
+class VersionedToggleTests(TestCase):
+    """Los toggles son un UPDATE condicionado a la versión: nada se pisa y el perdedor recibe 409."""
+
+    def setUp(self):
+        self.client.force_login(get_user_model().objects.create_user("version"))
+        self.addCleanup(board_cache._cache().clear)
+        patches = [
+            mock.patch.object(orders, "orders_source", return_value=lambda doc_ids=None, **kw: [_erp_row(d) for d in doc_ids]),
+            mock.patch.object(board_cache, "fetch_items_many", return_value={}),
+        ]
+        for p in patches:
+            p.start()
+            self.addCleanup(p.stop)
+
+    def _complete(self, version):
+        return self.client.post("/orders/7/complete/", {"context": "card", "version": version})
+
+    def test_stale_version_gets_conflict_with_fresh_card(self):
+        first = self._complete("0")
+        self.assertEqual(first.status_code, 200)
+        self.assertContains(first, '"version":"1"')
+        # Doble clic / otra pantalla con la tarjeta vieja: no reabre, recibe el estado actual
+        second = self._complete("0")
+        self.assertEqual(second.status_code, 409)
+        self.assertContains(second, "FINALIZADO", status_code=409)
+        self.assertContains(second, '"version":"1"', status_code=409)
+        ui = OrdenUIState.objects.get(doc_id=7)
+        self.assertEqual((ui.is_finalizado, ui.version), (True, 1))
+        self.assertEqual(ResumenFinalizacion.objects.aggregate(n=Sum("finalizados"))["n"], 1)
+
+        self.assertEqual(self.client.post("/orders/7/error/toggle/", {"version": "0"}).status_code, 409)
+        self.assertEqual(self.client.post("/orders/7/error/toggle/", {"version": "1"}).status_code, 200)
+        self.assertEqual(OrdenUIState.objects.get(doc_id=7).version, 2)
+
+    def test_error_edit_refreshes_modal_actions_version(self):
+        detail = self.client.post("/orders/7/complete/", {"context": "detail", "version": "0"})
+        self.assertContains(detail, 'id="detail-actions-7"')
+        self.assertContains(detail, '"version":"1"')
+
+        toggled = self.client.post("/orders/7/error/toggle/", {"version": "1"})
+        self.assertContains(toggled, '<div id="detail-actions-7" hx-swap-oob="true">')
+        self.assertContains(toggled, '"context":"detail","version":"2"')
+        # Reabrir con la versión que quedó en el modal no choca con la edición propia
+        version = toggled.content.decode().split('"context":"detail","version":"')[1].split('"')[0]
+        reopened = self.client.post("/orders/7/complete/", {"context": "detail", "version": version})
+        self.assertEqual(reopened.status_code, 200)
+        self.assertFalse(OrdenUIState.objects.get(doc_id=7).is_finalizado)
+
+    def test_update_writes_only_changed_columns(self):
+        OrdenUIState.objects.create(doc_id=7, first_seen_at=timezone.now(), error_comentarios="nota")
+        with CaptureQueriesContext(connection) as ctx:
+            self.assertEqual(self._complete("0").status_code, 200)
+        [update] = [q["sql"] for q in ctx.captured_queries if q["sql"].startswith('UPDATE "board_ordenuistate"')]
+        self.assertIn('"is_finalizado"', update)
+        self.assertIn('"version" = ("board_ordenuistate"."version" + 1)', update)
+        self.assertNotIn('"error_comentarios"', update)
+        self.assertIn('"version" = 0', update.split("WHERE")[1])
+
+    def test_interleaved_write_is_retried_on_fresh_state(self):
+        OrdenUIState.objects.create(doc_id=7, first_seen_at=timezone.now(), is_finalizado=True,
+                                    fecha_finalizacion=timezone.now())
+        calls = []
+
+        def reopen(ui):
+            calls.append(ui.version)
+            if len(calls) == 1:
+                # Otro request escribe entre nuestra lectura y nuestro UPDATE
+                OrdenUIState.objects.filter(doc_id=7).update(error_comentarios="otro", version=F("version") + 1)
+            ui.is_finalizado = False
+            ui.fecha_finalizacion = None
+
+        ui, saved = rollup.update_ui(7, reopen)
+        self.assertTrue(saved)
+        self.assertEqual(calls, [0, 1])
+        ui.refresh_from_db()
+        self.assertEqual((ui.is_finalizado, ui.error_comentarios, ui.version), (False, "otro", 2))
+        with self.assertRaises(rollup.VersionConflict):
+            rollup.update_ui(7, reopen, version=1)
+
+
+@override_settings(CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}})
+class BulkCompleteTests(TestCase):
+    """Finalizar / reabrir N tarjetas es un POST, un bulk_update y solo swaps out-of-band."""
+
+    def setUp(self):
+        self.client.force_login(get_user_model().objects.create_user("bulk"))
+        self.addCleanup(board_cache._cache().clear)
+
+        def rows(doc_ids=None, **kwargs):
+            ids = doc_ids if doc_ids is not None else range(1, 41)
+            return [_erp_row(int(d), status_erp="PENDIENTE" if int(d) == 3 else "SURTIDO") for d in ids if int(d) <= 40]
+
+        patches = [
+            mock.patch.object(views, "orders_source", return_value=rows),
+            mock.patch.object(orders, "cached_fetch_orders", side_effect=rows),
+            mock.patch.object(views.events, "publish"),
+        ]
+        for p in patches:
+            p.start()
+            self.addCleanup(p.stop)
+
+    def _post(self, action, ids):
+        return self.client.post("/orders/bulk-complete/", {"action": action, "ids": ids, "view": "relevantes"})
+
+    def _updates(self, action, ids):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self._post(action, ids)
+        self.assertEqual(response.status_code, 200)
+        # Solo el cambio de estado (armar el tablero para los KPIs puede completar folios nuevos)
+        return response, [
+            q["sql"] for q in ctx.captured_queries
+            if q["sql"].startswith('UPDATE "board_ordenuistate" SET "is_finalizado"')
+        ]
+
+    def test_finalize_and_reopen_in_one_update(self):
+        response, updates = self._updates("finalize", "1,2,3,99")
+        self.assertEqual(len(updates), 1)
+        self.assertEqual(response["HX-Reswap"], "none")
+        body = response.content.decode()
+        self.assertIn('id="card-1" hx-swap-oob="true"', body)
+        self.assertIn('id="card-2" hx-swap-oob="true"', body)
+        self.assertNotIn('id="card-3"', body)  # PENDIENTE: sin botón, no se finaliza
+        self.assertIn('id="kpis" hx-swap-oob="innerHTML"', body)
+        self.assertEqual(
+            sorted(OrdenUIState.objects.filter(is_finalizado=True).values_list("doc_id", flat=True)), [1, 2],
+        )
+        self.assertEqual(ResumenFinalizacion.objects.aggregate(n=Sum("finalizados"))["n"], 2)
+
+        _, updates = self._updates("finalize", ",".join(map(str, range(1, 41))))
+        self.assertEqual(len(updates), 1)
+        self.assertEqual(ResumenFinalizacion.objects.aggregate(n=Sum("finalizados"))["n"], 39)
+
+        _, updates = self._updates("reopen", ["1", "2"])
+        self.assertEqual(len(updates), 1)
+        self.assertFalse(OrdenUIState.objects.filter(doc_id__in=[1, 2], is_finalizado=True).exists())
+        self.assertIsNone(OrdenUIState.objects.get(doc_id=1).fecha_finalizacion)
+        self.assertEqual(ResumenFinalizacion.objects.aggregate(n=Sum("finalizados"))["n"], 37)
+
+    def test_unchanged_rows_keep_their_version(self):
+        now = timezone.now()
+        same = OrdenUIState.objects.create(doc_id=5, first_seen_at=now, version=3, error_comentarios="nota")
+        OrdenUIState.objects.create(doc_id=6, first_seen_at=now, version=3)
+
+        def change(ui):
+            ui.error_comentarios = "nota"
+
+        states, saved = rollup.update_many([5, 6], change, ["error_comentarios"])
+        self.assertEqual(saved, [6])
+        self.assertEqual(
+            dict(OrdenUIState.objects.filter(doc_id__in=[5, 6]).values_list("doc_id", "version")), {5: 3, 6: 4},
+        )
+        self.assertEqual(OrdenUIState.objects.get(doc_id=5).updated_at, same.updated_at)
+        self.assertEqual(states[5].version, 3)
+
+    def test_rejects_missing_action_or_ids(self):
+        self.assertEqual(self._post("toggle", "1").status_code, 400)
+        self.assertEqual(self._post("finalize", "").status_code, 400)
+        self.assertEqual(self.client.get("/orders/bulk-complete/").status_code, 405)
+
+
+@override_settings(CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}})
+class PastPaginationTests(TestCase):
+    """Historial 'pasados' por keyset: cursor estable y tabla caliente + archivo en un solo orden."""
+
+    def setUp(self):
+        self.addCleanup(board_cache._cache().clear)
+        base = timezone.now() - timezone.timedelta(days=3)
+        # Pares en la tabla caliente, nones en el archivo; 3 y 4 empatan en fecha
+        for doc_id in range(1, 9):
+            model = OrdenUIState if doc_id % 2 == 0 else OrdenUIStateArchivo
+            fecha = base - timezone.timedelta(hours=3 if doc_id == 4 else doc_id)
+            extra = {"updated_at": fecha} if model is OrdenUIStateArchivo else {}
+            model.objects.create(
+                doc_id=doc_id, folio=str(1000 + doc_id), is_finalizado=True,
+                first_seen_at=fecha - timezone.timedelta(hours=1), fecha_finalizacion=fecha, **extra,
+            )
+        patch = mock.patch.object(
+            orders, "cached_fetch_orders",
+            side_effect=lambda doc_ids=None, **kw: [_erp_row(d, cliente="Ana" if d % 3 else "Beto") for d in doc_ids or ()],
+        )
+        patch.start()
+        self.addCleanup(patch.stop)
+
+    def test_cursor_round_trip(self):
+        fecha = timezone.now()
+        self.assertEqual(orders.decode_cursor(orders.encode_cursor(fecha, 42)), (fecha, 42))
+        for bad in ("", "nada", "2025-08-27T10:00:00~x", "~5"):
+            with self.assertRaises(ValueError):
+                orders.decode_cursor(bad)
+
+    def test_pages_interleave_hot_and_archive(self):
+        pages, cursor = [], None
+        while True:
+            cards, cursor = orders.build_past_page(cursor=cursor, page_size=3)
+            pages.append([c["pk"] for c in cards])
+            if cursor is None:
+                break
+        # Empate en fecha (3 y 4): primero el doc_id mayor
+        self.assertEqual(pages, [[1, 2, 4], [3, 5, 6], [7, 8]])
+
+    def _get(self, **params):
+        request = RequestFactory().get("/", {"view": "pasados", **params})
+        with mock.patch.object(views, "prefetch_items"):
+            return views.OrdersCardsPartialView.as_view()(request)
+
+    @override_settings(BOARD_PAST_PAGE_SIZE=2, BOARD_SEARCH_INDEX=False)
+    def test_load_more_sentinel_keeps_the_search(self):
+        html = self._get(q="Ana").content.decode()
+        self.assertIn("&q=Ana", html)
+        cursor = html.split("cursor=", 1)[1].split("&", 1)[0]
+        page = self._get(q="Ana", cursor=unquote(cursor))
+        self.assertEqual(page.status_code, 200)
+        self.assertIn("&q=Ana", page.content.decode())
+
+    def test_invalid_cursor_is_400(self):
+        self.assertEqual(self._get(cursor="nada").status_code, 400)
+
+
+class ArchiveTests(TestCase):
+    """Las finalizadas viejas salen de la tabla caliente sin desaparecer del historial."""
+
+    def setUp(self):
+        self.addCleanup(board_cache._cache().clear)
+        now = timezone.now()
+        self.ana = EmpleadoResponsable.objects.create(nombre="Ana")
+        # 1..6 finalizadas hace 1..6 * 60 días; 7 abierta
+        for doc_id in range(1, 7):
+            OrdenUIState.objects.create(
+                doc_id=doc_id, folio=str(1000 + doc_id), is_finalizado=True, almacen="1", vendedor="V",
+                first_seen_at=now - timezone.timedelta(days=60 * doc_id, hours=1),
+                fecha_finalizacion=now - timezone.timedelta(days=60 * doc_id),
+                has_error=doc_id == 5, error_responsable=self.ana if doc_id == 5 else None,
+            )
+        OrdenUIState.objects.create(doc_id=7, first_seen_at=now)
+        rollup.rebuild()
+        patch = mock.patch.object(
+            orders, "cached_fetch_orders", side_effect=lambda doc_ids=None, **kw: [_erp_row(d) for d in doc_ids or ()],
+        )
+        patch.start()
+        self.addCleanup(patch.stop)
+
+    def _past_doc_ids(self, page_size):
+        return [c["pk"] for c in orders.iter_past_cards(page_size=page_size)]
+
+    def test_archives_old_rows_in_batches(self):
+        self.assertEqual(archive.archive_finalized(days=200, dry_run=True), 3)
+        self.assertEqual(archive.archive_finalized(days=200, batch=2), 3)
+        self.assertEqual(sorted(OrdenUIState.objects.values_list("doc_id", flat=True)), [1, 2, 3, 7])
+        archived = OrdenUIStateArchivo.objects.get(doc_id=5)
+        self.assertEqual((archived.folio, archived.error_responsable), ("1005", self.ana))
+        self.assertEqual(archive.archive_finalized(days=200), 0)
+
+    def test_history_merges_hot_and_archive(self):
+        before = self._past_doc_ids(page_size=100)
+        archive.archive_finalized(days=200)
+        self.assertEqual(self._past_doc_ids(page_size=100), before)
+        self.assertEqual(self._past_doc_ids(page_size=2), [1, 2, 3, 4, 5, 6])
+
+    def test_archived_orders_are_read_not_recreated(self):
+        archive.archive_finalized(days=200)
+        states = orders._load_ui_states([_erp_row(5), _erp_row(8)], [5, 8])
+        self.assertIsInstance(states[5], OrdenUIStateArchivo)
+        self.assertTrue(states[5].is_finalizado)
+        self.assertFalse(OrdenUIState.objects.filter(doc_id=5).exists())
+        self.assertTrue(OrdenUIState.objects.filter(doc_id=8).exists())
+
+    def test_reopen_restores_and_rollups_survive(self):
+        summaries = sorted(ResumenFinalizacion.objects.values_list("fecha", "finalizados"))
+        archive.archive_finalized(days=200)
+        rollup.rebuild()
+        self.assertEqual(sorted(ResumenFinalizacion.objects.values_list("fecha", "finalizados")), summaries)
+
+        def reopen(ui):
+            ui.is_finalizado = False
+            ui.fecha_finalizacion = None
+
+        ui, saved = rollup.update_ui(6, reopen)
+        self.assertTrue(saved)
+        self.assertFalse(OrdenUIStateArchivo.objects.filter(doc_id=6).exists())
+        self.assertEqual(OrdenUIState.objects.get(doc_id=6).folio, "1006")
+        self.assertEqual(ResumenFinalizacion.objects.aggregate(n=Sum("finalizados"))["n"], 5)
+
+
+@override_settings(BOARD_EXPORT_CHUNK=2)
+class ExportTests(TestCase):
+    """El export sale en streaming: encabezado antes de cualquier query y el ERP por bloques."""
+
+    def setUp(self):
+        self.client.force_login(get_user_model().objects.create_user("export"))
+        ana = EmpleadoResponsable.objects.create(nombre="Ana")
+        day = timezone.make_aware(datetime(2025, 9, 10, 12, 0))
+        # 1..5 en la tabla caliente, 6 archivada, 7 fuera de rango, 8 abierta
+        for doc_id in range(1, 8):
+            model = OrdenUIStateArchivo if doc_id == 6 else OrdenUIState
+            extra = {"updated_at": day} if model is OrdenUIStateArchivo else {}
+            model.objects.create(
+                doc_id=doc_id, folio=str(1000 + doc_id), is_finalizado=True, almacen="1",
+                first_seen_at=day - timezone.timedelta(minutes=30),
+                fecha_finalizacion=day + timezone.timedelta(days=30 if doc_id == 7 else 0, hours=doc_id),
+                has_error=doc_id == 2, error_responsable=ana if doc_id == 2 else None, **extra,
+            )
+        OrdenUIState.objects.create(doc_id=8)
+        self.calls = []
+
+        def source(doc_ids=None, fail_silently=True, search=None, **kwargs):
+            self.calls.append(list(doc_ids))
+            return [_erp_row(d) for d in doc_ids if not search or search in str(1000 + d)]
+
+        patch = mock.patch.object(export, "orders_source", return_value=source)
+        patch.start()
+        self.addCleanup(patch.stop)
+
+    def _get(self, **params):
+        return self.client.get("/orders/export/", {"date_from": "2025-09-01", "date_to": "2025-09-30", **params})
+
+    def test_csv_streams_in_chunks(self):
+        response = self._get()
+        self.assertTrue(response.streaming)
+        self.assertIn("pedidos_finalizados_20250901_20250930.csv", response["Content-Disposition"])
+        chunks = iter(response.streaming_content)
+        header = next(chunks).decode("utf-8")
+        self.assertTrue(header.startswith("\ufeffDocumento,Folio"))
+        self.assertEqual(self.calls, [])  # el primer byte no espera a la DB ni al ERP
+
+        lines = b"".join(chunks).decode("utf-8").splitlines()
+        self.assertEqual([line.split(",")[0] for line in lines], ["1", "2", "3", "4", "5", "6"])
+        self.assertEqual(self.calls, [[1, 2], [3, 4], [5, 6]])
+        self.assertEqual(lines[1].split(","), [
+            "2", "1002", "Cliente 2", "Vendedor", "1", "Paquetería", "2025-08-27",
+            "2025-09-10 11:30", "2025-09-10 14:00", "150", "Sí", "Ana", "No", "",
+        ])
+
+    def test_search_and_bad_requests(self):
+        # Sin índice local: el ERP filtra cada bloque
+        lines = b"".join(self._get(q="1003").streaming_content).decode("utf-8").splitlines()
+        self.assertEqual([line.split(",")[0] for line in lines[1:]], ["3"])
+        self.assertEqual(len(self.calls), 3)
+
+        IndiceBusqueda.objects.create(doc_id=5, folio="1005", folio_num=1005, cliente="Cliente 5", texto="cliente 5")
+        self.calls.clear()
+        with override_settings(BOARD_SEARCH_INDEX=True):
+            lines = b"".join(self._get(q="1005").streaming_content).decode("utf-8").splitlines()
+        self.assertEqual([line.split(",")[0] for line in lines[1:]], ["5"])
+        self.assertEqual(self.calls, [[5]])
+        self.assertEqual(self._get(format="pdf").status_code, 400)
+        self.assertEqual(self._get(date_from="2025-10-01").status_code, 400)
+        self.assertEqual(self._get(date_from="2020-01-01").status_code, 400)
+
+    def test_xlsx_needs_openpyxl(self):
+        with mock.patch.object(export, "xlsx_available", return_value=False):
+            self.assertEqual(self._get(format="xlsx").status_code, 501)
+        if not export.xlsx_available():
+            return
+        response = self._get(format="xlsx")
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(b"".join(response.streaming_content).startswith(b"PK"))
+
+
+@override_settings(CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}})
+class SnapshotCacheTests(SimpleTestCase):
+    """Snapshots compartidos: fresco, viejo mientras otro refresca, candado anti-estampida y contadores."""
+
+    def setUp(self):
+        board_cache._cache().clear()
+        self.calls = 0
+        self.rows = [_erp_row(1), _erp_row(2)]
+        self.delay = 0
+
+        def fake(**kw):
+            self.calls += 1
+            time.sleep(self.delay)
+            return [dict(r) for r in self.rows]
+
+        patcher = mock.patch.object(board_cache, "fetch_orders", side_effect=fake)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        publish = mock.patch.object(board_cache.events, "publish")
+        self.publish = publish.start()
+        self.addCleanup(publish.stop)
+        self.key = board_cache._snapshot_key(board_cache.normalize_filters(date_from="2025-08-27"))
+
+    def _expire(self):
+        cache = board_cache._cache()
+        entry = cache.get(self.key)
+        cache.set(self.key, {**entry, "fetched_at": entry["fetched_at"] - 3600}, None)
+
+    def test_fresh_snapshot_is_served_from_cache(self):
+        first = board_cache.cached_fetch_orders(date_from="2025-08-27")
+        second = board_cache.cached_fetch_orders(date_from="2025-08-27")
+        self.assertEqual(list(first), list(second))
+        self.assertEqual(self.calls, 1)
+        stats = board_cache.snapshot_stats()
+        self.assertEqual((stats["hits"], stats["misses"], stats["refreshes"]), (1, 1, 1))
+        self.assertEqual(stats["hit_ratio"], 0.5)
+
+    def test_expired_snapshot_is_served_while_another_worker_refreshes(self):
+        board_cache.cached_fetch_orders(date_from="2025-08-27")
+        self._expire()
+        self.rows = [_erp_row(1), _erp_row(2), _erp_row(3)]
+
+        board_cache._cache().add(f"{self.key}:lock", 1, 30)
+        stale = board_cache.cached_fetch_orders(date_from="2025-08-27")
+        self.assertEqual([r["doc_id"] for r in stale], [1, 2])
+        self.assertFalse(stale.stale)
+        self.assertEqual(self.calls, 1)
+        self.assertEqual(board_cache.snapshot_stats()["stale_hits"], 1)
+
+        board_cache._cache().delete(f"{self.key}:lock")
+        fresh = board_cache.cached_fetch_orders(date_from="2025-08-27")
+        self.assertEqual([r["doc_id"] for r in fresh], [1, 2, 3])
+        self.assertEqual(self.calls, 2)
+        self.publish.assert_called_once()
+
+    def test_unchanged_refresh_does_not_publish(self):
+        board_cache.cached_fetch_orders(date_from="2025-08-27")
+        self._expire()
+        board_cache.cached_fetch_orders(date_from="2025-08-27")
+        self.assertEqual(self.calls, 2)
+        self.publish.assert_not_called()
+
+    def test_cold_workers_share_one_erp_query(self):
+        self.delay = 0.2
+        results = []
+
+        def worker():
+            results.append(board_cache.cached_fetch_orders(date_from="2025-08-27"))
+
+        threads = [threading.Thread(target=worker) for _ in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(self.calls, 1)
+        self.assertEqual([[r["doc_id"] for r in rows] for rows in results], [[1, 2]] * 4)
+        self.assertIsNone(board_cache._cache().get(f"{self.key}:lock"))
+
+    def test_index_evicts_oldest_entries(self):
+        cache = board_cache._cache()
+        keys = [f"{board_cache.KEY_PREFIX}:snap:test{i}" for i in range(5)]
+        for key in keys:
+            cache.set(key, {"rows": []}, None)
+            board_cache._remember([key], max_entries=3)
+        self.assertEqual(sorted(cache.get(board_cache.INDEX_KEY)), keys[2:])
+        self.assertIsNone(cache.get(keys[0]))
+        self.assertIsNotNone(cache.get(keys[4]))
+        self.assertEqual(board_cache.snapshot_stats()["evictions"], 2)
+
+    def test_concurrent_index_updates_are_not_lost(self):
+        def worker(n):
+            for i in range(20):
+                board_cache._remember([f"k{n}:{i}"], max_entries=1000)
+
+        threads = [threading.Thread(target=worker, args=(n,)) for n in range(6)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(len(board_cache._cache().get(board_cache.INDEX_KEY)), 120)
+
+    def test_busy_index_lock_leaves_entries_to_their_ttl(self):
+        cache = board_cache._cache()
+        cache.add(f"{board_cache.INDEX_KEY}:lock", 1, 30)
+        with mock.patch.object(board_cache, "INDEX_LOCK_WAIT_SECONDS", 0):
+            board_cache._remember(["k"])
+        self.assertIsNone(cache.get(board_cache.INDEX_KEY))
+        self.assertIsNotNone(cache.get(f"{board_cache.INDEX_KEY}:lock"))
+
+
+@override_settings(CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}})
+class ItemsCacheTests(SimpleTestCase):
+    """Partidas por doc_id: solo las que faltan van al ERP, en un query; pend_u distinto las invalida."""
+
+    def setUp(self):
+        board_cache._cache().clear()
+        self.calls = []
+
+        def fake(doc_ids, fail_silently=True):
+            self.calls.append(list(doc_ids))
+            return {d: [{"codigo": f"P{d}", "descripcion": "Producto", "almacen": "1", "unidades": 1.0}] for d in doc_ids}
+
+        patcher = mock.patch.object(board_cache, "fetch_items_many", side_effect=fake)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_only_missing_docs_are_fetched(self):
+        first = board_cache.cached_fetch_items([1, 2], {1: 2.0, 2: 1.0})
+        self.assertEqual(first[2][0]["codigo"], "P2")
+        board_cache.cached_fetch_items([1, 2, 3], {1: 2.0, 2: 1.0, 3: 4.0})
+        self.assertEqual(self.calls, [[1, 2], [3]])
+        stats = board_cache.snapshot_stats()
+        self.assertEqual((stats["items_hits"], stats["items_misses"]), (2, 3))
+
+    def test_changed_pend_u_and_invalidation_refetch(self):
+        board_cache.cached_fetch_items([1, 2], {1: 2.0, 2: 1.0})
+        board_cache.cached_fetch_items([1, 2], {1: 0.0, 2: 1.0})
+        self.assertEqual(self.calls[-1], [1])
+        board_cache.invalidate_items([2])
+        board_cache.cached_fetch_items([1, 2], {1: 0.0, 2: 1.0})
+        self.assertEqual(self.calls, [[1, 2], [1], [2]])
+
+    def test_erp_failure_is_not_cached(self):
+        board_cache.fetch_items_many.side_effect = OperationalError("caído")
+        self.assertEqual(board_cache.cached_fetch_items([1], {1: 2.0}), {1: []})
+        self.assertIsNone(board_cache._cache().get(board_cache._items_key(1)))
+
+
+@override_settings(CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}})
+class CardFragmentCacheTests(TestCase):
+    """Cada tarjeta se renderiza una vez por versión; el resto de los polls sale del cache."""
+
+    def setUp(self):
+        board_cache._cache().clear()
+        with mock.patch.object(orders, "cached_fetch_orders", return_value=[_erp_row(i) for i in range(1, 11)]):
+            self.cards = orders.build_cards(date_from="2025-08-27")
+
+    def test_only_changed_cards_are_rendered(self):
+        with mock.patch.object(board_cache, "render_to_string", wraps=board_cache.render_to_string) as render:
+            first = board_cache.render_cards(self.cards)
+            self.assertEqual(render.call_count, 10)
+            self.assertEqual(board_cache.render_cards(self.cards), first)
+            self.assertEqual(render.call_count, 10)
+
+            self.cards[4] = {**self.cards[4], "status": "FINALIZADO", "has_error": True}
+            html = board_cache.render_cards(self.cards)
+            self.assertEqual(render.call_count, 11)
+        self.assertIn("card-fin", html[4])
+        self.assertEqual(html[:4], first[:4])
+
+        stats = board_cache.snapshot_stats()
+        self.assertEqual((stats["cards_hits"], stats["cards_misses"]), (19, 11))
+
+    def test_oob_fragments_are_cached_separately(self):
+        plain = board_cache.render_cards(self.cards[:1])[0]
+        oob = board_cache.render_cards(self.cards[:1], oob=True)[0]
+        self.assertNotIn("hx-swap-oob", plain)
+        self.assertIn('hx-swap-oob="true"', oob)
+
+
+@override_settings(
+    CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}},
+    BOARD_METRICS_SERVER_TIMING=True, BOARD_METRICS_TOKEN="s3cr3t",
+)
+class MetricsTests(TestCase):
+    """Desglose por fase en Server-Timing y los mismos tiempos como histogramas en /metrics."""
+
+    def setUp(self):
+        board_cache._cache().clear()
+        self.addCleanup(board_cache._cache().clear)
+        metrics._known["series"].clear()
+        patches = [
+            mock.patch.object(orders, "cached_fetch_orders", return_value=[_erp_row(i) for i in range(1, 4)]),
+            mock.patch.object(views, "prefetch_items"),
+        ]
+        for p in patches:
+            p.start()
+            self.addCleanup(p.stop)
+
+    def test_server_timing_and_prometheus_histograms(self):
+        request = RequestFactory().get("/", {"date_from": "2025-08-27"})
+        response = views.BoardPartialView.as_view()(request)
+        entries = [e.split(";")[0] for e in response["Server-Timing"].split(", ")]
+        for phase in ("fetch", "ui_load", "ui_save", "assemble", "render", "total"):
+            self.assertIn(phase, entries)
+
+        request = RequestFactory().get("/metrics", headers={"Authorization": "Bearer s3cr3t"})
+        request.user = mock.Mock(is_authenticated=False)
+        body = views.MetricsView.as_view()(request).content.decode()
+        self.assertIn("# TYPE board_build_seconds histogram", body)
+        self.assertIn('board_build_seconds_bucket{phase="ui_load",le="+Inf"} 1', body)
+        self.assertIn('board_build_seconds_count{phase="assemble"} 1', body)
+        self.assertIn('phase="render"', body)
+        self.assertIn("board_erp_breaker_open 0", body)
+
+    def test_metrics_requires_session_or_token(self):
+        request = RequestFactory().get("/metrics", headers={"Authorization": "Bearer otro"})
+        request.user = mock.Mock(is_authenticated=False)
+        self.assertEqual(views.MetricsView.as_view()(request).status_code, 401)
+
+
+class _FakeErpConnection:
+    """Conexión mínima: responde filas fijas o, con down=True, OperationalError."""
+
+    vendor = "microsoft"
+    connection = None
+
+    def __init__(self, rows=()):
+        self.rows = list(rows)
+        self.down = False
+        self.calls = 0
+
+    @contextlib.contextmanager
+    def cursor(self):
+        self.calls += 1
+        if self.down:
+            raise OperationalError("Query timeout expired")
+        cur = mock.Mock()
+        cols = list(self.rows[0]) if self.rows else ["doc_id"]
+        cur.description = [(c,) for c in cols]
+        data = [tuple(r[c] for c in cols) for r in self.rows]
+        cur.fetchmany.side_effect = ([data] if data else []) + [[]]
+        yield cur
+
+
+@override_settings(
+    CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}},
+    BOARD_ERP_BREAKER_THRESHOLD=3, BOARD_ERP_BREAKER_OPEN=30, BOARD_ORDERS_CACHE_TTL=0,
+)
+class ErpCircuitBreakerTests(SimpleTestCase):
+    """Con el ERP caído: fallar rápido, probar de a uno y seguir mostrando el último snapshot."""
+
+    def setUp(self):
+        board_cache._cache().clear()
+        self.addCleanup(board_cache._cache().clear)  # que el circuito abierto no se herede
+        rows = [_erp_row(i) for i in (1, 2)]
+        for r in rows:
+            del r["metodo_entrega"], r["status_erp"]
+        self.erp = _FakeErpConnection(rows)
+        patcher = mock.patch.object(erp, "connections", {erp.ERP_ALIAS: self.erp})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_opens_after_threshold_and_probes_once(self):
+        self.erp.down = True
+        for _ in range(3):
+            self.assertEqual(erp.fetch_orders(date_from="2025-08-27"), [])
+        self.assertEqual(self.erp.calls, 3)
+        with self.assertRaises(breaker.ErpUnavailable):
+            erp.fetch_orders(date_from="2025-08-27", fail_silently=False)
+        self.assertEqual(self.erp.calls, 3)  # circuito abierto: ni se intenta
+        self.assertEqual(breaker.erp_breaker.status()["state"], "open")
+
+        self.erp.down = False
+        later = breaker.time.time() + 31
+        with mock.patch.object(breaker.time, "time", return_value=later):
+            self.assertEqual(len(erp.fetch_orders(date_from="2025-08-27")), 2)
+        self.assertEqual(breaker.erp_breaker.status()["state"], "closed")
+
+    def test_failed_half_open_probe_reopens(self):
+        self.erp.down = True
+        for _ in range(3):
+            erp.fetch_orders()
+        later = breaker.time.time() + 31
+        with mock.patch.object(breaker.time, "time", return_value=later):
+            erp.fetch_orders()
+            self.assertEqual(self.erp.calls, 4)
+            self.assertEqual(breaker.erp_breaker.status()["state"], "open")
+
+    def test_snapshot_survives_erp_outage_marked_stale(self):
+        fresh = board_cache.cached_fetch_orders(date_from="2025-08-27")
+        self.assertFalse(fresh.stale)
+        self.erp.down = True
+        for _ in range(5):
+            rows = board_cache.cached_fetch_orders(date_from="2025-08-27")
+            self.assertEqual([r["doc_id"] for r in rows], [1, 2])
+            self.assertTrue(rows.stale)
+        self.assertEqual(self.erp.calls, 4)  # 1 bueno + 3 fallas; luego el circuito corta
+        self.assertIsNotNone(rows.age)
+
+        cold = board_cache.cached_fetch_orders(date_from="2025-09-01")
+        self.assertEqual((list(cold), cold.stale), ([], True))
+
+
+@override_settings(CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}})
+class ErpGatewayTests(SimpleTestCase):
+    """Queries iguales en vuelo se comparten y el total simultáneo contra el ERP está acotado."""
+
+    def setUp(self):
+        board_cache._cache().clear()
+        self.addCleanup(board_cache._cache().clear)
+        self.erp = _FakeErpConnection([{"doc_id": 1}])
+        patcher = mock.patch.object(erp, "connections", {erp.ERP_ALIAS: self.erp})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_identical_in_flight_queries_share_one_execution(self):
+        release = threading.Event()
+        real_cursor = self.erp.cursor
+
+        @contextlib.contextmanager
+        def slow_cursor():
+            release.wait(2)
+            with real_cursor() as cur:
+                yield cur
+
+        self.erp.cursor = slow_cursor
+        results = []
+        threads = [
+            threading.Thread(target=lambda: results.append(erp._execute("SELECT 1", [7])))
+            for _ in range(5)
+        ]
+        for t in threads:
+            t.start()
+        time.sleep(0.1)
+        release.set()
+        for t in threads:
+            t.join(2)
+        self.assertEqual(self.erp.calls, 1)
+        self.assertEqual(len(results), 5)
+        self.assertTrue(all(r[1] == [(1,)] for r in results))
+
+    @override_settings(BOARD_ERP_MAX_CONCURRENT=1, BOARD_ERP_QUEUE_TIMEOUT=0.2)
+    def test_waits_for_a_slot_then_gives_up(self):
+        slot = erp.gateway._acquire_slot()
+        with self.assertRaises(erp.ErpBusy):
+            erp._execute("SELECT 1", [1])
+        self.assertEqual(self.erp.calls, 0)
+        self.assertEqual(breaker.erp_breaker.status()["state"], "closed")  # saturado no es caído
+
+        threading.Timer(0.05, erp.gateway._release_slot, [slot]).start()
+        erp._execute("SELECT 1", [1])
+        self.assertEqual(self.erp.calls, 1)
+
+    @override_settings(BOARD_ERP_MAX_CONCURRENT=2)
+    def test_local_cache_limit_is_reported_once_and_settings_untouched(self):
+        self.erp.settings_dict = {"CONN_MAX_AGE": 0}
+        with mock.patch.object(erp.gateway, "_warned_local", False):
+            with self.assertLogs(erp.logger, "WARNING") as logs:
+                erp._execute("SELECT 1", [1])
+            self.assertIn("por proceso", logs.output[0])
+            with self.assertNoLogs(erp.logger, "WARNING"):
+                erp._execute("SELECT 1", [2])
+        self.assertEqual(self.erp.settings_dict, {"CONN_MAX_AGE": 0})
+
+
+@override_settings(BOARD_SEARCH_INDEX=True)
+class SearchIndexTests(TestCase):
+    """La búsqueda se resuelve contra el índice local y al ERP solo van doc_ids."""
+
+    def setUp(self):
+        rows = [
+            _erp_row(1, cliente="José Pérez", folio=1234.0),
+            _erp_row(2, cliente="Ferretería del Norte", folio=5123.0),
+            _erp_row(3, cliente="Pereza SA", folio=77.0, fecha_creacion=datetime(2025, 8, 20)),
+            _erp_row(4, cliente="Otro", folio=None),
+        ]
+        search_index.index_orders(rows)
+        self.rows = {r["doc_id"]: r for r in rows}
+
+    def test_resolve_by_cliente_and_folio(self):
+        self.assertEqual(search_index.resolve("jose perez"), [1])
+        self.assertEqual(search_index.resolve("Pereza"), [3])
+        self.assertEqual(sorted(search_index.resolve("PERE")), [1, 3])
+        self.assertEqual(sorted(search_index.resolve("123")), [1, 2])
+        self.assertEqual(search_index.resolve("77"), [3])
+        self.assertEqual(search_index.resolve("pe", date_from="2025-08-27"), [1])
+        self.assertEqual(search_index.resolve("zzz"), [])
+
+    def test_short_terms_match_substrings_like_the_erp(self):
+        self.assertEqual(sorted(search_index.resolve("23")), [1, 2])
+        self.assertEqual(sorted(search_index.resolve("7")), [3])
+        self.assertEqual(sorted(search_index.resolve("ez")), [1, 3])
+        self.assertEqual(sorted(search_index.resolve("o")), [1, 2, 4])
+
+    def test_renamed_cliente_is_reindexed(self):
+        renamed = [dict(self.rows[1], cliente="JOSÉ PÉREZ"), dict(self.rows[2], cliente="Tlapalería Sur")]
+        self.assertEqual(search_index.reindex_changed(self.rows.values(), [*renamed, _erp_row(9)]), 2)
+        self.assertEqual(IndiceBusqueda.objects.get(doc_id=1).cliente, "JOSÉ PÉREZ")
+        self.assertEqual(search_index.resolve("tlapaleria"), [2])
+        self.assertEqual(search_index.resolve("norte"), [])
+        self.assertFalse(IndiceBusqueda.objects.filter(doc_id=9).exists())
+
+    @override_settings(CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}})
+    def test_snapshot_refresh_reindexes_renamed_rows(self):
+        board_cache._cache().clear()
+        rows = [dict(r) for r in self.rows.values()]
+        with mock.patch.object(board_cache, "fetch_orders", side_effect=lambda **kw: rows), \
+                mock.patch.object(board_cache.events, "publish"):
+            board_cache.cached_fetch_orders(date_from="2025-08-01")
+            rows[3] = dict(rows[3], cliente="Abarrotes Lupita")
+            key = board_cache._snapshot_key(board_cache.normalize_filters(date_from="2025-08-01"))
+            entry = board_cache._cache().get(key)
+            board_cache._cache().set(key, {**entry, "fetched_at": 0}, None)
+            board_cache.cached_fetch_orders(date_from="2025-08-01")
+        self.assertEqual(search_index.resolve("lupita"), [4])
+
+    def test_reindex_updates_changed_rows(self):
+        search_index.index_orders([_erp_row(4, cliente="Abarrotes Lupita", folio=9001.0)])
+        self.assertEqual(search_index.resolve("lupita"), [4])
+        self.assertEqual(search_index.resolve("otro"), [])
+        self.assertEqual(IndiceBusqueda.objects.get(doc_id=4).folio, "9001")
+
+    def test_build_cards_sends_only_doc_ids_to_erp(self):
+        def fake(**kwargs):
+            return [self.rows[d] for d in kwargs["doc_ids"] if d in self.rows]
+
+        with mock.patch.object(orders, "cached_fetch_orders", side_effect=fake) as fetch:
+            cards = orders.build_cards(date_from="2025-08-01", search="pérez")
+        self.assertEqual(sorted(c["pk"] for c in cards), [1, 3])
+        self.assertIsNone(fetch.call_args.kwargs.get("search"))
+
+    def test_first_seen_orders_are_indexed(self):
+        with mock.patch.object(orders, "cached_fetch_orders", return_value=[_erp_row(50, cliente="Nuevo")]):
+            orders.build_cards(date_from="2025-08-27")
+        self.assertEqual(search_index.resolve("nuevo"), [50])
+
+
+@override_settings(BOARD_ERP_DOC_ID_BUCKETS=(4, 16, 64))
+class FetchOrdersChunkedTests(SimpleTestCase):
+    """El filtro por doc_ids en bloques debe dar lo mismo que el query único de siempre."""
+
+    @classmethod
+    def setUpClass(cls):
+        # El alias no existe en settings.DATABASES: se registra y se declara aquí
+        # (no como atributo de clase, que el runner valida antes de correr nada)
+        erp_standin.install()
+        cls.databases = {erp_standin.ALIAS}
+        super().setUpClass()
+        erp_standin.create_schema()
+        cls.doc_ids = erp_standin.seed(400)
+        cls.alias = mock.patch.object(erp, "ERP_ALIAS", erp_standin.ALIAS)
+        cls.alias.start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.alias.stop()
+        erp_standin.uninstall()
+        super().tearDownClass()
+
+    def _single(self, doc_ids, **kwargs):
+        args = [kwargs.get(k) for k in ("date_from", "date_to", "search", "limit")]
+        return erp._fetch_orders_query(*args, doc_ids=list(doc_ids), fail_silently=False)
+
+    def _assert_same(self, doc_ids, **kwargs):
+        chunked = erp.fetch_orders(doc_ids=doc_ids, fail_silently=False, **kwargs)
+        self.assertEqual(chunked, self._single(doc_ids, **kwargs))
+        return chunked
+
+    def test_all_chunks_match_single_query(self):
+        rows = self._assert_same(self.doc_ids[::-1])
+        self.assertGreater(len(rows), 300)
+        self.assertIsNone(rows[-1]["folio"])  # folio NULL al final, como el tablero
+
+    def test_items_are_grouped_per_doc_in_one_query(self):
+        ids = list(self.doc_ids[:20]) + [999999]
+        with mock.patch.object(erp, "_timed_execute", wraps=erp._timed_execute) as execute:
+            many = erp.fetch_items_many(ids, fail_silently=False)
+        self.assertEqual(execute.call_count, 1)
+        self.assertEqual(list(many), ids)
+        self.assertEqual(many[999999], [])
+        for doc_id in ids[:20]:
+            self.assertTrue(many[doc_id])
+            self.assertEqual(many[doc_id], erp.fetch_items_many([doc_id], fail_silently=False)[doc_id])
+            self.assertNotIn("doc_id", many[doc_id][0])
+
+    def test_limit_search_and_dates_match_single_query(self):
+        self._assert_same(self.doc_ids, limit=25)
+        self._assert_same(self.doc_ids, date_from="2025-08-02", date_to="2025-08-04")
+        self._assert_same(self.doc_ids, search="Cliente 1")
+        self._assert_same(self.doc_ids, search="13")
+
+    def test_in_list_lengths_are_bucketed(self):
+        seen = []
+        real = erp._fetch_orders_query
+
+        def spy(*args):
+            seen.append(len(args[4]))
+            return real(*args)
+
+        with mock.patch.object(erp, "_fetch_orders_query", side_effect=spy):
+            self.assertEqual(len(erp.fetch_orders(doc_ids=[1, 2, 3, 3, 5])), 4)
+            erp.fetch_orders(doc_ids=self.doc_ids[:150])
+        self.assertEqual(sorted(seen), [4, 64, 64, 64])
+
+    def test_small_fetch_batches_give_the_same_rows(self):
+        with override_settings(BOARD_ERP_FETCH_SIZE=7):
+            small = erp.fetch_orders(date_from="2025-08-02", fail_silently=False)
+        self.assertEqual(small, erp.fetch_orders(date_from="2025-08-02", fail_silently=False))
+        self.assertGreater(len(small), 7)
+
+    def test_dates_come_back_as_datetimes(self):
+        # Como el ERP real: build_cards combina la fecha con first_seen_at
+        rows = erp.fetch_orders(doc_ids=self.doc_ids[:3], fail_silently=False)
+        self.assertTrue(all(isinstance(r["fecha_creacion"], datetime) for r in rows))
+
+
+class BenchBaselineTests(SimpleTestCase):
+    def test_committed_baseline_covers_every_benchmark(self):
+        path = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), conf.get("BENCH_BASELINE"))
+        baseline = bench.load_baseline(path)
+        self.assertEqual(sorted(baseline["1000"]), sorted(b.name for b in bench.BENCHMARKS))
+
+    def test_regression_needs_ratio_and_absolute_delta(self):
+        baseline = {"1000": {
+            "erp.fetch_items": {"median_ms": 0.5},
+            "view.kpis": {"median_ms": 20.0},
+            "view.dashboard": {"median_ms": 80.0},
+        }}
+        results = {1000: {
+            "erp.fetch_items": {"median_ms": 1.5},    # +200 % pero solo 1 ms: ruido
+            "view.kpis": {"median_ms": 30.0},         # +50 %: regresión
+            "view.dashboard": {"median_ms": 90.0},    # +12 %: dentro del umbral
+            "view.metrics": {"median_ms": 5.0},       # sin base: no se compara
+        }}
+        regressions = bench.compare(results, baseline, threshold=0.25, min_delta_ms=2.0)
+        self.assertEqual([(n, name) for n, name, *_ in regressions], [(1000, "view.kpis")])
+
+    def test_save_merges_sizes(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "base.json")
+            bench.save_baseline(path, {1000: {"view.kpis": {"median_ms": 1.0}}})
+            bench.save_baseline(path, {10000: {"view.kpis": {"median_ms": 2.0}}}, bench.load_baseline(path))
+            self.assertEqual(set(bench.load_baseline(path)), {"1000", "10000"})
+
+    def test_select_by_prefix(self):
+        names = [b.name for b in bench.select(["build_cards.", "view.kpis"])]
+        self.assertIn("build_cards.pasados", names)
+        self.assertIn("view.kpis", names)
+        self.assertNotIn("erp.fetch_items", names)
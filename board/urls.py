@@ -5,23 +5,45 @@ from .views import (
     DashboardView,
     OrderDetailPartialView,
     OrdersCardsPartialView,
+    BoardPartialView,
     OrderCompleteView,
+    OrdersBulkCompleteView,
     KpisPartialView,
+    CacheStatsView,
+    MirrorStatusView,
+    SearchSuggestView,
+    MetricsView,
+    ReportsView,
 )
 # NUEVO: vistas de error en un módulo separado para no tocar tu views.py
 from .views_error import OrderErrorToggleView, OrderErrorSaveView
+from .views_sse import BoardEventsView
 
 urlpatterns = [
     path('', login_required(DashboardView.as_view()), name='dashboard'),
     path('orders/cards/', login_required(OrdersCardsPartialView.as_view()), name='orders-cards'),
+    path('orders/board/', login_required(BoardPartialView.as_view()), name='orders-board'),
     path('orders/<int:pk>/detail/', login_required(OrderDetailPartialView.as_view()), name='order-detail'),
     path('orders/<int:pk>/complete/', login_required(OrderCompleteView.as_view()), name='order-complete'),
+    path('orders/bulk-complete/', login_required(OrdersBulkCompleteView.as_view()), name='orders-bulk-complete'),
+    path('orders/search/suggest/', login_required(SearchSuggestView.as_view()), name='search-suggest'),
     path('kpis/', login_required(KpisPartialView.as_view()), name='kpis'),
+    path('cache/stats/', login_required(CacheStatsView.as_view()), name='cache-stats'),
+    path('metrics', MetricsView.as_view(), name='metrics'),
+    path('mirror/status/', login_required(MirrorStatusView.as_view()), name='mirror-status'),
+    path('reports/', login_required(ReportsView.as_view()), name='reports'),
 
     # === ERRORES ===
     path('orders/<int:pk>/error/toggle/', login_required(OrderErrorToggleView.as_view()), name='order-error-toggle'),
     path('orders/<int:pk>/error/save/',   login_required(OrderErrorSaveView.as_view()),   name='order-error-save'),
 
+    # === PUSH (SSE, servir vía ASGI) ===
+    path('events/', login_required(BoardEventsView.as_view()), name='board-events'),
+
     # === IMPRESION ===
-    path("orders/<pk>/print/", views.OrderPrintView.as_view(), name="order-print"),
+    path("orders/<int:pk>/print/", login_required(views.OrderPrintView.as_view()), name="order-print"),
+    path("orders/print/", views.OrderBulkPrintView.as_view(), name="orders-print-bulk"),
+
+    # === EXPORTACIÓN ===
+    path("orders/export/", login_required(views.OrdersExportView.as_view()), name="orders-export"),
 ]
@@ -1,17 +1,30 @@
+import tempfile
+from itertools import chain, islice
+
+from asgiref.sync import sync_to_async
 from django.utils import timezone
-from django.utils.dateparse import parse_datetime
+from django.utils.dateparse import parse_date, parse_datetime
 from django.views.generic import TemplateView, View
-from django.shortcuts import render
-from django.http import HttpResponseBadRequest, HttpResponseNotFound
+from django.http import FileResponse, HttpResponse, HttpResponseBadRequest, HttpResponseNotFound, JsonResponse
+from django.utils.cache import get_conditional_response, quote_etag
 from django.views.decorators.csrf import ensure_csrf_cookie
-from django.views.decorators.http import require_POST
 from django.contrib.auth.decorators import login_required
 from django.utils.decorators import method_decorator
 
-from .models import OrdenUIState, EmpleadoResponsable
-from .services.orders import build_cards, get_order_items
+from . import conf
+from .models import EmpleadoResponsable
+from .services.orders import (
+    abuild_card, afetch_row, awith_items, build_cards, build_kpis, build_past_page, iter_past_cards, make_cards,
+)
 
 from .services import erp as erp_service
+from .services.breaker import erp_breaker
+from .services.cache import cached_fetch_items, orders_source, prefetch_items, snapshot_stats
+from .services.mirror import mirror_status
+from .services import archive, delta, events, export, metrics, rollup
+# django.shortcuts.render + tiempo de render (métricas / Server-Timing)
+from .services.metrics import arender, render, stream_render
+from .services import search as search_index
 
 
 def _default_date_from():
@@ -20,15 +33,69 @@ def _default_date_from():
     return "2025-08-27"
 
 
-def _extract_filters(request):
-    q = request.GET.get("q", "").strip() or None
-    view_mode = request.GET.get("view", "relevantes")
-    date_from = request.GET.get("date_from") or _default_date_from()
+def _extract_filters(request, data=None):
+    data = request.GET if data is None else data
+    q = data.get("q", "").strip() or None
+    view_mode = data.get("view", "relevantes")
+    date_from = data.get("date_from") or _default_date_from()
     return q, view_mode, date_from
 
 
+def _parse_ids(values):
+    """ids=1,2,3 o ids repetido -> [1, 2, 3] (sin duplicados, en orden)."""
+    raw = ",".join(values)
+    return list(dict.fromkeys(int(x) for x in raw.replace(" ", "").split(",") if x.isdigit()))
+
+
+def _board_cards(q, view_mode, date_from):
+    """(cards, next_cursor): en 'pasados' solo la primera página del historial."""
+    if view_mode == "pasados":
+        return build_past_page(search=q)
+    return build_cards(date_from=date_from, search=q, view_mode=view_mode, limit=None), None
+
+
+def _not_modified(request, etag):
+    """304 (sin cuerpo) si el cliente ya tiene este estado según If-None-Match; si no, None."""
+    response = get_conditional_response(request, etag=etag)
+    if response is not None:
+        response["ETag"] = etag
+    return response
+
+
+def _with_etag(response, etag):
+    response["ETag"] = etag
+    # El JS manda If-None-Match por su cuenta; que el navegador no cachee ni revalide solo
+    response["Cache-Control"] = "no-store"
+    return response
+
+
+def _stale_minutes(cards):
+    """Minutos de antigüedad si las tarjetas vienen de un snapshot viejo (ERP sin respuesta); si no, None."""
+    if not getattr(cards, "stale", False):
+        return None
+    age = cards.age
+    return int(age // 60) if age is not None else -1
+
+
+def _etag_variant(name, cards):
+    # Cambiar de fresco a viejo (y cada minuto de antigüedad) debe repintar el encabezado
+    stale = _stale_minutes(cards)
+    return name if stale is None else f"{name}:stale{stale}"
+
+
+def _kpis_context(cards):
+    k = build_kpis(cards)
+    return {
+        "kpis": k["kpis"],
+        "por_almacen": k["por_almacen"],
+        "por_metodo": k["por_metodo"],
+        "last_update": timezone.localtime().strftime("%d/%m/%Y %H:%M"),
+        "stale_minutes": _stale_minutes(cards),
+    }
+
+
 # --- Dashboard (página principal) ---
-@method_decorator([login_required, ensure_csrf_cookie], name='dispatch')
+@method_decorator([metrics.track_view, login_required, ensure_csrf_cookie], name='dispatch')
 class DashboardView(TemplateView):
     template_name = "board/dashboard.html"
 
@@ -36,17 +103,12 @@ class DashboardView(TemplateView):
         ctx = super().get_context_data(**kwargs)
         q, view_mode, date_from = _extract_filters(self.request)
 
-        cards = build_cards(date_from=date_from, search=q, view_mode=view_mode, limit=None)
-        kpis = [
-            {"label": "Pendientes",  "value": sum(1 for c in cards if c["status"] == "PENDIENTE")},
-            {"label": "Surtidos",    "value": sum(1 for c in cards if c["status"] == "SURTIDO")},
-            {"label": "Finalizados", "value": sum(1 for c in cards if c["status"] == "FINALIZADO")},
-        ]
+        cards, next_cursor = _board_cards(q, view_mode, date_from)
+        ctx.update(_kpis_context(cards))
         ctx.update({
             "sucursal": "TABLERO DE ÓRDENES",
-            "kpis": kpis,
             "orders": cards,
-            "last_update": timezone.localtime().strftime("%d/%m/%Y %H:%M"),
+            "next_cursor": next_cursor,
             "q": q or "",
             "view_mode": view_mode,
             "date_from": date_from,
@@ -55,22 +117,21 @@ class DashboardView(TemplateView):
 
 
 # --- Detalle (modal) ---
+@method_decorator(metrics.track_view, name='dispatch')
 class OrderDetailPartialView(View):
+    """
+    Async (servir por planner/asgi.py): la orden (ERP + OrdenUIState), sus
+    partidas y los responsables se piden a la vez; el modal tarda lo que el
+    query más lento, no la suma.
+    """
     template_name = "board/_order_detail.html"
 
-    def get(self, request, pk):
-        # Mantengo tu mismo flujo/filters para construir 'orden'
-        q, view_mode, date_from = _extract_filters(request)
-        cards = build_cards(date_from=date_from, search=q, view_mode=view_mode, limit=None)
-        orden = next((c for c in cards if c["pk"] == pk), None)
-
-        # Items (como ya lo haces)
-        items = get_order_items(pk)
+    async def get(self, request, pk):
+        # Solo esta orden: un query al ERP por doc_id, no el tablero completo.
+        # Items (cache por doc_id; normalmente ya precargados con el tablero)
+        orden, items, responsables = await awith_items(pk, abuild_card(pk), _aresponsables())
 
-        # ✅ CLAVE: pasar responsables también en este render inicial
-        responsables = EmpleadoResponsable.objects.filter(activo=True).order_by("nombre")
-
-        return render(
+        return await arender(
             request,
             self.template_name,
             {
@@ -81,47 +142,181 @@ class OrderDetailPartialView(View):
         )
 
 
+async def _aresponsables():
+    return [r async for r in EmpleadoResponsable.objects.filter(activo=True).order_by("nombre")]
+
+
 # --- Tarjetas (parcial con polling) ---
-@method_decorator(ensure_csrf_cookie, name='dispatch')
+@method_decorator([metrics.track_view, ensure_csrf_cookie], name='dispatch')
 class OrdersCardsPartialView(View):
     template_name = "board/_cards.html"
+    delta_template_name = "board/_cards_delta.html"
+    page_template_name = "board/_cards_page.html"
+
+    etag_variant = "cards"
+
+    def get_extra_context(self, cards):
+        return {}
 
     def get(self, request):
         q, view_mode, date_from = _extract_filters(request)
-        cards = build_cards(date_from=date_from, search=q, view_mode=view_mode, limit=None)
 
+        # Scroll infinito de 'pasados': solo la página pedida, se anexa al final
+        cursor = request.GET.get("cursor")
+        if cursor and view_mode == "pasados":
+            try:
+                cards, next_cursor = build_past_page(search=q, cursor=cursor)
+            except ValueError:
+                return HttpResponseBadRequest("Cursor inválido")
+            return render(request, self.page_template_name, {"orders": cards, "next_cursor": next_cursor, "q": q})
+
+        cards, next_cursor = _board_cards(q, view_mode, date_from)
+
+        now = timezone.now()
+        board_key = delta.board_key(view_mode, q, date_from)
+        state = delta.track(board_key, cards, now.timestamp())
+
+        # Sin cambios desde el último poll de esta pantalla: 304 y el JS no hace swap
+        etag = quote_etag(delta.board_etag(board_key, cards, _etag_variant(self.etag_variant, cards)))
+        not_modified = _not_modified(request, etag)
+        if not_modified is not None:
+            return not_modified
+
+        extra = self.get_extra_context(cards)
+        prefetch_items(cards)
+
+        # Modo delta: solo si el cliente trae 'since' de ESTE mismo tablero
         since = request.GET.get("since")
-        if since:
+        if since and request.GET.get("key") == board_key:
             dt = parse_datetime(since)
-            if dt:
-                pass
-        return render(request, self.template_name, {
+            changes = delta.changes_since(state, cards, dt.timestamp(), now.timestamp()) if dt else None
+            # Con más páginas detrás, el final de #cards es el centinela, no la última tarjeta
+            if changes is not None and changes[0] and next_cursor:
+                changes = None
+            if changes is not None:
+                added, changed, removed = changes
+                response = render(request, self.delta_template_name, {
+                    "added": added,
+                    "changed": changed,
+                    "removed": removed,
+                    "now_iso": now.isoformat(),
+                    "board_key": board_key,
+                    **extra,
+                })
+                # Todo viaja como out-of-band; el contenido de #cards no se toca
+                response["HX-Reswap"] = "none"
+                return _with_etag(response, etag)
+
+        return _with_etag(render(request, self.template_name, {
             "orders": cards,
-            "now_iso": timezone.now().isoformat(),
-        })
+            "next_cursor": next_cursor,
+            "q": q,
+            "now_iso": now.isoformat(),
+            "board_key": board_key,
+            **extra,
+        }), etag)
+
+
+# --- Tablero combinado: tarjetas + KPIs (out-of-band) de una sola pasada ---
+class BoardPartialView(OrdersCardsPartialView):
+    """
+    Mismo contrato que OrdersCardsPartialView (completo o delta), pero además
+    manda _kpis.html como swap out-of-band sobre #kpis, calculado sobre las
+    MISMAS tarjetas: un solo build_cards por poll y KPIs siempre coherentes.
+    """
+    etag_variant = "board"
+
+    def get_extra_context(self, cards):
+        return {"kpis_oob": True, **_kpis_context(cards)}
 
 
 # --- KPIs (parcial) ---
-@method_decorator(ensure_csrf_cookie, name='dispatch')
+@method_decorator([metrics.track_view, ensure_csrf_cookie], name='dispatch')
 class KpisPartialView(View):
     template_name = "board/_kpis.html"
 
     def get(self, request):
         q, view_mode, date_from = _extract_filters(request)
         cards = build_cards(date_from=date_from, search=q, view_mode=view_mode, limit=None)
-        kpis = [
-            {"label": "Pendientes",  "value": sum(1 for c in cards if c["status"] == "PENDIENTE")},
-            {"label": "Surtidos",    "value": sum(1 for c in cards if c["status"] == "SURTIDO")},
-            {"label": "Finalizados", "value": sum(1 for c in cards if c["status"] == "FINALIZADO")},
-        ]
-        return render(request, self.template_name, {
-            "kpis": kpis,
-            "last_update": timezone.localtime().strftime("%d/%m/%Y %H:%M"),
+        etag = quote_etag(delta.board_etag(delta.board_key(view_mode, q, date_from), cards, _etag_variant("kpis", cards)))
+        not_modified = _not_modified(request, etag)
+        if not_modified is not None:
+            return not_modified
+        return _with_etag(render(request, self.template_name, _kpis_context(cards)), etag)
+
+
+# --- Typeahead de búsqueda (solo índice local, nunca el ERP) ---
+@method_decorator(metrics.track_view, name='dispatch')
+class SearchSuggestView(View):
+    template_name = "board/_search_suggest.html"
+
+    def get(self, request):
+        q = request.GET.get("q", "").strip()
+        suggestions = search_index.suggest(q) if len(q) >= 2 and conf.get("SEARCH_INDEX") else []
+        return render(request, self.template_name, {"suggestions": suggestions})
+
+
+# --- Contadores del cache de snapshots ERP (monitoreo) ---
+class CacheStatsView(View):
+    def get(self, request):
+        return JsonResponse({
+            **snapshot_stats(),
+            "erp_breaker": erp_breaker.status(),
+            "erp_gateway": erp_service.gateway_stats(),
         })
 
 
+# --- Lag del espejo local del ERP (503 si está atrasado, para alertas) ---
+class MirrorStatusView(View):
+    def get(self, request):
+        status = mirror_status()
+        return JsonResponse(status, status=200 if status["healthy"] else 503)
+
+
+# --- Reportes de finalización / errores (leen los resúmenes, no las órdenes) ---
+@method_decorator(metrics.track_view, name="dispatch")
+class ReportsView(View):
+    """
+    ?date_from=YYYY-MM-DD&date_to=YYYY-MM-DD (default últimos 30 días)
+    &by=fecha,almacen,vendedor (dimensiones de finalización) &errors_by_day=1
+    """
+    def get(self, request):
+        try:
+            date_from = parse_date(request.GET.get("date_from") or "")
+            date_to = parse_date(request.GET.get("date_to") or "")
+        except ValueError:
+            return HttpResponseBadRequest("Fecha inválida")
+        by = [d.strip() for d in (request.GET.get("by") or "fecha,almacen").split(",")]
+        return JsonResponse({
+            "finalizacion": rollup.finalization_report(date_from, date_to, by=by),
+            "errores": rollup.error_report(date_from, date_to, by_day=request.GET.get("errors_by_day") == "1"),
+        })
+
+
+# --- Métricas en formato Prometheus (sesión o token Bearer para el scraper) ---
+class MetricsView(View):
+    def get(self, request):
+        token = conf.get("METRICS_TOKEN")
+        bearer = request.headers.get("Authorization", "")
+        if not request.user.is_authenticated and not (token and bearer == f"Bearer {token}"):
+            return HttpResponse("No autorizado", status=401)
+
+        cache = snapshot_stats()
+        gauges = {
+            f"board_snapshot_{name}": (f"Contador compartido del cache de snapshots: {name}.", value)
+            for name, value in cache.items() if not name.endswith("_ratio")
+        }
+        breaker_state = erp_breaker.status()
+        gauges["board_erp_breaker_open"] = (
+            "1 si el circuito del ERP está abierto o medio abierto.", int(breaker_state["state"] != "closed"),
+        )
+        gateway = erp_service.gateway_stats()
+        gauges["board_erp_gateway_in_flight"] = ("Queries al ERP en curso (todos los workers).", gateway["in_flight"])
+        return HttpResponse(metrics.export(gauges), content_type="text/plain; version=0.0.4; charset=utf-8")
+
+
 # --- Toggle de finalizado (UI-only, sin tocar ERP) ---
-@method_decorator(require_POST, name='dispatch')
+@method_decorator(metrics.track_view, name='dispatch')
 class OrderCompleteView(View):
     """
     Toggle:
@@ -129,100 +324,267 @@ class OrderCompleteView(View):
       - Si estaba PENDIENTE/SURTIDO (UI/ERP) -> FINALIZADO (UI)
     Devuelve el parcial según 'context':
       - context=card   -> _card.html (una sola tarjeta)
-      - context=detail -> _order_detail.html (contenido del modal)
+      - context=detail -> _order_detail.html (contenido del modal; orden y
+        partidas se piden a la vez)
+    Async; solo POST (View contesta 405 al resto).
+    Con 'version' (la de la tarjeta que vio el cliente): si otro ya la cambió,
+    no se toca nada y se contesta 409 con el parcial del estado actual.
     """
-    def post(self, request, pk):
+    async def post(self, request, pk):
         context = request.POST.get("context")
+        if context not in ("card", "detail"):
+            return HttpResponseBadRequest("Missing or invalid 'context'")
+
+        # La fila del ERP da almacén / vendedor a los resúmenes y luego arma la
+        # tarjeta sin un segundo query
+        row = await afetch_row(pk)
+
+        def toggle(ui):
+            if ui.is_finalizado:
+                ui.is_finalizado = False
+                ui.fecha_finalizacion = None
+            else:
+                ui.is_finalizado = True
+                ui.fecha_finalizacion = timezone.now()
+                rollup.set_dimensions(ui, row)
+
+        status = 200
+        try:
+            ui, _ = await sync_to_async(rollup.update_ui)(pk, toggle, _posted_version(request))
+        except rollup.VersionConflict as conflict:
+            ui, status = conflict.ui, 409
+        else:
+            await sync_to_async(events.publish, thread_sensitive=False)()
 
-        ui, _ = OrdenUIState.objects.get_or_create(doc_id=pk)
-        if ui.is_finalizado:
-            ui.is_finalizado = False
-            ui.fecha_finalizacion = None
+        if context == "card":
+            orden = await abuild_card(pk, ui=ui, row=row)
+            response = await arender(request, "board/_card.html", {"o": orden}, status=status)
         else:
-            ui.is_finalizado = True
-            ui.fecha_finalizacion = timezone.now()
-        ui.save()
+            orden, items = await awith_items(pk, abuild_card(pk, ui=ui, row=row))
+            response = await arender(request, "board/_order_detail.html", {"orden": orden, "items": items}, status=status)
+        response["HX-Trigger"] = "refreshKpis"
+        return response
 
-        # Recalcular con los filtros actuales para mantener coherencia
-        q, view_mode, date_from = _extract_filters(request)
-        cards = build_cards(date_from=date_from, search=q, view_mode=view_mode, limit=None)
-        orden = next((c for c in cards if c["pk"] == pk), None)
-        items = get_order_items(pk)
 
-        if context == "card":
-            response = render(request, "board/_card.html", {"o": orden})
-            response["HX-Trigger"] = "refreshKpis"
-            return response
-        elif context == "detail":
-            response = render(request, "board/_order_detail.html", {"orden": orden, "items": items})
-            response["HX-Trigger"] = "refreshKpis"
-            return response
+def _posted_version(request):
+    """'version' del POST (la que el cliente vio) o None si no la mandó."""
+    raw = (request.POST.get("version") or "").strip()
+    return int(raw) if raw.isdigit() else None
 
-        return HttpResponseBadRequest("Missing or invalid 'context'")
+
+# --- Exportación del historial de finalizadas (CSV en streaming / XLSX armado en disco) ---
+@method_decorator(metrics.track_view, name="dispatch")
+class OrdersExportView(View):
+    """
+    ?date_from=YYYY-MM-DD&date_to=YYYY-MM-DD (por fecha de finalización,
+    incluyentes; default últimos 30 días) &q=... &format=csv|xlsx
+    CSV: el encabezado sale antes de cualquier query y luego un bloque de
+    EXPORT_CHUNK órdenes a la vez. XLSX no es streaming: el libro completo se
+    arma en un archivo temporal (write_only, memoria acotada) y recién entonces
+    sale el primer byte; requiere openpyxl.
+    """
+    def get(self, request):
+        fmt = request.GET.get("format", "csv")
+        if fmt not in ("csv", "xlsx"):
+            return HttpResponseBadRequest("Missing or invalid 'format'")
+        try:
+            date_from, date_to = export.date_range(
+                parse_date(request.GET.get("date_from") or ""), parse_date(request.GET.get("date_to") or ""),
+            )
+        except ValueError as exc:
+            return HttpResponseBadRequest(str(exc))
+        rows = export.iter_rows(date_from, date_to, search=request.GET.get("q", "").strip() or None)
+        filename = f"pedidos_finalizados_{date_from:%Y%m%d}_{date_to:%Y%m%d}.{fmt}"
+
+        if fmt == "csv":
+            response = metrics.stream_response(
+                request, export.iter_csv(rows), "text/csv; charset=utf-8", fallback="orders-export",
+            )
+        else:
+            if not export.xlsx_available():
+                return HttpResponse("Exportar a XLSX requiere openpyxl; usa format=csv.", status=501)
+            workbook = tempfile.TemporaryFile()
+            export.write_xlsx(rows, workbook)
+            workbook.seek(0)
+            response = FileResponse(
+                workbook, content_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+            )
+        response["Content-Disposition"] = f'attachment; filename="{filename}"'
+        return response
+
+
+# --- Finalizar / reabrir varias órdenes (multi-selección del tablero) ---
+@method_decorator(metrics.track_view, name="dispatch")
+class OrdersBulkCompleteView(View):
+    """
+    POST ids=1,2,3 (o ids repetido) + action=finalize|reopen + filtros del
+    toolbar. Una lectura al ERP, una transacción con un solo bulk_update
+    (rollup.update_many) y una respuesta solo con swaps out-of-band: las
+    tarjetas afectadas y los KPIs del tablero actual.
+    """
+    template_name = "board/_cards_bulk.html"
+
+    def post(self, request):
+        action = request.POST.get("action")
+        if action not in ("finalize", "reopen"):
+            return HttpResponseBadRequest("Missing or invalid 'action'")
+        doc_ids = _parse_ids(request.POST.getlist("ids"))[:conf.get("BULK_MAX_ORDERS")]
+        if not doc_ids:
+            return HttpResponseBadRequest("Missing 'ids'")
+
+        # La fila del ERP da almacén / vendedor a los resúmenes y arma la tarjeta de respuesta
+        rows = {r["doc_id"]: r for r in orders_source()(doc_ids=doc_ids)}
+        finalize = action == "finalize"
+        now = timezone.now()
+
+        def change(ui):
+            row = rows[ui.doc_id]
+            # Igual que el botón de la tarjeta: nada que hacer o PENDIENTE (sin botón) no cambian
+            if ui.is_finalizado == finalize or (finalize and row["status_erp"] == "PENDIENTE"):
+                return False
+            ui.is_finalizado = finalize
+            ui.fecha_finalizacion = now if finalize else None
+            if finalize:
+                rollup.set_dimensions(ui, row)
+
+        states, saved = rollup.update_many(
+            [d for d in doc_ids if d in rows], change, ["is_finalizado", "fecha_finalizacion", "almacen", "vendedor"],
+        )
+        if saved:
+            events.publish()
+
+        q, view_mode, date_from = _extract_filters(request, request.POST)
+        board, _ = _board_cards(q, view_mode, date_from)
+        response = render(request, self.template_name, {
+            "cards": make_cards([rows[d] for d in saved], states),
+            "kpis_oob": True,
+            **_kpis_context(board),
+        })
+        # Todo viaja como out-of-band; el destino del botón no se toca
+        response["HX-Reswap"] = "none"
+        response["HX-Trigger"] = "bulkDone"
+        return response
 
 
-@method_decorator(login_required, name="dispatch")
+@method_decorator(metrics.track_view, name="dispatch")
 class OrderPrintView(View):
     """
     Página imprimible de un pedido (formato A4).
     No depende de _extract_filters; busca directamente por doc_id en ERP.
+    Async: pedido, partidas y OrdenUIState se piden a la vez.
     """
     template_name = "board/order_print.html"
 
-    def get(self, request, pk):
-        # Traer la orden por doc_id directamente del ERP
-        rows = erp_service.fetch_orders(
-            date_from=None,
-            date_to=None,
-            search=None,
-            limit=None,
-            doc_ids=[pk],
+    async def get(self, request, pk):
+        # Traer la orden por doc_id directamente del ERP y, en paralelo,
+        # el estado local de UI para fechas de creación/finalización "reales" de la app
+        row, items, ui = await awith_items(
+            pk,
+            afetch_row(pk, source=erp_service.fetch_orders),
+            archive.aget_ui(pk, "first_seen_at", "fecha_finalizacion"),
         )
 
-        if not rows:
+        if row is None:
             return HttpResponseNotFound("No se encontró el pedido para impresión.")
 
-        row = rows[0]
-        # Normalizar a las claves que ya usan tus templates
-        orden = {
-            "pk": row.get("doc_id"),
-            "folio": row.get("folio"),
-            "cliente": row.get("cliente"),
-            "fecha_creacion": row.get("fecha_creacion"),
-            "fecha_entrega": row.get("fecha_entrega"),
-            "vendedor": row.get("vendedor"),
-            "almacen": row.get("almacen_calc") or row.get("almacen"),
-            "status": row.get("status_erp"),
-            "observ": row.get("observ"),
-            "referencia": row.get("referencia"),
-            "metodo_entrega": row.get("metodo_entrega"),
-            "total_u": row.get("total_u"),
-            "pend_u": row.get("pend_u"),
-            # Los siguientes son opcionales; si tu context original los agrega vía UI state,
-            # aquí simplemente quedan ausentes (el template los trata como opcionales).
-            "is_finalizado": row.get("is_finalizado"),
-            "has_error": row.get("has_error"),
-            "fecha_finalizacion": row.get("fecha_finalizacion"),
-        }
+        orden = _print_orden(row, ui)
+        ctx = {"orden": orden, "items": _sort_print_items(items)}
+        return await arender(request, self.template_name, ctx)
 
-        # Buscar estado local de UI para fechas de creación/finalización "reales" de la app
-        ui = OrdenUIState.objects.filter(doc_id=str(pk)).only("first_seen_at", "fecha_finalizacion").first()
-        if ui:
-            # Sobrescribimos con el origen solicitado
-            orden["fecha_creacion"] = ui.first_seen_at
-            orden["fecha_finalizacion"] = ui.fecha_finalizacion
 
-        items = get_order_items(pk)
-        # Ordenar primero por almacen (numérico) y luego por código alfabéticamente
-        def parse_almacen(val):
-            try:
-                return int(val)
-            except Exception:
-                return 999999  # por si viene texto o nulo
+@method_decorator([metrics.track_view, login_required], name="dispatch")
+class OrderBulkPrintView(View):
+    """
+    Varias órdenes en un solo documento imprimible (una página A4 por orden).
+    Acepta:
+      - ids=1,2,3 (o ids repetido), o
+      - los filtros del tablero (view, q, date_from) + opcional almacen / status;
+        con view=pasados recorre todo el historial, no solo la primera página.
+    Se envía en streaming: bloques de PRINT_STREAM_CHUNK órdenes (1 query de
+    pedidos, 1 de partidas no cacheadas y 1 de OrdenUIState por bloque), así la
+    memoria no depende de cuántas órdenes se impriman.
+    """
+    template_name = "board/order_print_bulk.html"
 
-        items_sorted = sorted(
-            items,
-            key=lambda x: (parse_almacen(x.get("almacen")), str(x.get("codigo") or ""))
+    def _doc_ids(self, request):
+        ids = _parse_ids(request.GET.getlist("ids"))
+        if ids:
+            return ids[:conf.get("PRINT_MAX_ORDERS")]
+        q, view_mode, date_from = _extract_filters(request)
+        almacen = request.GET.get("almacen")
+        status = request.GET.get("status")
+        if view_mode == "pasados":
+            cards = iter_past_cards(search=q)
+        else:
+            cards = build_cards(date_from=date_from, search=q, view_mode=view_mode, limit=None)
+        selected = (
+            c["pk"] for c in cards
+            if (not almacen or str(c["almacen"]) == almacen) and (not status or c["status"] == status)
         )
-        ctx = {"orden": orden, "items": items_sorted}
-        return render(request, self.template_name, ctx)
\ No newline at end of file
+        return list(islice(selected, conf.get("PRINT_MAX_ORDERS")))
+
+    def get(self, request):
+        doc_ids = self._doc_ids(request)
+        size = conf.get("PRINT_STREAM_CHUNK")
+        chunks = (doc_ids[i:i + size] for i in range(0, len(doc_ids), size))
+        pages = (page for chunk in chunks for page in _print_pages(chunk))
+
+        # La primera página se arma antes de responder: sin pedidos todavía se puede dar 404
+        first = next(pages, None)
+        if first is None:
+            return HttpResponseNotFound("No hay pedidos para imprimir con esos filtros.")
+        return stream_render(request, self.template_name, chain([first], pages), {"total": len(doc_ids)})
+
+
+def _print_pages(doc_ids):
+    """{orden, items} de cada doc_id del bloque, en el orden pedido."""
+    rows = {r["doc_id"]: r for r in erp_service.fetch_orders(doc_ids=doc_ids)}
+    uis = archive.ui_states(list(rows), only=("doc_id", "first_seen_at", "fecha_finalizacion"))
+    items = cached_fetch_items(list(rows), {d: r.get("pend_u") for d, r in rows.items()})
+    for doc_id in doc_ids:
+        row = rows.get(doc_id)
+        if row is not None:
+            yield {"orden": _print_orden(row, uis.get(doc_id)), "items": _sort_print_items(items.get(doc_id, []))}
+
+
+def _print_orden(row, ui=None):
+    # Normalizar a las claves que ya usan tus templates
+    orden = {
+        "pk": row.get("doc_id"),
+        "folio": row.get("folio"),
+        "cliente": row.get("cliente"),
+        "fecha_creacion": row.get("fecha_creacion"),
+        "fecha_entrega": row.get("fecha_entrega"),
+        "vendedor": row.get("vendedor"),
+        "almacen": row.get("almacen_calc") or row.get("almacen"),
+        "status": row.get("status_erp"),
+        "observ": row.get("observ"),
+        "referencia": row.get("referencia"),
+        "metodo_entrega": row.get("metodo_entrega"),
+        "total_u": row.get("total_u"),
+        "pend_u": row.get("pend_u"),
+        # Los siguientes son opcionales; si tu context original los agrega vía UI state,
+        # aquí simplemente quedan ausentes (el template los trata como opcionales).
+        "is_finalizado": row.get("is_finalizado"),
+        "has_error": row.get("has_error"),
+        "fecha_finalizacion": row.get("fecha_finalizacion"),
+    }
+    if ui:
+        # Sobrescribimos con el origen solicitado
+        orden["fecha_creacion"] = ui.first_seen_at
+        orden["fecha_finalizacion"] = ui.fecha_finalizacion
+    return orden
+
+
+def _sort_print_items(items):
+    # Ordenar primero por almacen (numérico) y luego por código alfabéticamente
+    def parse_almacen(val):
+        try:
+            return int(val)
+        except Exception:
+            return 999999  # por si viene texto o nulo
+
+    return sorted(
+        items,
+        key=lambda x: (parse_almacen(x.get("almacen")), str(x.get("codigo") or ""))
+    )
@@ -1,51 +1,64 @@
+import asyncio
+
+from asgiref.sync import sync_to_async
 from django.views import View
-from django.shortcuts import render
 from django.utils.decorators import method_decorator
-from django.contrib.auth.decorators import login_required
 from django.http import HttpResponseForbidden
 
-from .models import OrdenUIState, EmpleadoResponsable
-from .services.orders import build_cards, get_order_items
-
-# Reutilizamos tu helper para mantener exactamente el mismo comportamiento de filtros
-from .views import _extract_filters
+from .models import EmpleadoResponsable
+from .services.orders import abuild_card
+from .services import events, metrics, rollup
+from .services.metrics import arender
+from .views import _aresponsables, _posted_version
 
 
-@method_decorator(login_required, name='dispatch')
+@method_decorator(metrics.track_view, name='dispatch')
 class OrderErrorToggleView(View):
     """
     Alterna has_error. Si se apaga, limpia responsable / resuelto / comentarios.
-    Devuelve solo el partial de controles (HTMX), como haces con el toggle de finalizar.
+    Devuelve solo el partial de controles (HTMX), como haces con el toggle de finalizar,
+    más los botones Reabrir/Finalizar del modal fuera de banda: el cambio sube
+    la versión y con la vieja el siguiente clic sería un 409.
+    Async: la tarjeta (ERP) y los responsables se piden a la vez. El cambio
+    pasa por rollup.update_ui (UPDATE condicionado a la versión + resumen de
+    errores); si la orden cambió desde la versión del cliente, 409 con los
+    controles actuales.
     """
     template_name = "board/_order_error_controls.html"
 
-    def post(self, request, pk):
-        ui, _ = OrdenUIState.objects.get_or_create(doc_id=pk)
-
-        # === Guard: solo permitir cuando la orden está FINALIZADA ===
-        if not ui.is_finalizado:
-            return HttpResponseForbidden("Solo se puede marcar error cuando la orden está FINALIZADA.")
-
-        ui.has_error = not ui.has_error
-        if not ui.has_error:
-            ui.error_responsable = None
-            ui.error_resuelto = False
-            ui.error_comentarios = ""
-        ui.save()
+    async def post(self, request, pk):
+        def toggle(ui):
+            # === Guard: solo permitir cuando la orden está FINALIZADA ===
+            if not ui.is_finalizado:
+                return False
+            ui.has_error = not ui.has_error
+            if not ui.has_error:
+                ui.error_responsable = None
+                ui.error_resuelto = False
+                ui.error_comentarios = ""
+
+        status = 200
+        try:
+            ui, saved = await sync_to_async(rollup.update_ui)(pk, toggle, _posted_version(request))
+        except rollup.VersionConflict as conflict:
+            ui, status = conflict.ui, 409
+        else:
+            if not saved:
+                return HttpResponseForbidden("Solo se puede marcar error cuando la orden está FINALIZADA.")
+            await sync_to_async(events.publish, thread_sensitive=False)()
 
-        # Recalcula tarjetas para mantener coherencia (igual que tu flujo actual)
-        q, view_mode, date_from = _extract_filters(request)
-        cards = build_cards(date_from=date_from, search=q, view_mode=view_mode, limit=None)
-        orden = next((c for c in cards if c["pk"] == pk), None)
-        # items queda intacto; no lo necesitamos para este partial
+        # Solo esta orden (un query al ERP por doc_id); items queda intacto,
+        # no lo necesitamos para este partial
+        orden, responsables = await asyncio.gather(abuild_card(pk, ui=ui), _aresponsables())
 
-        return render(request, self.template_name, {
+        return await arender(request, self.template_name, {
             "orden": orden,
-            "responsables": EmpleadoResponsable.objects.filter(activo=True).order_by("nombre"),
-        })
+            "responsables": responsables,
+            "actions_oob": True,
+        }, status=status)
 
 
-@method_decorator(login_required, name='dispatch')
+@method_decorator(metrics.track_view, name='dispatch')
 class OrderErrorSaveView(View):
     """
     Guarda los detalles del error:
@@ -53,39 +66,43 @@ class OrderErrorSaveView(View):
     - error_resuelto (checkbox)
     - comentarios (texto)
     Siempre deja has_error en True (porque es un 'guardar' del bloque activo).
+    Async, como el toggle (también re-renderiza los botones del modal).
     """
     template_name = "board/_order_error_controls.html"
 
-    def post(self, request, pk):
-        ui, _ = OrdenUIState.objects.get_or_create(doc_id=pk)
-
-        # === Guard: solo permitir cuando la orden está FINALIZADA ===
-        if not ui.is_finalizado:
-            return HttpResponseForbidden("Solo se puede marcar error cuando la orden está FINALIZADA.")
-
-        ui.has_error = True
-
+    async def post(self, request, pk):
         # Responsable
         resp_id = (request.POST.get("error_responsable") or "").strip()
+        responsable = None
         if resp_id.isdigit():
-            ui.error_responsable = EmpleadoResponsable.objects.filter(id=int(resp_id), activo=True).first()
+            responsable = await EmpleadoResponsable.objects.filter(id=int(resp_id), activo=True).afirst()
+
+        def save(ui):
+            # === Guard: solo permitir cuando la orden está FINALIZADA ===
+            if not ui.is_finalizado:
+                return False
+            ui.has_error = True
+            ui.error_responsable = responsable
+            # ¿Se solucionó?
+            ui.error_resuelto = (request.POST.get("error_resuelto") == "on")
+            # Comentarios
+            ui.error_comentarios = (request.POST.get("error_comentarios") or "").strip()
+
+        status = 200
+        try:
+            ui, saved = await sync_to_async(rollup.update_ui)(pk, save, _posted_version(request))
+        except rollup.VersionConflict as conflict:
+            ui, status = conflict.ui, 409
         else:
-            ui.error_responsable = None
-
-        # ¿Se solucionó?
-        ui.error_resuelto = (request.POST.get("error_resuelto") == "on")
-
-        # Comentarios
-        ui.error_comentarios = (request.POST.get("error_comentarios") or "").strip()
-
-        ui.save()
+            if not saved:
+                return HttpResponseForbidden("Solo se puede marcar error cuando la orden está FINALIZADA.")
+            await sync_to_async(events.publish, thread_sensitive=False)()
 
-        # Recalcula tarjetas para mantener coherencia (igual que tu flujo actual)
-        q, view_mode, date_from = _extract_filters(request)
-        cards = build_cards(date_from=date_from, search=q, view_mode=view_mode, limit=None)
-        orden = next((c for c in cards if c["pk"] == pk), None)
+        # Solo esta orden (un query al ERP por doc_id)
+        orden, responsables = await asyncio.gather(abuild_card(pk, ui=ui), _aresponsables())
 
-        return render(request, self.template_name, {
+        return await arender(request, self.template_name, {
             "orden": orden,
-            "responsables": EmpleadoResponsable.objects.filter(activo=True).order_by("nombre"),
-        })
+            "responsables": responsables,
+            "actions_oob": True,
+        }, status=status)
@@ -0,0 +1,39 @@
+import asyncio
+
+from django.http import StreamingHttpResponse
+from django.views import View
+
+from . import conf
+from .services.events import broadcaster
+
+
+class BoardEventsView(View):
+    """
+    Canal Server-Sent Events (async, pensado para servirse por planner/asgi.py).
+    Emite 'event: board' cada vez que alguien llama a events.publish(): cambió
+    el estado de alguna orden o un refresco de snapshot / la sync del espejo
+    trajo cambios del ERP. El aviso es el mismo para todos los tableros; cada
+    uno reacciona pidiendo su delta de tarjetas y KPIs con sus filtros.
+    """
+
+    async def get(self, request):
+        async def stream():
+            hub = broadcaster()
+            queue = hub.subscribe()
+            keepalive = conf.get("EVENTS_KEEPALIVE")
+            try:
+                yield "retry: 3000\n\n"
+                while True:
+                    try:
+                        version = await asyncio.wait_for(queue.get(), keepalive)
+                    except asyncio.TimeoutError:
+                        yield ": keepalive\n\n"
+                        continue
+                    yield f"event: board\ndata: {version}\n\n"
+            finally:
+                hub.unsubscribe(queue)
+
+        response = StreamingHttpResponse(stream(), content_type="text/event-stream")
+        response["Cache-Control"] = "no-cache"
+        response["X-Accel-Buffering"] = "no"  # nginx: no bufferizar el stream
+        return response
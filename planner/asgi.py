@@ -3,6 +3,11 @@ ASGI config for planner project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
 
+El tablero usa este punto de entrada para el canal SSE (board/events/) y
+para sus vistas async (detalle, impresión, toggles), que piden ERP y DB
+local a la vez; servirlo con un servidor ASGI, p. ej.:
+    uvicorn planner.asgi:application
+
 For more information on this file, see
 https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
 """